@@ -2,8 +2,8 @@
 Common fixtures
 """
 import os
-import shutil
 from pathlib import Path
+import shutil
 from unittest.mock import patch
 
 from pytest import fixture
@@ -80,7 +80,6 @@ def storagie(my_project: Path):
     ret = storage.HomeDirectoryStorage.from_path(my_project)
 
     assert ret.script_path == my_project
-    normaled = storage._normalize_path(my_project, ".json")
-    assert (storage.HACENADA_HOME / f"{normaled}").exists()
+    assert storage.session_path(my_project, ".json").exists()
 
     yield ret
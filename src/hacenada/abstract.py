@@ -1,8 +1,9 @@
 """
 Abstract types
 """
-import typing
 from abc import ABC, abstractmethod
+import contextlib
+import typing
 
 from hacenada.const import STR_DICT
 
@@ -31,6 +32,24 @@ class SessionStorage(ABC):
         Concrete method, implementing this is optional
         """
 
+    @property
+    def encoding(self) -> str:
+        """
+        The encoding used for this storage and its machine-readable log
+
+        Concrete method, implementing this is optional
+        """
+        return "json"
+
+    def lock(self) -> typing.ContextManager:
+        """
+        Hold the lock on this session while the block runs, so no other hacenada
+        changes it
+
+        Concrete method, implementing this is optional
+        """
+        return contextlib.nullcontext()
+
     @property  # type: ignore
     @abstractmethod
     def description(self):
@@ -51,6 +70,70 @@ class SessionStorage(ABC):
         Save a single answer
         """
 
+    def skip_step(self, label: str):
+        """
+        Record that the step with this label was skipped, rather than answered
+
+        Concrete method, implementing this is optional
+        """
+        self.save_answer({label: None})
+
+    def save_cached(self, label: str, value: typing.Any):
+        """
+        Record an answer that was remembered from an earlier run, rather than given
+
+        Concrete method, implementing this is optional
+        """
+        self.save_answer({label: value})
+
+    def forget_answer(self, label: str):
+        """
+        Delete the answer with this label, so the step will be asked again
+
+        Concrete method, implementing this is optional
+        """
+
+    def relabel_answers(self, relabel: typing.Dict[str, str]):
+        """
+        Move answers from old labels to new labels, all at once (labels may be swapped)
+
+        Concrete method, implementing this is optional
+        """
+
+    def checkpoint(self):
+        """
+        Mark the answers as they are now as a point undo() can go back to
+
+        Concrete method, implementing this is optional
+        """
+
+    def undo(self) -> typing.Optional[typing.List[str]]:
+        """
+        Put the answers back as they were at the last checkpoint, returning the
+        labels put back
+
+        None means there is nothing to undo. Concrete method, implementing this is
+        optional
+        """
+        return None
+
+    @property
+    def step_digests(self) -> typing.Dict[str, str]:
+        """
+        The step digests of the script as it was when the answers were last saved
+
+        Concrete method, implementing this is optional
+        """
+        return {}
+
+    @step_digests.setter
+    def step_digests(self, value: typing.Dict[str, str]):
+        """
+        Remember the step digests of the script
+
+        Concrete method, implementing this is optional
+        """
+
     @abstractmethod
     def update_meta(self, **kw):
         """
@@ -81,3 +164,92 @@ class Render(ABC):
         """
         Output a question to a device, should return a 0-item label:value dict
         """
+
+    def render_waits(self, steps, context) -> STR_DICT:
+        """
+        Wait for the checks of wait steps, all at once, returning a label:value dict
+
+        Concrete method, implementing this is optional
+        """
+        from hacenada import wait
+
+        return wait.render_waits(steps, context)
+
+
+class AsyncRender(ABC):
+    """
+    Rendering operations for question types, from an event loop (e.g. a chat bot)
+    """
+
+    @abstractmethod
+    async def render(self, step, context) -> STR_DICT:
+        """
+        Ask a question and wait for the answer, returning a 1-item label:value dict
+        """
+
+    async def render_waits(self, steps, context) -> STR_DICT:
+        """
+        Wait for the checks of wait steps, all at once, returning a label:value dict
+
+        Concrete method, implementing this is optional
+        """
+        from hacenada import wait
+
+        return await wait.answer_waits(steps)
+
+
+class AsyncSessionStorage(ABC):
+    """
+    Session storage used from an event loop
+
+    The session works on a copy in memory, loaded once, and saved after each
+    change, so the storage may take as long as it likes without holding up
+    other sessions.
+    """
+
+    @abstractmethod
+    async def load(self) -> STR_DICT:
+        """
+        The session's data: a dict of meta (a dict) and answer (a list of answers)
+        """
+
+    @abstractmethod
+    async def save(self, data: STR_DICT):
+        """
+        Save the session's data, in the same shape load() returns
+        """
+
+    async def checkpoint(self):
+        """
+        Mark the saved answers as a point undo can go back to; see
+        SessionStorage.checkpoint()
+
+        Concrete method, implementing this is optional
+        """
+
+    async def finish(self, script):
+        """
+        The script is finished: keep the logs of the session, and remove it, as
+        `hacenada next` does at the end of a script
+
+        Concrete method, implementing this is optional
+        """
+
+
+class AuditSink(ABC):
+    """
+    A destination for audit events, each one a line of json
+    """
+
+    @abstractmethod
+    def write(self, lines: typing.List[str]):
+        """
+        Deliver a batch of lines, each ending in a newline
+        """
+
+    def close(self):
+        """
+        Release whatever the sink holds open
+
+        Concrete method, implementing this is optional
+        """
@@ -0,0 +1,215 @@
+"""
+Stream audit events of a session (steps shown, answered, skipped) to a sink
+
+Events are json lines, queued in memory and written by a background thread in
+batches, so a slow or unavailable sink never holds up the operator's prompt.
+When the queue is full, events are dropped and counted rather than waited for.
+
+Sinks are named like urls:
+
+    file:/var/log/hacenada/audit.jsonl    append to a file
+    unix:/run/audit.sock                  send to a unix stream socket
+    syslog: or syslog:IDENT               the local syslog, as IDENT (default hacenada)
+
+A MemorySink, which keeps events for tests, has no name: events sent to it would
+be lost when the command exits.
+"""
+from __future__ import annotations
+
+import getpass
+import json
+from pathlib import Path
+import queue
+import socket
+import threading
+import typing
+
+import attr
+
+from hacenada.abstract import AuditSink
+from hacenada.const import STR_DICT
+
+
+# events waiting to be written; more than this and new events are dropped
+QUEUE_SIZE = 1000
+
+# the most events written at once
+BATCH_SIZE = 100
+
+# how long to wait at exit for queued events to be written
+CLOSE_TIMEOUT = 2.0
+
+# answer values longer than this are cut short in events
+MAX_VALUE = 1024
+
+_STOP = object()
+
+
+@attr.s(auto_attribs=True)
+class FileSink(AuditSink):
+    """
+    Append events to a file, one write per batch
+    """
+
+    path: Path
+
+    def write(self, lines: typing.List[str]):
+        with Path(self.path).open("a") as f:
+            f.write("".join(lines))
+
+
+@attr.s(auto_attribs=True)
+class UnixSocketSink(AuditSink):
+    """
+    Send events to a unix stream socket, reconnecting after a failure
+    """
+
+    path: Path
+    _sock: typing.Optional[socket.socket] = None
+
+    def write(self, lines: typing.List[str]):
+        try:
+            if self._sock is None:
+                self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._sock.connect(str(self.path))
+            self._sock.sendall("".join(lines).encode("utf-8"))
+        except OSError:
+            self.close()
+            raise
+
+    def close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+
+@attr.s(auto_attribs=True)
+class SyslogSink(AuditSink):
+    """
+    Log events to the local syslog, one message per event
+    """
+
+    ident: str = "hacenada"
+
+    def write(self, lines: typing.List[str]):
+        import syslog
+
+        syslog.openlog(self.ident, 0, syslog.LOG_USER)
+        for line in lines:
+            syslog.syslog(syslog.LOG_INFO, line.rstrip("\n"))
+
+
+@attr.s(auto_attribs=True)
+class MemorySink(AuditSink):
+    """
+    Keep events in memory; a stand-in for a real sink
+    """
+
+    lines: typing.List[str] = attr.Factory(list)
+    batches: int = 0
+
+    def write(self, lines: typing.List[str]):
+        self.lines.extend(lines)
+        self.batches += 1
+
+    @property
+    def events(self) -> typing.List[STR_DICT]:
+        return [json.loads(line) for line in self.lines]
+
+
+def open_sink(name: str) -> AuditSink:
+    """
+    The sink called name (see the module docstring); ValueError if there isn't one
+    """
+    kind, _, where = name.partition(":")
+    if kind == "file" and where:
+        return FileSink(Path(where))
+    if kind == "unix" and where:
+        return UnixSocketSink(Path(where))
+    if kind == "syslog":
+        return SyslogSink(where or "hacenada")
+    raise ValueError(f"unknown audit sink {name!r} (use file:, unix: or syslog:)")
+
+
+def _shorten(value: typing.Any) -> typing.Any:
+    if isinstance(value, str) and len(value) > MAX_VALUE:
+        return value[:MAX_VALUE] + f"… ({len(value)} characters)"
+    return value
+
+
+@attr.s(auto_attribs=True)
+class AuditLog:
+    """
+    Queue events and write them to a sink from a background thread
+
+    fields are added to every event, e.g. the user and host.
+    """
+
+    sink: AuditSink
+    fields: STR_DICT = attr.Factory(dict)
+    queue_size: int = QUEUE_SIZE
+    batch_size: int = BATCH_SIZE
+    dropped: int = 0
+    failed: int = 0
+    _queue: queue.Queue = attr.ib(init=False, repr=False)
+    _thread: threading.Thread = attr.ib(init=False, repr=False)
+
+    def __attrs_post_init__(self):
+        self._queue = queue.Queue(self.queue_size)
+        self._thread = threading.Thread(
+            target=self._drain, name="hacenada-audit", daemon=True
+        )
+        self._thread.start()
+
+    @classmethod
+    def to(cls, name: str) -> AuditLog:
+        """
+        Constructor, for the sink called name, with the user and host in every event
+        """
+        fields = dict(user=getpass.getuser(), host=socket.gethostname())
+        return cls(sink=open_sink(name), fields=fields)
+
+    def emit(self, event: STR_DICT):
+        """
+        Queue an event, without waiting; if the queue is full, the event is dropped
+        """
+        event = dict(self.fields, **event)
+        if "value" in event:
+            event["value"] = _shorten(event["value"])
+        try:
+            self._queue.put_nowait(json.dumps(event, default=str) + "\n")
+        except queue.Full:
+            self.dropped += 1
+
+    def _drain(self):
+        """
+        Write queued events in batches until stopped
+        """
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            lines = [line for line in batch if line is not _STOP]
+            if lines:
+                try:
+                    self.sink.write(lines)
+                except Exception:
+                    self.failed += len(lines)
+            if len(lines) < len(batch):
+                return
+
+    def close(self, timeout: float = CLOSE_TIMEOUT):
+        """
+        Write what's queued, waiting at most timeout seconds, and close the sink
+        """
+        try:
+            self._queue.put(_STOP, timeout=timeout)
+        except queue.Full:
+            pass
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self.sink.close()
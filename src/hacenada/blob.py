@@ -0,0 +1,178 @@
+"""
+Content-addressed store for large answer values
+
+Values above a size threshold are stored once, compressed, under their sha256
+digest. Storage and machine-readable logs hold a small reference in place of
+the value, so the same large value costs its size once no matter how many
+sessions and logs it appears in.
+
+Files that may hold references ("referrers") are recorded as they are written.
+Collection scans the referrers that still exist for digests, and deletes blobs
+that none of them mention.
+"""
+from __future__ import annotations
+
+import hashlib
+import os
+from pathlib import Path
+import re
+import tempfile
+import time
+import typing
+import zipfile
+import zlib
+
+import attr
+
+
+# answer values larger than this many bytes (utf-8) are stored as blobs
+BLOB_THRESHOLD = 4096
+
+# blobs newer than this are never collected, so a value saved a moment ago isn't
+# lost before the file referencing it is written
+GRACE_SECONDS = 3600
+
+REFERRERS = "referrers"
+
+_DIGEST_RX = re.compile(rb"[0-9a-f]{64}")
+
+
+class BlobRef(typing.TypedDict):
+    blob: str
+    size: int
+
+
+def is_ref(value: typing.Any) -> bool:
+    """
+    Is value a reference to a blob, rather than an answer value?
+
+    A reference has exactly the keys of BlobRef, with a sha256 digest, so an
+    answer that merely has a "blob" key isn't mistaken for one.
+    """
+    return (
+        isinstance(value, dict)
+        and value.keys() == BlobRef.__annotations__.keys()
+        and isinstance(value["blob"], str)
+        and _DIGEST_RX.fullmatch(value["blob"].encode()) is not None
+        and isinstance(value["size"], int)
+    )
+
+
+def _digests(data: bytes) -> typing.Set[str]:
+    return {m.decode() for m in _DIGEST_RX.findall(data)}
+
+
+def mentions(path: Path) -> typing.Set[str]:
+    """
+    The blob digests mentioned in a file, or in the files in a zip bundle
+    """
+    if path.suffix == ".zip":
+        with zipfile.ZipFile(path) as zf:
+            return set().union(*(_digests(zf.read(name)) for name in zf.namelist()))
+    return _digests(path.read_bytes())
+
+
+@attr.s(auto_attribs=True)
+class CollectStats:
+    """
+    What a collection did
+    """
+
+    kept: int = 0
+    deleted: int = 0
+    freed: int = 0
+
+
+@attr.s(auto_attribs=True)
+class BlobStore:
+    """
+    Compressed blobs in a directory, by digest
+    """
+
+    root: Path
+
+    def _path(self, digest: str) -> Path:
+        return self.root / digest[:2] / digest
+
+    def put(self, value: str) -> BlobRef:
+        """
+        Store value (once), returning the reference to it
+        """
+        data = value.encode("utf-8")
+        digest = hashlib.sha256(data).hexdigest()
+        path = self._path(digest)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+            with os.fdopen(fd, "wb") as f:
+                f.write(zlib.compress(data))
+            os.replace(tmp, path)
+        else:
+            # refresh, so a re-used blob gets the grace period again
+            os.utime(path)
+        return BlobRef(blob=digest, size=len(data))
+
+    def get(self, ref: BlobRef) -> str:
+        """
+        The value a reference stands for
+        """
+        return zlib.decompress(self._path(ref["blob"]).read_bytes()).decode("utf-8")
+
+    def resolve(self, value: typing.Any) -> typing.Any:
+        """
+        The value itself, whether value is a reference or not
+        """
+        if is_ref(value):
+            return self.get(value)
+        return value
+
+    def add_referrer(self, path: Path):
+        """
+        Record that the file at path may hold references
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        with (self.root / REFERRERS).open("a") as f:
+            f.write(f"{Path(path).absolute()}\n")
+
+    def move_referrer(self, old: Path, new: Path):
+        """
+        Record that a file that may hold references was moved from old to new
+        """
+        if Path(old).absolute() in self.referrers():
+            self.add_referrer(new)
+
+    def referrers(self) -> typing.List[Path]:
+        """
+        Every recorded referrer, without duplicates
+        """
+        recorded = self.root / REFERRERS
+        if not recorded.exists():
+            return []
+        lines = recorded.read_text().splitlines()
+        return [Path(line) for line in dict.fromkeys(lines) if line]
+
+    def collect(self, now: typing.Optional[float] = None) -> CollectStats:
+        """
+        Delete blobs that no existing referrer mentions
+
+        Referrers that no longer exist are forgotten.
+        """
+        now = time.time() if now is None else now
+        stats = CollectStats()
+        live = [p for p in self.referrers() if p.exists()]
+        mentioned: typing.Set[str] = set()
+        for path in live:
+            mentioned.update(mentions(path))
+
+        for path in self.root.glob("??/*"):
+            st = path.stat()
+            if path.name in mentioned or now - st.st_mtime < GRACE_SECONDS:
+                stats.kept += 1
+                continue
+            path.unlink()
+            stats.deleted += 1
+            stats.freed += st.st_size
+
+        if self.root.exists():
+            (self.root / REFERRERS).write_text("".join(f"{p}\n" for p in live))
+        return stats
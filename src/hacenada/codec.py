@@ -0,0 +1,235 @@
+"""
+Compact binary encoding for session storage and logs
+
+A compact file is a short header followed by length-prefixed records. Each
+record is a single tagged value:
+
+    N T F       None, True, False
+    i           signed 64-bit integer
+    f           64-bit float
+    s y         utf-8 string, bytes (32-bit length prefix)
+    l d         list, dict (32-bit item count prefix; dict keys are strings)
+    t           datetime, as integer microseconds since the epoch (UTC)
+
+Large strings are stored verbatim, so they cost no escaping to write and are
+sliced straight out of the buffer when read.
+"""
+import datetime
+import os
+import struct
+import typing
+
+from tinydb.storages import Storage, touch
+
+from hacenada.error import CodecError
+
+
+MAGIC = b"HCNB"
+VERSION = 1
+HEADER = MAGIC + bytes([VERSION])
+
+_LEN = struct.Struct("<I")
+_INT = struct.Struct("<q")
+_FLOAT = struct.Struct("<d")
+_EPOCH = datetime.datetime(1970, 1, 1, tzinfo=datetime.timezone.utc)
+
+# tags as integers, which is how indexing bytes returns them
+_S, _D, _L, _T, _I, _F, _Y = b"sdltify"
+_CONSTANTS = {ord("N"): None, ord("T"): True, ord("F"): False}
+
+
+def _encode(obj: typing.Any, out: typing.List[bytes]):
+    """
+    Append the tagged encoding of obj to the list of chunks in out
+    """
+    if obj is None:
+        out.append(b"N")
+    elif obj is True:
+        out.append(b"T")
+    elif obj is False:
+        out.append(b"F")
+    elif isinstance(obj, int):
+        try:
+            out.append(b"i" + _INT.pack(obj))
+        except struct.error:
+            raise CodecError(f"integer out of range: {obj}")
+    elif isinstance(obj, float):
+        out.append(b"f" + _FLOAT.pack(obj))
+    elif isinstance(obj, str):
+        raw = obj.encode("utf-8")
+        out.append(b"s" + _LEN.pack(len(raw)))
+        out.append(raw)
+    elif isinstance(obj, bytes):
+        out.append(b"y" + _LEN.pack(len(obj)))
+        out.append(obj)
+    elif isinstance(obj, datetime.datetime):
+        if obj.tzinfo is None:
+            # naive == local timezone, same as DateTimeSerializer
+            obj = obj.astimezone(datetime.timezone.utc)
+        micros = (obj - _EPOCH) // datetime.timedelta(microseconds=1)
+        out.append(b"t" + _INT.pack(micros))
+    elif isinstance(obj, (list, tuple)):
+        out.append(b"l" + _LEN.pack(len(obj)))
+        for item in obj:
+            _encode(item, out)
+    elif isinstance(obj, dict):
+        out.append(b"d" + _LEN.pack(len(obj)))
+        for k, v in obj.items():
+            raw = str(k).encode("utf-8")
+            out.append(_LEN.pack(len(raw)))
+            out.append(raw)
+            _encode(v, out)
+    else:
+        raise CodecError(f"can't encode {obj!r}")
+
+
+def _decode(buf: bytes, pos: int) -> typing.Tuple[typing.Any, int]:
+    """
+    Decode one tagged value from buf at pos, returning the value and the next position
+    """
+    tag = buf[pos]
+    pos += 1
+    if tag == _S:
+        (n,) = _LEN.unpack_from(buf, pos)
+        start, pos = pos + 4, pos + 4 + n
+        return buf[start:pos].decode("utf-8"), pos
+    if tag == _D:
+        (n,) = _LEN.unpack_from(buf, pos)
+        pos += 4
+        ret = {}
+        for _ in range(n):
+            (klen,) = _LEN.unpack_from(buf, pos)
+            start, pos = pos + 4, pos + 4 + klen
+            key = buf[start:pos].decode("utf-8")
+            ret[key], pos = _decode(buf, pos)
+        return ret, pos
+    if tag == _L:
+        (n,) = _LEN.unpack_from(buf, pos)
+        pos += 4
+        items = []
+        for _ in range(n):
+            item, pos = _decode(buf, pos)
+            items.append(item)
+        return items, pos
+    if tag == _T:
+        (micros,) = _INT.unpack_from(buf, pos)
+        return _EPOCH + datetime.timedelta(microseconds=micros), pos + 8
+    if tag == _I:
+        return _INT.unpack_from(buf, pos)[0], pos + 8
+    if tag == _F:
+        return _FLOAT.unpack_from(buf, pos)[0], pos + 8
+    if tag == _Y:
+        (n,) = _LEN.unpack_from(buf, pos)
+        start, pos = pos + 4, pos + 4 + n
+        return bytes(buf[start:pos]), pos
+    if tag in _CONSTANTS:
+        return _CONSTANTS[tag], pos
+    raise CodecError(f"unknown tag {chr(tag)!r} at offset {pos - 1}")
+
+
+def dumps(obj: typing.Any) -> bytes:
+    """
+    Encode a single value
+    """
+    out: typing.List[bytes] = []
+    _encode(obj, out)
+    return b"".join(out)
+
+
+def loads(data: bytes) -> typing.Any:
+    """
+    Decode a single value
+    """
+    try:
+        ret, _ = _decode(data, 0)
+    except (struct.error, UnicodeDecodeError, IndexError) as e:
+        raise CodecError(f"corrupt value: {e}")
+    return ret
+
+
+def dump_records(records: typing.Iterable[typing.Any]) -> bytes:
+    """
+    Encode an iterable of values as a complete compact file, header included
+    """
+    out = [HEADER]
+    for record in records:
+        payload = dumps(record)
+        out.append(_LEN.pack(len(payload)))
+        out.append(payload)
+    return b"".join(out)
+
+
+def load_records(data: bytes) -> typing.Iterator[typing.Any]:
+    """
+    Decode the records of a complete compact file, one at a time
+    """
+    if not is_compact(data):
+        raise CodecError("not a compact file (bad header)")
+
+    pos = len(HEADER)
+    while pos < len(data):
+        if pos + 4 > len(data):
+            raise CodecError(f"truncated record at offset {pos}")
+        (n,) = _LEN.unpack_from(data, pos)
+        pos += 4
+        if pos + n > len(data):
+            raise CodecError(f"truncated record at offset {pos - 4}")
+        try:
+            value, end = _decode(data, pos)
+        except (struct.error, UnicodeDecodeError, IndexError) as e:
+            raise CodecError(f"corrupt record at offset {pos - 4}: {e}")
+        if end != pos + n:
+            raise CodecError(f"record length mismatch at offset {pos - 4}")
+        yield value
+        pos = end
+
+
+def is_compact(data: bytes) -> bool:
+    """
+    Does this data start with the compact file header?
+    """
+    return data.startswith(HEADER)
+
+
+class CompactStorage(Storage):
+    """
+    A tinydb Storage that keeps the database in the compact binary format
+
+    Each document is one record of [table, doc_id, document]; an empty table is
+    kept as [table, None, None] so it survives a round trip.
+    """
+
+    def __init__(self, path: str, **kwargs):
+        super().__init__()
+        touch(path, create_dirs=False)
+        self._handle = open(path, mode="rb+")
+
+    def read(self) -> typing.Optional[typing.Dict[str, typing.Dict[str, typing.Any]]]:
+        self._handle.seek(0)
+        data = self._handle.read()
+        if not data:
+            return None
+
+        ret: typing.Dict[str, typing.Dict[str, typing.Any]] = {}
+        for table, doc_id, doc in load_records(data):
+            docs = ret.setdefault(table, {})
+            if doc_id is not None:
+                docs[doc_id] = doc
+        return ret
+
+    def write(self, data: typing.Dict[str, typing.Dict[str, typing.Any]]):
+        def _records():
+            for table, docs in data.items():
+                if not docs:
+                    yield [table, None, None]
+                for doc_id, doc in docs.items():
+                    yield [table, str(doc_id), doc]
+
+        self._handle.seek(0)
+        self._handle.write(dump_records(_records()))
+        self._handle.flush()
+        os.fsync(self._handle.fileno())
+        self._handle.truncate()
+
+    def close(self):
+        self._handle.close()
@@ -0,0 +1,167 @@
+"""
+Shell completion, answered from a small cache without loading the rest of hacenada
+
+start and next record the script of each session in progress, with its step
+labels, in HACENADA_HOME/completion/sessions.json; a finished or dropped session is
+removed. The completion functions printed by `hacenada completion` run
+`python -m hacenada.complete`, which only reads that file (this module imports
+nothing but the standard library), so completion takes a few milliseconds
+however many sessions and scripts there are.
+"""
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+import sys
+import tempfile
+import typing
+
+
+# in HACENADA_HOME, out of the way of the session storages
+CACHE = "completion/sessions.json"
+
+# the commands, for completing the first word; test_complete checks these against main
+COMMANDS = (
+    "compile",
+    "completion",
+    "diff",
+    "export",
+    "gc",
+    "loadtest",
+    "next",
+    "print",
+    "replay",
+    "report",
+    "start",
+    "status",
+    "storage",
+    "undo",
+    "watch",
+)
+
+# commands whose FILENAME is usually the script of a session in progress (start's
+# only with --start-over)
+SESSION_COMMANDS = ("next", "print", "undo", "watch")
+
+# options whose value is a step label
+LABEL_OPTIONS = ("--until",)
+
+SHELLS = {
+    "bash": """\
+_hacenada_complete() {
+    local IFS=$'\\n'
+    COMPREPLY=($(%(python)s -m hacenada.complete \
+        "${COMP_WORDS[@]:1:COMP_CWORD}" 2>/dev/null))
+}
+complete -o default -F _hacenada_complete hacenada
+""",
+    "zsh": """\
+_hacenada() {
+    local -a found
+    found=("${(@f)$(%(python)s -m hacenada.complete \
+        "${(@)words[2,CURRENT]}" 2>/dev/null)}")
+    if [[ -n ${found[1]} ]]; then
+        compadd -a found
+    else
+        _files
+    fi
+}
+compdef _hacenada hacenada
+""",
+}
+
+
+def default_home() -> Path:
+    """
+    HACENADA_HOME, found as storage finds it, without importing storage
+    """
+    return Path(os.environ.get("XDG_CONFIG_HOME", Path.home() / ".config")) / "hacenada"
+
+
+def load(home: Path) -> typing.Dict[str, typing.List[str]]:
+    """
+    The step labels of each session's script, by the script's absolute path
+    """
+    try:
+        return json.loads((home / CACHE).read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save(home: Path, entries: typing.Dict[str, typing.List[str]]):
+    path = home / CACHE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+    with os.fdopen(fd, "w") as f:
+        json.dump(entries, f)
+    os.replace(tmp, path)
+
+
+def remember(home: Path, script_path: Path, labels: typing.List[str]):
+    """
+    Record that the script at script_path, with step labels, has a session in progress
+    """
+    entries = load(home)
+    key = str(Path(script_path).absolute())
+    if entries.get(key) != labels:
+        entries[key] = labels
+        _save(home, entries)
+
+
+def forget(home: Path, script_path: Path):
+    """
+    Record that the script at script_path has no session in progress
+    """
+    entries = load(home)
+    if entries.pop(str(Path(script_path).absolute()), None) is not None:
+        _save(home, entries)
+
+
+def _shown(path: str, cwd: str) -> str:
+    """
+    path as it's best typed from cwd: relative below it, absolute elsewhere
+    """
+    if path.startswith(cwd.rstrip(os.sep) + os.sep):
+        return os.path.relpath(path, cwd)
+    return path
+
+
+def candidates(
+    entries: typing.Dict[str, typing.List[str]], words: typing.List[str], cwd: str
+) -> typing.List[str]:
+    """
+    The completions of the last of words, the arguments of a hacenada command line
+    """
+    *before, incomplete = words or [""]
+    if not before:
+        found: typing.Iterable[str] = COMMANDS
+    elif before[-1] in LABEL_OPTIONS:
+        # the labels of the --script given, or of every script
+        scripts = [
+            str(Path(cwd, before[i + 1]))
+            for i, word in enumerate(before[:-1])
+            if word == "--script"
+        ]
+        found = sorted(
+            {label for path in scripts or entries for label in entries.get(path, [])}
+        )
+    elif (
+        before[0] in SESSION_COMMANDS or "--start-over" in before
+    ) and not incomplete.startswith("-"):
+        found = sorted(_shown(path, cwd) for path in entries)
+    else:
+        found = []
+    return [each for each in found if each.startswith(incomplete)]
+
+
+def main(argv: typing.List[str]):
+    """
+    Print the completions of the command line argv, one per line
+    """
+    for each in candidates(load(default_home()), argv, os.getcwd()):
+        print(each)
+
+
+if __name__ == "__main__":  # pragma: nocover
+    main(sys.argv[1:])
@@ -5,3 +5,22 @@ import typing
 
 
 STR_DICT = typing.Dict[str, typing.Any]
+
+# step types that a renderer knows how to display
+STEP_TYPES = ("description", "input", "message", "confirm")
+
+# every step type a script may use: wait steps are polled rather than displayed
+SCRIPT_STEP_TYPES = STEP_TYPES + ("wait",)
+
+# the keys of a wait step's check, and whether its answer is cached
+WAIT_KEYS = ("check", "interval", "timeout", "cache")
+
+# the keys of a script's `retain` table, and what each one counts
+RETAIN_KEYS = {"days": "days", "runs": "runs", "max_bytes": "bytes"}
+
+# differences in how long a step took smaller than this, in seconds, are not
+# reported by diff
+TIMING_THRESHOLD = 60.0
+
+# the formats export writes, one for each of its writers
+EXPORT_FORMATS = ("csv", "jsonl", "parquet")
@@ -0,0 +1,236 @@
+"""
+Compare two runs of a script, step by step
+
+Each run is a script and its answers, from a log or a session in progress.
+Steps and answers are matched by label, so steps inserted, removed or reordered
+in one run don't misalign the rest. A digest of each label's step and answer is
+computed first, and labels whose digests match are passed over without looking
+further; everything is a dict lookup, so comparing runs takes time linear in
+their number of steps.
+
+Changes are reported in the order of the second run's script, with the labels
+only in the first run after the step they followed there.
+"""
+from __future__ import annotations
+
+import datetime
+import hashlib
+import json
+import typing
+
+import attr
+
+from hacenada import blob
+from hacenada.abstract import SessionStorage
+from hacenada.const import STR_DICT, TIMING_THRESHOLD
+from hacenada.script import Script
+
+
+# how much of a message or answer to show
+PREVIEW_LENGTH = 80
+
+
+@attr.s(auto_attribs=True)
+class Run:
+    """
+    One side of a comparison: a script, its answers by label, and each step's time
+    """
+
+    name: str
+    steps: typing.Dict[str, STR_DICT]
+    answers: typing.Dict[str, STR_DICT]
+    took: typing.Dict[str, float]
+
+    @classmethod
+    def of(cls, name: str, script: Script, storage: SessionStorage) -> Run:
+        answers = {a["label"]: dict(a) for a in storage.answer.all()}
+        return cls(
+            name,
+            {s["label"]: dict(s) for s in script.overlay},
+            answers,
+            _durations(answers),
+        )
+
+
+@attr.s(auto_attribs=True)
+class Change:
+    """
+    One difference between the runs, at a label
+    """
+
+    label: str
+    # "step added", "step removed", "step changed", "answer changed" or "timing"
+    what: str
+    a: str = ""
+    b: str = ""
+
+
+def _durations(answers: typing.Dict[str, STR_DICT]) -> typing.Dict[str, float]:
+    """
+    How long each answered step took: the time since the answer before it, in seconds
+    """
+    timed = (
+        a for a in answers.values() if isinstance(a.get("when"), datetime.datetime)
+    )
+    ordered = sorted(timed, key=lambda a: a["when"])
+    return {
+        this["label"]: (this["when"] - previous["when"]).total_seconds()
+        for previous, this in zip(ordered, ordered[1:])
+    }
+
+
+def _digest(*parts: typing.Any) -> str:
+    return hashlib.sha1(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+
+
+# what a step asks, compared between runs; other keys (e.g. stop) don't change the
+# question
+STEP_FIELDS = ("message", "type", "when", "check", "foreach")
+
+
+def _step_content(step: typing.Optional[STR_DICT]) -> typing.Optional[list]:
+    if step is None:
+        return None
+    return [step.get(field) for field in STEP_FIELDS]
+
+
+def _show_step(content: list, other: typing.Optional[list] = None) -> str:
+    """
+    A preview of a step's message, and its other fields that differ from other's
+    """
+    ret = _preview(content[0])
+    for field, value, was in zip(STEP_FIELDS[1:], content[1:], (other or content)[1:]):
+        if value != was and value is not None:
+            ret += f" ({field}: {_preview(value)})"
+    return ret
+
+
+def _answer_content(answered: typing.Optional[STR_DICT]) -> typing.Optional[list]:
+    """
+    What was answered; a value in the blob store is compared by its digest
+    """
+    if answered is None:
+        return None
+    return [answered["value"], bool(answered.get("skipped"))]
+
+
+def _preview(value: typing.Any) -> str:
+    """
+    A one-line preview of a message or answer value
+    """
+    if blob.is_ref(value):
+        return f"<{value['size']} byte value {value['blob'][:12]}>"
+    text = value if isinstance(value, str) else json.dumps(value, default=str)
+    text = " ".join(text.split())
+    return text if len(text) <= PREVIEW_LENGTH else text[: PREVIEW_LENGTH - 3] + "..."
+
+
+def _show_answer(answered: typing.Optional[STR_DICT]) -> str:
+    if answered is None:
+        return "(not answered)"
+    if answered.get("skipped"):
+        return "(skipped)"
+    return _preview(answered["value"])
+
+
+def _order(a: typing.Iterable[str], b: typing.Iterable[str]) -> typing.List[str]:
+    """
+    Every label of b in order, with the labels only in a after the label they
+    followed in a
+    """
+    in_b = dict.fromkeys(b)
+    following: typing.Dict[typing.Optional[str], typing.List[str]] = {}
+    anchor: typing.Optional[str] = None
+    for label in a:
+        if label in in_b:
+            anchor = label
+        else:
+            following.setdefault(anchor, []).append(label)
+    ret = list(following.get(None, []))
+    for label in in_b:
+        ret.append(label)
+        ret.extend(following.get(label, []))
+    return ret
+
+
+def _labels(run: Run) -> typing.List[str]:
+    """
+    The labels of run's steps and answers, in script order with expanded answers
+    after their step
+    """
+    expanded: typing.Dict[str, typing.List[str]] = {}
+    for label in run.answers:
+        base = label.partition("[")[0]
+        if label not in run.steps and base in run.steps:
+            expanded.setdefault(base, []).append(label)
+    ret = []
+    for label in run.steps:
+        ret.append(label)
+        ret.extend(expanded.get(label, []))
+    placed = set(ret)
+    return ret + [label for label in run.answers if label not in placed]
+
+
+def compare(
+    a: Run, b: Run, timing_threshold: float = TIMING_THRESHOLD
+) -> typing.Tuple[typing.List[Change], int]:
+    """
+    The differences between runs a and b, and how many labels were the same in both
+    """
+    changes = []
+    same = 0
+    for label in _order(_labels(a), _labels(b)):
+        step_a, step_b = _step_content(a.steps.get(label)), _step_content(
+            b.steps.get(label)
+        )
+        answer_a, answer_b = a.answers.get(label), b.answers.get(label)
+        took_a, took_b = a.took.get(label), b.took.get(label)
+        slower = (
+            took_a is not None
+            and took_b is not None
+            and abs(took_b - took_a) >= timing_threshold
+        )
+        if (
+            _digest(step_a, _answer_content(answer_a))
+            == _digest(step_b, _answer_content(answer_b))
+            and not slower
+        ):
+            same += 1
+            continue
+
+        if step_a is None and step_b is not None:
+            changes.append(Change(label, "step added", b=_show_step(step_b)))
+        elif step_b is None and step_a is not None:
+            changes.append(Change(label, "step removed", a=_show_step(step_a)))
+        elif step_a is not None and step_b is not None and step_a != step_b:
+            changes.append(
+                Change(
+                    label,
+                    "step changed",
+                    _show_step(step_a, step_b),
+                    _show_step(step_b, step_a),
+                )
+            )
+        if _answer_content(answer_a) != _answer_content(answer_b):
+            changes.append(
+                Change(
+                    label,
+                    "answer changed",
+                    _show_answer(answer_a),
+                    _show_answer(answer_b),
+                )
+            )
+        if slower:
+            changes.append(Change(label, "timing", _took(took_a), _took(took_b)))
+    return changes, same
+
+
+def _took(seconds: typing.Optional[float]) -> str:
+    seconds = seconds or 0.0
+    if seconds >= 3600:
+        return f"{seconds / 3600:.1f}h"
+    if seconds >= 60:
+        return f"{seconds / 60:.1f}m"
+    return f"{seconds:.0f}s"
@@ -0,0 +1,222 @@
+"""
+Drive sessions from an asyncio event loop, e.g. to embed hacenada in a chat bot
+
+An AsyncSession works on a copy of its session in memory, loaded once from an
+AsyncSessionStorage and saved back after each change; a ThreadedStorage holds
+the session's lock meanwhile, as the hacenada commands do. next_step() does what
+needs no person (recording steps whose condition is false as skipped, and
+waiting for wait steps) and gives the next step for someone to answer;
+answer() records their answer. At the end of the script the session's logs are
+written and the session removed, as `hacenada next` does. Nothing blocks the
+event loop, so one loop can drive any number of sessions at once.
+
+    storage = ThreadedStorage.for_script(path)
+    sesh = await AsyncSession.open(Script.from_scriptfile(path), storage)
+    while (step := await sesh.next_step()) is not None:
+        await sesh.answer(step["label"], await ask_in_chat(step["message"]))
+"""
+from __future__ import annotations
+
+import asyncio
+from pathlib import Path
+import typing
+
+import attr
+
+from hacenada import error, memo, wait
+from hacenada.abstract import AsyncRender, AsyncSessionStorage
+from hacenada.const import STR_DICT
+from hacenada.script import Script, Step
+from hacenada.session import Session, SessionOptions
+from hacenada.storage import HomeDirectoryStorage
+
+
+T = typing.TypeVar("T")
+
+
+async def _in_thread(fn: typing.Callable[..., T], *args) -> T:
+    """
+    Call fn in the event loop's default executor, so its I/O doesn't block the loop
+    """
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+@attr.s(auto_attribs=True)
+class ThreadedStorage(AsyncSessionStorage):
+    """
+    A HomeDirectoryStorage used from an event loop, reading and writing in a thread
+    """
+
+    storage: HomeDirectoryStorage
+
+    @classmethod
+    def for_script(
+        cls, path: Path, encoding: typing.Optional[str] = None
+    ) -> ThreadedStorage:
+        """
+        The storage in HACENADA_HOME of the session of the script at path
+        """
+        return cls(HomeDirectoryStorage.from_path(path, encoding=encoding))
+
+    def _locked(self, fn: typing.Callable[..., T], *args) -> T:
+        """
+        Call fn holding the session's lock, as the hacenada commands do
+        """
+        with self.storage.lock():
+            return fn(*args)
+
+    async def load(self) -> STR_DICT:
+        return await _in_thread(self._locked, self.storage.to_structured)
+
+    async def save(self, data: STR_DICT):
+        await _in_thread(self._locked, self.storage.replace_structured, data)
+
+    async def checkpoint(self):
+        await _in_thread(self._locked, self.storage.checkpoint)
+
+    def _log_and_cleanup(self, script: Script):
+        # the logs are written in the formats the print command uses
+        from hacenada import main
+
+        options = SessionOptions(quiet=True)
+        main.log_and_cleanup(
+            Session(storage=self.storage, script=script, options=options)
+        )
+
+    async def finish(self, script: Script):
+        await _in_thread(self._locked, self._log_and_cleanup, script)
+
+
+@attr.s(auto_attribs=True)
+class AsyncSession:
+    """
+    A session driven from an event loop; see open()
+    """
+
+    session: Session
+    storage: AsyncSessionStorage
+    renderer: typing.Optional[AsyncRender] = None
+    # the step shown and waiting for an answer, if any
+    pending: typing.Optional[Step] = None
+    finished: bool = False
+    _guard: typing.Optional[asyncio.Lock] = attr.ib(default=None, init=False)
+
+    @classmethod
+    async def open(
+        cls,
+        script: Script,
+        storage: AsyncSessionStorage,
+        renderer: typing.Optional[AsyncRender] = None,
+        on_event: typing.Optional[typing.Callable[[STR_DICT], None]] = None,
+        cache: typing.Optional[memo.StepCache] = None,
+    ) -> AsyncSession:
+        """
+        Load the session from storage, with its answers reconciled with script
+
+        renderer is only needed by step() and run(). on_event and cache are as in
+        SessionOptions.
+        """
+        data = await storage.load()
+        memory = HomeDirectoryStorage.from_structured(data)
+        options = SessionOptions(quiet=True, on_event=on_event, cache=cache)
+        self = cls(
+            Session(storage=memory, script=script, options=options), storage, renderer
+        )
+        self.session.reconcile()
+        if memory.to_structured() != data:
+            await self._save()
+        return self
+
+    @property
+    def _lock(self) -> asyncio.Lock:
+        """
+        Held while the session changes, so its steps are taken one at a time
+        """
+        # made here, in the running loop, rather than when the session is made
+        if self._guard is None:
+            self._guard = asyncio.Lock()
+        return self._guard
+
+    async def _save(self):
+        await self.storage.save(self.session.storage.to_structured())
+
+    async def _wait(self, group: typing.List[Step]):
+        """
+        Answer wait steps from the cache, or by polling their checks, and save
+        """
+        q_a = self.session.recall(group)
+        recalled = set(q_a)
+        waiting = [each for each in group if each["label"] not in recalled]
+        if waiting and self.renderer:
+            q_a.update(await self.renderer.render_waits(waiting, self))
+        elif waiting:
+            q_a.update(await wait.answer_waits(waiting))
+        try:
+            self.session.record(group, q_a, recalled)
+        finally:
+            await self._save()
+        if group[-1]["stop"]:
+            await self.storage.checkpoint()
+
+    async def next_step(self) -> typing.Optional[Step]:
+        """
+        The next step for someone to answer, or None when the script is finished
+
+        Steps before it are done first: those whose condition is false are
+        recorded as skipped, and wait steps are waited for (raising WaitTimedOut
+        if a check doesn't succeed in time). The same step is given again until
+        it is answered.
+        """
+        async with self._lock:
+            while self.pending is None:
+                group, _ = self.session.next_group(self.session.remaining())
+                if group is None:
+                    if not self.finished:
+                        await self._save()
+                        self.finished = True
+                        self.session.emit("finished")
+                        await self.storage.finish(self.session.script)
+                    return None
+                if group[0]["type"] == "wait":
+                    await self._wait(group)
+                else:
+                    self.pending = group[0]
+                    await self._save()
+            return self.pending
+
+    async def answer(self, label: str, value: typing.Any):
+        """
+        Answer the pending step, which has label
+        """
+        async with self._lock:
+            if self.pending is None or self.pending["label"] != label:
+                raise error.StepNotPending(
+                    f"[{label}] is not the step waiting for an answer"
+                )
+            self.session.record([self.pending], {label: value})
+            stop, self.pending = self.pending["stop"], None
+            await self._save()
+            # each stop is a point to undo to, as in Session.step_session()
+            if stop:
+                await self.storage.checkpoint()
+
+    async def step(self) -> bool:
+        """
+        Ask the next step with the renderer and answer it; False when the script is
+        finished
+        """
+        if self.renderer is None:
+            raise error.RenderError("this session has no renderer to ask steps with")
+        step = await self.next_step()
+        if step is None:
+            return False
+        q_a = await self.renderer.render(step, self)
+        await self.answer(step["label"], q_a[step["label"]])
+        return True
+
+    async def run(self):
+        """
+        Ask every remaining step with the renderer, until the script is finished
+        """
+        while await self.step():
+            pass
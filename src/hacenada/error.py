@@ -21,6 +21,18 @@ class NoNextFound(StorageError):
     """
 
 
+class StorageBusy(StorageError):
+    """
+    Another hacenada holds the lock on this session
+    """
+
+
+class CodecError(StorageError):
+    """
+    Data could not be encoded or decoded in the compact binary format
+    """
+
+
 class ScriptFinished(Exception):
     """
     Signal that the interpreter reached the end of the script
@@ -31,3 +43,45 @@ class RenderError(Exception):
     """
     Base for all rendering-related errors
     """
+
+
+class ReplayStopped(Exception):
+    """
+    Signal that a replay reached the step where the operator takes over
+    """
+
+
+class ReplayDiverged(RenderError):
+    """
+    A step being replayed has no recorded answer to give
+    """
+
+
+class WaitTimedOut(RenderError):
+    """
+    The check of a wait step did not succeed in time
+    """
+
+
+class StepNotPending(Exception):
+    """
+    An answer was given for a step that isn't waiting for one
+    """
+
+
+class ScriptError(Exception):
+    """
+    The script is malformed or cannot be loaded
+    """
+
+
+class ExpressionError(ScriptError):
+    """
+    A step expression could not be parsed
+    """
+
+
+class ExportError(Exception):
+    """
+    Answers could not be exported in the format asked for
+    """
@@ -0,0 +1,297 @@
+"""
+Export every answer of every session and log as flat rows, for analytics
+
+Sessions are the storages in HACENADA_HOME, finished or not; logs are the
+files in the .log.d directory of each of their scripts, and in any .log.d
+found under directories named by the caller. Rows are produced one log at a
+time and handed to a writer as they come, so memory use does not grow with the
+number of logs. Logs are parsed in a pool of worker processes.
+"""
+from __future__ import annotations
+
+import csv
+import datetime
+import io
+import json
+from pathlib import Path
+import re
+import typing
+
+import attr
+
+from hacenada import error, logfile, storage
+from hacenada.const import STR_DICT
+from hacenada.script import Script
+
+
+# the columns of every row, in order
+COLUMNS = (
+    "script",
+    "script_path",
+    "source",
+    "run",
+    "run_date",
+    "description",
+    "label",
+    "type",
+    "value",
+    "skipped",
+    "answered_at",
+)
+
+# logs handed to the worker pool at a time; bounds how many parsed logs wait in memory
+WINDOW = 64
+
+# rows per row group in a parquet file
+PARQUET_BATCH = 10000
+
+T = typing.TypeVar("T")
+Row = STR_DICT
+Writer = typing.Callable[[typing.Iterable[Row], typing.BinaryIO], None]
+WRITERS: typing.Dict[str, Writer] = {}
+
+
+def writer(name: str) -> typing.Callable[[Writer], Writer]:
+    """
+    Register fn as the writer of an export format
+    """
+
+    def deco(fn: Writer) -> Writer:
+        WRITERS[name] = fn
+        return fn
+
+    return deco
+
+
+@attr.s(auto_attribs=True)
+class Parsed:
+    """
+    The rows of one session or log, or why it could not be read
+    """
+
+    path: Path
+    rows: typing.List[Row] = attr.Factory(list)
+    error: str = ""
+
+
+@attr.s(auto_attribs=True)
+class ExportStats:
+    """
+    What an export did
+    """
+
+    sessions: int = 0
+    logs: int = 0
+    rows: int = 0
+    failed: typing.List[str] = attr.Factory(list)
+
+
+def _cell(value: typing.Any) -> typing.Optional[str]:
+    """
+    A value as text, for formats whose columns are all text
+    """
+    if value is None or isinstance(value, str):
+        return value
+    return json.dumps(value)
+
+
+def _rows(
+    script: typing.Optional[Script],
+    script_path: Path,
+    data: STR_DICT,
+    source: str,
+    run: str,
+    run_date: str,
+) -> typing.List[Row]:
+    """
+    A row for each answer in data, which has the answer and meta keys of a log
+    """
+    name = script.preamble.get("name", "") if script else ""
+    types = {s["label"]: s["type"] for s in script.overlay} if script else {}
+    blobs = storage.blob_store()
+    ret = []
+    for answer in data["answer"]:
+        label = answer["label"]
+        when: datetime.datetime = answer["when"]
+        ret.append(
+            dict(
+                script=name,
+                script_path=str(script_path),
+                source=source,
+                run=run,
+                run_date=run_date or when.date().isoformat(),
+                description=data["meta"].get("description", ""),
+                label=label,
+                type=types.get(script.template_label(label) if script else label, ""),
+                value=blobs.resolve(answer["value"]),
+                skipped=bool(answer.get("skipped")),
+                answered_at=when.isoformat(),
+            )
+        )
+    return ret
+
+
+def parse_log(path: Path) -> Parsed:
+    """
+    The rows of a log file; run in the worker processes
+    """
+    try:
+        data = logfile.read_log(path)
+        script = Script.from_structured(data)
+    except Exception as e:
+        return Parsed(path, error=f"{path}: {e}")
+    m = re.match(r"\d{4}-\d\d-\d\d", path.name)
+    # the script is beside its .log.d; the .log.d's name has lost its suffix
+    name = Path(data.get("meta", {}).get("script_path") or "").name
+    if name:
+        script_path = path.parent.parent / name
+    else:
+        script_path = path.parent.with_suffix("").with_suffix("")
+    return Parsed(
+        path, _rows(script, script_path, data, "log", path.stem, m.group() if m else "")
+    )
+
+
+def parse_session(stored: Path) -> Parsed:
+    """
+    The rows of a session storage, with step types from its script if it can be loaded
+    """
+    try:
+        with storage.locked(stored):
+            store = storage.HomeDirectoryStorage._from_json_path(stored)
+            try:
+                data = store.to_structured()
+            finally:
+                store.db.close()
+    except Exception as e:
+        return Parsed(stored, error=f"{stored}: {e}")
+    script_path = storage.script_of(stored, data["meta"])
+    try:
+        script: typing.Optional[Script] = Script.from_scriptfile(script_path)
+    except error.ScriptError:
+        script = None
+    return Parsed(stored, _rows(script, script_path, data, "session", stored.name, ""))
+
+
+def session_files(home: Path) -> typing.List[Path]:
+    """
+    The session storages in home, in every encoding, in their buckets or (as older
+    versions kept them) not
+    """
+    patterns = [
+        f"{where}*{suffix}"
+        for where in ("", f"{storage.SESSIONS}/*/")
+        for suffix in storage.ENCODINGS.values()
+    ]
+    return sorted(p for pattern in patterns for p in home.glob(pattern))
+
+
+def log_dirs(
+    sessions: typing.Iterable[Path], roots: typing.Iterable[Path] = ()
+) -> typing.List[Path]:
+    """
+    The .log.d directories of the scripts of sessions, and any under roots
+    """
+    found = [storage.script_of(p).with_suffix(".log.d") for p in sessions]
+    for root in roots:
+        root = Path(root)
+        found.extend([root] if root.suffix == ".d" else root.rglob("*.log.d"))
+    return sorted({p.resolve() for p in found if p.is_dir()})
+
+
+def find_logs(dirs: typing.Iterable[Path]) -> typing.Iterator[Path]:
+    """
+    The machine-readable logs in dirs, one directory at a time
+    """
+    for d in dirs:
+        yield from sorted(p for p in d.iterdir() if p.suffix in logfile.LOG_SUFFIXES)
+
+
+def _init_worker(home: Path):  # pragma: nocover
+    """
+    Share this process's HACENADA_HOME (for the blob store) with a worker
+    """
+    storage.HACENADA_HOME = home
+
+
+def _windows(items: typing.Iterable[T], size: int) -> typing.Iterator[typing.List[T]]:
+    window: typing.List[T] = []
+    for item in items:
+        window.append(item)
+        if len(window) == size:
+            yield window
+            window = []
+    if window:
+        yield window
+
+
+def parsed_logs(logs: typing.Iterable[Path], jobs: int) -> typing.Iterator[Parsed]:
+    """
+    Parse logs in a pool of jobs processes (or in this one, with 1), in order
+    """
+    if jobs <= 1:
+        yield from map(parse_log, logs)
+        return
+    import multiprocessing
+
+    with multiprocessing.Pool(jobs, _init_worker, (storage.HACENADA_HOME,)) as pool:
+        for window in _windows(logs, WINDOW):
+            yield from pool.imap(parse_log, window)
+
+
+def answer_rows(
+    stats: ExportStats,
+    roots: typing.Iterable[Path] = (),
+    jobs: int = 1,
+) -> typing.Iterator[Row]:
+    """
+    Every row of every session in HACENADA_HOME and every log, counted in stats
+    """
+    sessions = session_files(storage.HACENADA_HOME)
+    for parsed in map(parse_session, sessions):
+        stats.sessions += 1
+        stats.failed.extend([parsed.error] if parsed.error else [])
+        stats.rows += len(parsed.rows)
+        yield from parsed.rows
+
+    for parsed in parsed_logs(find_logs(log_dirs(sessions, roots)), jobs):
+        stats.logs += 1
+        stats.failed.extend([parsed.error] if parsed.error else [])
+        stats.rows += len(parsed.rows)
+        yield from parsed.rows
+
+
+@writer("csv")
+def write_csv(rows: typing.Iterable[Row], out: typing.BinaryIO):
+    text = io.TextIOWrapper(out, encoding=storage.ENCODING, newline="")
+    w = csv.DictWriter(text, fieldnames=COLUMNS)
+    w.writeheader()
+    for row in rows:
+        w.writerow(dict(row, value=_cell(row["value"])))
+    text.detach()
+
+
+@writer("jsonl")
+def write_jsonl(rows: typing.Iterable[Row], out: typing.BinaryIO):
+    for row in rows:
+        out.write(json.dumps(row).encode(storage.ENCODING) + b"\n")
+
+
+@writer("parquet")
+def write_parquet(rows: typing.Iterable[Row], out: typing.BinaryIO):
+    """
+    Parquet files are available when pyarrow is installed
+    """
+    try:
+        import pyarrow
+        import pyarrow.parquet
+    except ImportError:
+        raise error.ExportError("parquet export needs pyarrow: pip install pyarrow")
+
+    schema = pyarrow.schema(
+        [(c, pyarrow.bool_() if c == "skipped" else pyarrow.string()) for c in COLUMNS]
+    )
+    with pyarrow.parquet.ParquetWriter(out, schema) as pw:
+        for batch in _windows(rows, PARQUET_BATCH):
+            cells = [dict(row, value=_cell(row["value"])) for row in batch]
+            pw.write_table(pyarrow.Table.from_pylist(cells, schema=schema))
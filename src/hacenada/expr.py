@@ -0,0 +1,233 @@
+"""
+A small, safe expression language for conditions on steps
+
+Expressions refer to earlier answers by label and are compiled once, to plain
+Python closures, so evaluating one costs no parsing:
+
+    deploy_kind == "new" and not skip-dns
+    region in ["us-east-1", "eu-west-1"]
+    (count >= 3 or force) and description != ""
+
+Operands are labels (an unanswered or skipped step is none), strings in single
+or double quotes, numbers, true, false, none, and [lists]. Operators, from
+loosest to tightest binding, are or, and, not, and the comparisons == != < <=
+> >= in and "not in". Answers given as text that look like numbers (an input
+step's "5") are compared as numbers with numbers. Comparing values of
+incompatible types is false.
+"""
+from __future__ import annotations
+
+import operator
+import re
+import typing
+
+import attr
+
+from hacenada.error import ExpressionError
+
+
+Lookup = typing.Callable[[str], typing.Any]
+_Fn = typing.Callable[[Lookup], typing.Any]
+
+KEYWORDS = {"and", "or", "not", "in", "true", "false", "none"}
+
+_TOKEN_RX = re.compile(
+    r"""
+    \s*(?:
+        (?P<number>-?\d+(?:\.\d+)?(?![\w.-]))
+      | (?P<string>"(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')
+      | (?P<name>[A-Za-z_][\w.-]*)
+      | (?P<op>==|!=|<=|>=|<|>|\(|\)|\[|\]|,)
+    )""",
+    re.VERBOSE,
+)
+
+_NUMBER_RX = re.compile(r"-?\d+(?:\.\d+)?")
+
+_COMPARISONS: typing.Dict[str, typing.Callable[[typing.Any, typing.Any], bool]] = {
+    "==": operator.eq,
+    "!=": operator.ne,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "in": lambda a, b: operator.contains(b, a),
+    "not in": lambda a, b: not operator.contains(b, a),
+}
+
+
+def _is_number(value: typing.Any) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _coerced(value: typing.Any, other: typing.Any) -> typing.Any:
+    """
+    value as a number, if it is text that looks like one and other is a number
+    """
+    if isinstance(value, str) and _is_number(other):
+        text = value.strip()
+        if _NUMBER_RX.fullmatch(text):
+            return float(text) if "." in text else int(text)
+    return value
+
+
+def _compare(op: str, a: typing.Any, b: typing.Any) -> bool:
+    """
+    Apply the comparison op, comparing numeric-looking text with numbers as numbers
+    """
+    if op in ("in", "not in") and isinstance(b, list):
+        b = [_coerced(item, a) for item in b]
+        a = next((_coerced(a, item) for item in b if _is_number(item)), a)
+    else:
+        a, b = _coerced(a, b), _coerced(b, a)
+    return _COMPARISONS[op](a, b)
+
+
+def _tokenize(source: str) -> typing.List[typing.Tuple[str, str]]:
+    """
+    Split source into (kind, text) tokens
+    """
+    tokens = []
+    pos = 0
+    source = source.rstrip()
+    while pos < len(source):
+        m = _TOKEN_RX.match(source, pos)
+        if not m:
+            raise ExpressionError(
+                f"unexpected {source[pos:].strip()[:10]!r} in {source!r}"
+            )
+        kind = m.lastgroup or ""
+        text = m.group(kind)
+        if kind == "name" and text in KEYWORDS:
+            kind = "keyword"
+        tokens.append((kind, text))
+        pos = m.end()
+    return tokens
+
+
+class _Parser:
+    """
+    Recursive descent over tokens, producing a closure for each node
+    """
+
+    def __init__(self, source: str):
+        self.source = source
+        self.tokens = _tokenize(source)
+        self.pos = 0
+        self.names: typing.Set[str] = set()
+
+    def _peek(self, ahead: int = 0) -> typing.Tuple[str, str]:
+        if self.pos + ahead < len(self.tokens):
+            return self.tokens[self.pos + ahead]
+        return ("end", "")
+
+    def _take(self, text: typing.Optional[str] = None) -> typing.Tuple[str, str]:
+        token = self._peek()
+        if token[0] == "end" or (text is not None and token[1] != text):
+            wanted = f"{text!r}" if text else "a value"
+            found = repr(token[1]) if token[1] else "the end"
+            raise ExpressionError(
+                f"expected {wanted}, found {found} in {self.source!r}"
+            )
+        self.pos += 1
+        return token
+
+    def parse(self) -> _Fn:
+        fn = self._or()
+        if self._peek()[0] != "end":
+            raise ExpressionError(f"unexpected {self._peek()[1]!r} in {self.source!r}")
+        return fn
+
+    def _or(self) -> _Fn:
+        fn = self._and()
+        while self._peek() == ("keyword", "or"):
+            self._take()
+            fn = (lambda a, b: lambda lk: a(lk) or b(lk))(fn, self._and())
+        return fn
+
+    def _and(self) -> _Fn:
+        fn = self._not()
+        while self._peek() == ("keyword", "and"):
+            self._take()
+            fn = (lambda a, b: lambda lk: a(lk) and b(lk))(fn, self._not())
+        return fn
+
+    def _not(self) -> _Fn:
+        if self._peek() == ("keyword", "not"):
+            self._take()
+            inner = self._not()
+            return lambda lk: not inner(lk)
+        return self._comparison()
+
+    def _comparison(self) -> _Fn:
+        left = self._operand()
+        op = self._peek()[1]
+        if op == "not" and self._peek(1) == ("keyword", "in"):
+            self._take()
+            op = "not in"
+        elif op not in _COMPARISONS:
+            return left
+        self._take()
+        right = self._operand()
+
+        def _compared(lk):
+            try:
+                return _compare(op, left(lk), right(lk))
+            except TypeError:
+                return False
+
+        return _compared
+
+    def _operand(self) -> _Fn:
+        kind, text = self._take()
+        if kind == "number":
+            number = float(text) if "." in text else int(text)
+            return lambda lk: number
+        if kind == "string":
+            string = re.sub(r"\\(.)", r"\1", text[1:-1])
+            return lambda lk: string
+        if kind == "name":
+            self.names.add(text)
+            return lambda lk: lk(text)
+        if kind == "keyword" and text in ("true", "false", "none"):
+            constant = {"true": True, "false": False, "none": None}[text]
+            return lambda lk: constant
+        if text == "(":
+            inner = self._or()
+            self._take(")")
+            return inner
+        if text == "[":
+            items: typing.List[_Fn] = []
+            while self._peek()[1] != "]":
+                if items:
+                    self._take(",")
+                items.append(self._operand())
+            self._take("]")
+            return lambda lk: [item(lk) for item in items]
+        raise ExpressionError(f"unexpected {text!r} in {self.source!r}")
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Expression:
+    """
+    A compiled expression, and the labels it refers to
+    """
+
+    source: str
+    names: typing.FrozenSet[str]
+    fn: _Fn = attr.ib(eq=False, repr=False)
+
+    def __call__(self, lookup: Lookup) -> bool:
+        """
+        Evaluate, looking up each label's answer with lookup
+        """
+        return bool(self.fn(lookup))
+
+
+def compile_expression(source: str) -> Expression:
+    """
+    Parse source once, producing an Expression that can be evaluated many times
+    """
+    parser = _Parser(source)
+    fn = parser.parse()
+    return Expression(source=source, names=frozenset(parser.names), fn=fn)
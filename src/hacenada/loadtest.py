@@ -0,0 +1,224 @@
+"""
+Load-test session storage with many concurrent synthetic sessions
+
+Worker processes each run sessions of a generated script through
+Session.step_session, answering with a renderer that never prompts, against a
+storage backend sharing one HACENADA_HOME. Step latencies, errors, and
+sessions whose stored answers don't read back as given (corruption) are
+collected into a LoadStats report.
+"""
+from __future__ import annotations
+
+import functools
+import multiprocessing
+from pathlib import Path
+import time
+import typing
+
+import attr
+
+from hacenada import error, session, storage
+from hacenada.abstract import Render, SessionStorage
+from hacenada.const import STR_DICT
+from hacenada.script import Script, Step
+
+
+# how to open the storage of a script under each backend name: one backend per
+# storage encoding, so any encoding added to storage is load-tested too
+BACKENDS: typing.Dict[str, typing.Callable[[Path], SessionStorage]] = {
+    encoding: functools.partial(
+        storage.HomeDirectoryStorage.from_path, encoding=encoding
+    )
+    for encoding in storage.ENCODINGS
+}
+
+
+@attr.s(auto_attribs=True)
+class SyntheticRender(Render):
+    """
+    Answer every step immediately, with a value derived from its label
+    """
+
+    answer_size: int = 16
+
+    def answer_for(self, label: str) -> str:
+        size = self.answer_size
+        return (label * size)[:size]
+
+    def render(self, step: Step, context) -> STR_DICT:
+        return {step["label"]: self.answer_for(step["label"])}
+
+
+def synthetic_script(steps: int) -> STR_DICT:
+    """
+    The structured data of a script with this many input steps
+    """
+    return dict(
+        hacenada=dict(name="load test", description=""),
+        step=[
+            dict(type="input", message=f"step {n}", label=f"step-{n}")
+            for n in range(steps)
+        ],
+    )
+
+
+@attr.s(auto_attribs=True)
+class WorkerResult:
+    """
+    What one worker measured
+    """
+
+    sessions: int = 0
+    latencies: typing.List[float] = attr.Factory(list)
+    errors: typing.Dict[str, int] = attr.Factory(dict)
+    corrupted: int = 0
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class WorkerJob:
+    """
+    What one worker is asked to do
+    """
+
+    worker: int
+    home: Path
+    backend: str
+    sessions: int
+    steps: int
+    answer_size: int
+
+
+def run_worker(job: WorkerJob) -> WorkerResult:
+    """
+    Run job.sessions sessions one after the other, timing every step
+    """
+    storage.HACENADA_HOME = job.home
+    result = WorkerResult()
+    renderer = SyntheticRender(answer_size=job.answer_size)
+    options = session.SessionOptions(renderer=renderer, quiet=True)
+    script = Script.from_structured(synthetic_script(job.steps))
+    scripts = job.home / "scripts"
+    scripts.mkdir(parents=True, exist_ok=True)
+
+    for n in range(job.sessions):
+        path = scripts / f"worker-{job.worker}-{n}.toml"
+        try:
+            sesh = session.Session(
+                storage=BACKENDS[job.backend](path), script=script, options=options
+            )
+            while True:
+                started = time.perf_counter()
+                try:
+                    sesh.step_session()
+                except error.ScriptFinished:
+                    break
+                finally:
+                    result.latencies.append(time.perf_counter() - started)
+
+            stored = BACKENDS[job.backend](path)
+            for step in script.overlay:
+                answered = stored.get_answer(step["label"])
+                if not answered or answered["value"] != renderer.answer_for(
+                    step["label"]
+                ):
+                    result.corrupted += 1
+                    break
+        except Exception as e:
+            name = type(e).__name__
+            result.errors[name] = result.errors.get(name, 0) + 1
+        finally:
+            storage.HomeDirectoryStorage.drop_path(path)
+        result.sessions += 1
+
+    return result
+
+
+def percentile(ordered: typing.Sequence[float], pct: float) -> float:
+    """
+    The pct-th percentile (nearest rank) of already-sorted values, 0 when empty
+    """
+    if not ordered:
+        return 0.0
+    rank = max(1, -(-len(ordered) * pct // 100))
+    return ordered[int(rank) - 1]
+
+
+@attr.s(auto_attribs=True)
+class LoadStats:
+    """
+    The outcome of a load test
+    """
+
+    backend: str
+    workers: int
+    sessions: int = 0
+    steps: int = 0
+    elapsed: float = 0.0
+    latencies: typing.List[float] = attr.Factory(list)  # sorted
+    errors: typing.Dict[str, int] = attr.Factory(dict)
+    corrupted: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """
+        Steps per second, across all workers
+        """
+        return self.steps / self.elapsed if self.elapsed else 0.0
+
+    def report(self) -> str:
+        """
+        A human-readable summary
+        """
+        ms = {p: percentile(self.latencies, p) * 1000 for p in (50, 90, 99, 100)}
+        errors = ", ".join(f"{k}: {v}" for k, v in sorted(self.errors.items())) or "0"
+        return "\n".join(
+            [
+                f"{self.backend}: {self.sessions} sessions in {self.workers} workers, "
+                f"{self.steps} steps in {self.elapsed:.2f}s",
+                f"  throughput: {self.throughput:.1f} steps/s",
+                f"  latency: p50 {ms[50]:.2f}ms  p90 {ms[90]:.2f}ms  "
+                f"p99 {ms[99]:.2f}ms  max {ms[100]:.2f}ms",
+                f"  errors: {errors}",
+                f"  corrupted sessions: {self.corrupted}",
+            ]
+        )
+
+
+def run(
+    home: Path,
+    backend: str = "json",
+    workers: int = 4,
+    sessions: int = 10,
+    steps: int = 20,
+    answer_size: int = 16,
+) -> LoadStats:
+    """
+    Run `workers` processes, each running `sessions` sessions of `steps` steps,
+    against home
+    """
+    jobs = [
+        WorkerJob(
+            worker=n,
+            home=Path(home),
+            backend=backend,
+            sessions=sessions,
+            steps=steps,
+            answer_size=answer_size,
+        )
+        for n in range(workers)
+    ]
+    started = time.perf_counter()
+    with multiprocessing.Pool(workers) as pool:
+        results = pool.map(run_worker, jobs)
+
+    stats = LoadStats(backend=backend, workers=workers)
+    stats.elapsed = time.perf_counter() - started
+    for result in results:
+        stats.sessions += result.sessions
+        stats.latencies.extend(result.latencies)
+        stats.corrupted += result.corrupted
+        for name, count in result.errors.items():
+            stats.errors[name] = stats.errors.get(name, 0) + count
+    stats.steps = len(stats.latencies)
+    stats.latencies.sort()
+    return stats
@@ -0,0 +1,92 @@
+"""
+Read and write the machine-readable session logs
+
+A log holds the script preamble, the raw steps, the answers and the session
+meta, either as json or in the compact binary encoding.
+"""
+import datetime
+import json
+from pathlib import Path
+import typing
+
+from hacenada import codec
+from hacenada.const import STR_DICT
+from hacenada.script import Script
+from hacenada.storage import ENCODINGS, HomeDirectoryStorage
+
+
+LOG_SUFFIXES = (ENCODINGS["json"], ENCODINGS["compact"])
+
+
+# meta properties of a session that don't belong in its log: a log is a snapshot,
+# so how often the session changed doesn't, and the log lives beside its script
+SESSION_ONLY_META = ("revision", "script")
+
+
+def is_log(path: Path) -> bool:
+    """
+    Is path a machine-readable log, rather than a script?
+
+    Compact files are always logs; json files are logs when they live in a .log.d
+    """
+    path = Path(path)
+    if path.suffix == ENCODINGS["compact"]:
+        return True
+    return path.suffix == ENCODINGS["json"] and path.parent.suffix == ".d"
+
+
+def compact_records(script: Script, storage) -> typing.Iterator[list]:
+    """
+    The [key, value] records of a compact log, in file order
+    """
+    yield ["hacenada", script.preamble]
+    for step in script.raw_steps:
+        yield ["step", step]
+    if storage:
+        for answer in storage.answer.all():
+            yield ["answer", dict(answer)]
+        meta = storage.to_structured()["meta"]
+        yield ["meta", {k: v for k, v in meta.items() if k not in SESSION_ONLY_META}]
+
+
+def write_compact(path: Path, script: Script, storage) -> Path:
+    """
+    Write a compact log of the script and answers to path
+    """
+    path.write_bytes(codec.dump_records(compact_records(script, storage)))
+    return path
+
+
+def read_log(path: Path) -> STR_DICT:
+    """
+    Load a log file in either encoding to structured data
+
+    The result has the keys hacenada, step, answer and meta, with answer
+    timestamps as datetimes.
+    """
+    path = Path(path)
+    raw = path.read_bytes()
+
+    if codec.is_compact(raw):
+        ret: STR_DICT = dict(hacenada={}, step=[], answer=[], meta={})
+        for key, value in codec.load_records(raw):
+            if key in ("hacenada", "meta"):
+                ret[key] = value
+            else:
+                ret[key].append(value)
+        return ret
+
+    ret = json.loads(raw)
+    ret.setdefault("answer", [])
+    ret.setdefault("meta", {})
+    for answer in ret["answer"]:
+        answer["when"] = datetime.datetime.fromisoformat(answer["when"])
+    return ret
+
+
+def load_log(path: Path) -> typing.Tuple[Script, HomeDirectoryStorage]:
+    """
+    Reconstruct the script and an in-memory storage from a log file
+    """
+    data = read_log(path)
+    return Script.from_structured(data), HomeDirectoryStorage.from_structured(data)
@@ -27,19 +27,49 @@ https://blog.danslimmon.com/2019/07/15/do-nothing-scripting-the-key-to-gradual-a
       imports several third-party libraries and I haven't even written any code yet.
       minimize dependencies or have a canonical way (like a curl-pipe-bash installer?)
 """
+import contextlib
 import datetime
 import io
 import json
+import os
 import pathlib
+import shlex
+import sys
+import tempfile
 import typing
 import urllib
 
 import click
 import toml
 
-from hacenada import render, script, session, storage
+# modules only some commands need are imported by those commands, so running a
+# step (and above all with the plain renderer) loads no more than it uses
+from hacenada import (
+    blob,
+    complete,
+    logfile,
+    render,
+    script,
+    session,
+    storage,
+    wait,
+)
 from hacenada.abstract import SessionStorage
-from hacenada.error import ScriptFinished, StorageError
+from hacenada.const import EXPORT_FORMATS, STR_DICT, TIMING_THRESHOLD
+from hacenada.error import (
+    ExportError,
+    RenderError,
+    ScriptError,
+    ScriptFinished,
+    StorageBusy,
+    StorageError,
+)
+from hacenada.expr import Lookup
+from hacenada.storage import blob_store, print_cache, step_cache
+
+
+if typing.TYPE_CHECKING:
+    from hacenada import audit, diff
 
 
 def handle_filename(_, param, value):
@@ -89,9 +119,101 @@ def _find_storage_somehow(filename) -> typing.Tuple[pathlib.Path, SessionStorage
         raise click.UsageError(str(e))
 
 
+@contextlib.contextmanager
+def _holding(_store: SessionStorage) -> typing.Iterator[None]:
+    """
+    Hold the session's lock while the block runs, or say that another hacenada has it
+    """
+    try:
+        with _store.lock():
+            yield
+    except StorageBusy as e:
+        raise click.ClickException(f"** {e}")
+
+
+def _load_script(filename) -> script.Script:
+    """
+    Load a script (source or compiled), reporting problems as usage errors
+    """
+    try:
+        return script.Script.from_scriptfile(filename)
+    except ScriptError as e:
+        raise click.UsageError(f"** {filename}: {e}")
+
+
+def renderer_option(fn):
+    """
+    Common decorator option for choosing how steps are shown
+    """
+    return click.option(
+        "--renderer",
+        type=click.Choice(("auto",) + tuple(render.RENDERERS)),
+        default="auto",
+        help="How to show steps: inquirer's interactive prompts, or plain prompts "
+        "that work on any terminal or pipe (default: inquirer on a full terminal, "
+        "plain otherwise)",
+    )(fn)
+
+
+def audit_option(fn):
+    """
+    Common decorator option for sending audit events
+    """
+    return click.option(
+        "--audit",
+        "audit_sink",
+        metavar="SINK",
+        envvar="HACENADA_AUDIT",
+        default=None,
+        help="Send an event for each step shown, answered or skipped to SINK: "
+        "file:PATH, unix:PATH or syslog:[IDENT] (default: $HACENADA_AUDIT)",
+    )(fn)
+
+
+def _open_audit(audit_sink: typing.Optional[str]) -> typing.Optional["audit.AuditLog"]:
+    """
+    The audit log for the --audit option, if one was given
+    """
+    if not audit_sink:
+        return None
+    from hacenada import audit
+
+    try:
+        return audit.AuditLog.to(audit_sink)
+    except ValueError as e:
+        raise click.UsageError(f"** {e}")
+
+
+def _step(sesh: session.Session, _audit: typing.Optional["audit.AuditLog"] = None):
+    """
+    Run the session's next step, writing the logs when the script is finished
+    """
+    try:
+        sesh.step_session()
+    except ScriptFinished:
+        script_path = sesh.storage.script_path
+        fn_md = log_and_cleanup(sesh)
+        print(f"{script_path}: Cleaning up.  Log: {fn_md}")
+    except RenderError as e:
+        raise click.ClickException(f"** {e}")
+    else:
+        labels = [step["label"] for step in sesh.script.overlay]
+        complete.remember(storage.HACENADA_HOME, sesh.storage.script_path, labels)
+    finally:
+        if _audit:
+            _audit.close()
+            if _audit.dropped or _audit.failed:
+                print(
+                    f"** audit: {_audit.dropped} events dropped, "
+                    f"{_audit.failed} could not be delivered"
+                )
+
+
 @hacenada.command()
 @filename_arg(required=False)
-def next(filename):
+@renderer_option
+@audit_option
+def next(filename, renderer, audit_sink):
     """
     Run the next step.
 
@@ -103,43 +225,576 @@ def next(filename):
     """
     filename, _store = _find_storage_somehow(filename)
 
-    _opt = session.SessionOptions(renderer=render.InquirerRender())
-    _script = script.Script.from_scriptfile(filename)
-    sesh = session.Session(script=_script, storage=_store, options=_opt)
+    _script = _load_script(filename)
+    with _holding(_store):
+        _audit = _open_audit(audit_sink)
+        _opt = session.SessionOptions(
+            renderer=render.choose_renderer(renderer),
+            on_event=_audit.emit if _audit else None,
+            cache=step_cache(),
+        )
+        sesh = session.Session(script=_script, storage=_store, options=_opt)
+        _print_reconciled(filename, sesh.reconcile())
+        _step(sesh, _audit)
+
+
+def _print_reconciled(filename, reconciled: session.Reconciliation):
+    """
+    Tell the operator what happened to their answers when the script was edited
+    """
+    for old, new in reconciled.relabeled.items():
+        print(f"{filename}: the answer to [{old}] now belongs to [{new}]")
+    for label in reconciled.invalidated:
+        print(
+            f"** {filename}: [{label}] was changed or removed, its answer was discarded"
+        )
+
+
+@hacenada.command()
+@filename_arg(required=False)
+def undo(filename):
+    """
+    Go back to before the last run of next, so its steps are asked again
+
+    Running it again goes back one more run, as far back as the session keeps
+    checkpoints. FILENAME works as it does for next.
+    """
+    filename, _store = _find_storage_somehow(filename)
+    with _holding(_store):
+        undone = _store.undo()
+    if undone is None:
+        raise click.ClickException(f"** {filename}: nothing to undo")
+    labels = ", ".join(f"[{label}]" for label in undone)
+    print(f"{filename}: undid the answers to {labels}")
+
 
+@hacenada.command("status")
+@click.option("--format", default="table", type=click.Choice(("table", "json")))
+def session_status(format):
+    """
+    List every session in progress: its script, description, progress and last answer
+
+    Progress counts the steps of the script as it was when the session last
+    changed. Sessions are listed from summaries kept beside them, without
+    loading any session or script.
+    """
+    from hacenada import status
+
+    found = status.collect(storage.HACENADA_HOME)
+    for failed in found:
+        if failed.error:
+            click.echo(f"** {failed.error}", err=True)
+    found = [s for s in found if not s.error]
+    if format == "json":
+        rows = [
+            dict(
+                script=str(s.script_path),
+                description=s.description,
+                done=s.done,
+                total=s.total,
+                current=s.current,
+                last_answer=s.last_answer.isoformat() if s.last_answer else None,
+            )
+            for s in found
+        ]
+        print(json.dumps(rows, indent=2))
+        return
+
+    table = [("SCRIPT", "DESCRIPTION", "STEP", "LAST ANSWER")]
+    for s in found:
+        step = f"{s.done}/{s.total}" + (f" [{s.current}]" if s.current else "")
+        table.append(
+            (str(s.script_path), s.description, step, status.ago(s.last_answer))
+        )
+    widths = [max(len(row[i]) for row in table) for i in range(3)]
+    for row in table:
+        print(
+            "  ".join(cell.ljust(width) for cell, width in zip(row, widths))
+            + "  "
+            + row[-1]
+        )
+
+
+@hacenada.command("watch")
+@filename_arg(required=False)
+def watch_script(filename):
+    """
+    Keep an ongoing session in step with its script while the script is edited
+
+    Whenever the script file or a fragment it includes changes, the script is
+    reloaded (only the changed steps are processed again) and the session's
+    answers are matched to the new steps by label, or by content when a step's
+    label changed. Answers to steps that were changed or removed are discarded,
+    so `hacenada next` asks them again. The session is locked while that happens.
+
+    FILENAME works as it does for next. Stop watching with Ctrl-C.
+    """
+    from hacenada import watch
+
+    filename, _store = _find_storage_somehow(filename)
+    # nothing is rendered while watching
+    _opt = session.SessionOptions(renderer=render.PlainRender())
+    sesh = session.Session(script=_load_script(filename), storage=_store, options=_opt)
+    with _holding(_store):
+        _print_reconciled(filename, sesh.reconcile())
+    sources = script.source_files(filename)
+
+    print(f"{filename}: watching for changes, Ctrl-C to stop")
     try:
-        sesh.step_session()
-    except ScriptFinished:
-        _log_and_cleanup(sesh)
+        for _ in watch.changes(sources):
+            try:
+                with _store.lock():
+                    sesh.script = sesh.script.reload(filename)
+                    reconciled = sesh.reconcile()
+            except ScriptError as e:
+                print(f"** {filename}: {e} (keeping the previous version)")
+                continue
+            except StorageBusy as e:
+                # next reconciles the answers itself when it runs
+                print(f"** {e} (trying again at the next change)")
+                continue
+            sources[:] = script.source_files(filename)
+            _print_reconciled(filename, reconciled)
+            if not (reconciled.relabeled or reconciled.invalidated):
+                print(f"{filename}: reloaded, all answers still apply")
+    except KeyboardInterrupt:
+        pass
 
 
 @hacenada.command()
 @click.option("--start-over", "starting_over", is_flag=True)
+@click.option(
+    "--encoding",
+    type=click.Choice(tuple(storage.ENCODINGS)),
+    default=None,
+    help="How to store the session and its machine-readable log (default: json)",
+)
+@renderer_option
+@audit_option
 @filename_arg()
-def start(filename, starting_over):
+def start(filename, starting_over, encoding, renderer, audit_sink):
     """
     Begin a new session after opening filename.
     """
-    if starting_over:
-        storage.HomeDirectoryStorage.drop_path(filename)
-    _store = storage.HomeDirectoryStorage.from_path(filename)
+    try:
+        if starting_over:
+            storage.HomeDirectoryStorage.drop_path(filename)
+        _store = storage.HomeDirectoryStorage.from_path(filename, encoding=encoding)
+    except StorageError as e:
+        raise click.UsageError(str(e))
+
+    _script = _load_script(filename)
+    with _holding(_store):
+        _opt = session.SessionOptions(
+            renderer=render.choose_renderer(renderer), cache=step_cache()
+        )
+        sesh = session.Session(script=_script, storage=_store, options=_opt)
+        if sesh.started and not starting_over:
+            raise click.UsageError(
+                f"** <{filename}-storage> already contains some answers, "
+                "will not overwrite an ongoing session without --start-over"
+            )
+        sesh.reconcile()
+        _audit = _open_audit(audit_sink)
+        if _audit:
+            sesh.options.on_event = _audit.emit
+        _step(sesh, _audit)
+
+
+@hacenada.command("completion")
+@click.argument("shell", type=click.Choice(tuple(complete.SHELLS)))
+def completion(shell):
+    """
+    Print the shell code that completes hacenada's commands, session scripts and
+    step labels
+
+    Add `eval "$(hacenada completion bash)"` to ~/.bashrc, or the same with zsh
+    to ~/.zshrc (after compinit).
+    """
+    print(complete.SHELLS[shell] % dict(python=shlex.quote(sys.executable)), end="")
+
+
+@hacenada.command("compile")
+@filename_arg()
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(dir_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Where to write the compiled script "
+    f"(default: FILENAME with {script.COMPILED_SUFFIX})",
+)
+def compile_script(filename, output):
+    """
+    Validate every step of the script and write a fast-loading compiled copy
+
+    The compiled script may be given to start, next and print in place of the .toml
+    """
+    _script = _load_script(filename)
+    output = output or filename.with_suffix(script.COMPILED_SUFFIX)
+    output.write_bytes(_script.compile())
+    print(f"{filename}: {len(_script.overlay)} steps compiled to {output}")
+
+
+@hacenada.command("report")
+@filename_arg()
+@click.option(
+    "--output",
+    "-o",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="Where to build the site (default: FILENAME with .report.d)",
+)
+def report_site(filename, output):
+    """
+    Build a browsable HTML site of every logged run of the script
+
+    Rebuilding only regenerates pages for logs added or changed since the last build.
+    """
+    from hacenada import report
+
+    output = output or filename.with_suffix(".report.d")
+    stats = report.build(filename.with_suffix(".log.d"), output)
+    for log_name in stats.failed:
+        print(f"** {log_name}: could not be read, skipped")
+    print(
+        f"{output}: {stats.runs} runs ({stats.built} built, {stats.removed} removed), "
+        f"{stats.labels} label pages updated"
+    )
+
+
+@hacenada.command("diff")
+@click.argument(
+    "run_a",
+    metavar="A",
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+)
+@click.argument(
+    "run_b",
+    metavar="B",
+    type=click.Path(exists=True, dir_okay=False, path_type=pathlib.Path),
+)
+@click.option(
+    "--timing",
+    type=click.FloatRange(min=0),
+    default=TIMING_THRESHOLD,
+    show_default=True,
+    help="Report steps whose time taken differs by at least this many seconds",
+)
+def diff_runs(run_a, run_b, timing):
+    """
+    Show what changed between two runs: the script's steps, the answers, and the
+    time steps took
+
+    A and B are each a log of a finished session (json or compact), or a script
+    whose session is in progress. Steps are matched by label. The exit status
+    is 1 if the runs differ.
+    """
+    from hacenada import diff
+
+    changes, same = diff.compare(_diff_run(run_a), _diff_run(run_b), timing)
+    for change in changes:
+        print(f"[{change.label}] {change.what}")
+        if change.a:
+            print(f"  - {change.a}")
+        if change.b:
+            print(f"  + {change.b}")
+    print(f"{len({c.label for c in changes})} steps differ, {same} the same")
+    if changes:
+        sys.exit(1)
+
+
+def _diff_run(path: pathlib.Path) -> "diff.Run":
+    """
+    The run in a log, or in the session of a script, for diff
+    """
+    from hacenada import diff
+
+    if logfile.is_log(path):
+        try:
+            return diff.Run.of(str(path), *logfile.load_log(path))
+        except (StorageError, ScriptError, ValueError) as e:
+            raise click.UsageError(f"** {path}: could not be read: {e}")
+    if storage.stored_path(path) is None:
+        raise click.UsageError(
+            f"** {path} is neither a log nor a script with a session in progress"
+        )
+    return diff.Run.of(
+        str(path), _load_script(path), storage.HomeDirectoryStorage.from_path(path)
+    )
+
+
+@hacenada.command("replay")
+@click.argument("logs", type=click.Path(exists=True, path_type=pathlib.Path))
+@click.option(
+    "--script",
+    "script_file",
+    callback=handle_filename,
+    default=None,
+    help="Replay against this script, instead of the script saved in each log",
+)
+@click.option(
+    "--until",
+    metavar="LABEL",
+    default=None,
+    help="Stop before the step LABEL, leaving the session of --script for "
+    "`hacenada next`",
+)
+@click.option("--start-over", "starting_over", is_flag=True)
+def replay_logs(logs, script_file, until, starting_over):
+    """
+    Replay the answers recorded in a session log, or in every log in a directory
 
-    _script = script.Script.from_scriptfile(filename)
-    _opt = session.SessionOptions(renderer=render.InquirerRender())
-    sesh = session.Session(script=_script, storage=_store, options=_opt)
-    if sesh.started and not starting_over:
+    Each step is given its recorded answer without prompting. With --script,
+    replay against a changed script to check that it still accepts past runs;
+    the exit status is non-zero if any log does not replay cleanly.
+
+    With --until (a single log, and --script), the answers before LABEL are put in
+    the script's session so the operator can take over from there.
+    """
+    from hacenada import replay
+
+    _script = _load_script(script_file) if script_file else None
+    found = replay.find_logs(logs)
+
+    if until:
+        _replay_until(found, _script, script_file, until, starting_over)
+        return
+
+    clean = 0
+    for log in found:
+        try:
+            result = replay.replay(log, _script)
+        except (StorageError, ScriptError, ValueError) as e:
+            print(f"** {log}: could not be read: {e}")
+            continue
+        if result.diverged:
+            print(f"** {log}: {result.diverged}, after {result.replayed} steps")
+        elif result.unused:
+            asked = ", ".join(f"[{label}]" for label in result.unused)
+            print(f"** {log}: answers were recorded for steps never reached: {asked}")
+        else:
+            print(f"{log}: {result.replayed} steps replayed")
+            clean += 1
+
+    print(f"{clean} of {len(found)} logs replayed cleanly")
+    if clean < len(found):
+        sys.exit(1)
+
+
+def _replay_until(found, _script, script_file, until, starting_over):
+    """
+    Replay one log into the session of script_file, stopping before the step until
+    """
+    if not _script or len(found) != 1:
+        raise click.UsageError("** --until needs --script and a single log")
+    if _script.template_label(until) not in {step["label"] for step in _script.overlay}:
+        raise click.UsageError(f"** {script_file} has no step [{until}]")
+
+    from hacenada import replay
+
+    if starting_over:
+        storage.HomeDirectoryStorage.drop_path(script_file)
+    _store = storage.HomeDirectoryStorage.from_path(script_file)
+    if len(_store.answer) and not starting_over:
         raise click.UsageError(
-            f"** <{filename}-storage> already contains some answers, "
+            f"** <{script_file}-storage> already contains some answers, "
             "will not overwrite an ongoing session without --start-over"
         )
 
+    result = replay.replay(found[0], _script, _store, until=until)
+    if result.finished:
+        storage.HomeDirectoryStorage.drop_path(script_file)
+        print(f"** [{until}] was skipped in this replay; no session was kept")
+        sys.exit(1)
+    if result.diverged:
+        print(f"** {found[0]}: {result.diverged}")
+    print(
+        f"{result.replayed} steps replayed; "
+        f"run `hacenada next {script_file}` to continue"
+    )
+
+
+@hacenada.command("loadtest")
+@click.option("--backend", type=click.Choice(tuple(storage.ENCODINGS)), default="json")
+@click.option(
+    "--workers", type=click.IntRange(min=1), default=4, help="Worker processes"
+)
+@click.option(
+    "--sessions", type=click.IntRange(min=1), default=10, help="Sessions per worker"
+)
+@click.option(
+    "--steps", type=click.IntRange(min=1), default=20, help="Steps per session"
+)
+@click.option(
+    "--answer-size", type=click.IntRange(min=1), default=16, help="Bytes per answer"
+)
+@click.option(
+    "--home",
+    type=click.Path(file_okay=False, path_type=pathlib.Path),
+    default=None,
+    help="The HACENADA_HOME to share (default: a new temporary directory)",
+)
+def load_test(backend, workers, sessions, steps, answer_size, home):
+    """
+    Measure how a storage backend holds up under many concurrent sessions
+
+    Worker processes run synthetic sessions side by side, answering every step
+    at once. Reports steps per second, step latency percentiles, errors, and
+    sessions whose answers did not read back as they were saved.
+    """
+    from hacenada import loadtest
+
+    with tempfile.TemporaryDirectory(prefix="hacenada-loadtest-") as tmp:
+        stats = loadtest.run(
+            home or pathlib.Path(tmp),
+            backend=backend,
+            workers=workers,
+            sessions=sessions,
+            steps=steps,
+            answer_size=answer_size,
+        )
+    print(stats.report())
+    if stats.errors or stats.corrupted:
+        sys.exit(1)
+
+
+@hacenada.command("export")
+@click.argument("roots", nargs=-1, type=click.Path(exists=True, path_type=pathlib.Path))
+@click.option("--format", default="csv", type=click.Choice(EXPORT_FORMATS))
+@click.option(
+    "-o",
+    "--output",
+    type=click.File("wb"),
+    default="-",
+    help="Where to write (default: stdout)",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    help="Processes parsing logs",
+)
+def export_answers(roots, format, output, jobs):
+    """
+    Export every answer of every session and log, one row per answer
+
+    Sessions are all those in HACENADA_HOME, with the logs of their scripts;
+    logs in any .log.d directory under ROOTS are exported too. Each row has
+    the script, the run (the log, or the session storage) and its date, the
+    step label and type, the value, and when it was answered.
+    """
+    from hacenada import export
+
+    stats = export.ExportStats()
     try:
-        sesh.step_session()
-    except ScriptFinished:
-        _log_and_cleanup(sesh)
+        export.WRITERS[format](export.answer_rows(stats, roots, jobs), output)
+    except ExportError as e:
+        raise click.UsageError(f"** {e}")
+    for failed in stats.failed:
+        click.echo(f"** skipped {failed}", err=True)
+    click.echo(
+        f"{stats.rows} answers from {stats.sessions} sessions and {stats.logs} logs",
+        err=True,
+    )
+    if stats.failed:
+        sys.exit(1)
+
+
+@hacenada.command()
+@click.argument("roots", nargs=-1, type=click.Path(exists=True, path_type=pathlib.Path))
+@click.option(
+    "--days", type=click.IntRange(min=0), help="Compact runs older than this many days"
+)
+@click.option(
+    "--runs",
+    type=click.IntRange(min=0),
+    help="Compact all but this many runs per script",
+)
+@click.option(
+    "--max-bytes",
+    type=click.IntRange(min=0),
+    help="Delete the oldest bundles, then runs, of a script past this size",
+)
+@click.option(
+    "--session-days",
+    type=click.IntRange(min=0),
+    help="Drop sessions not touched for this many days",
+)
+def gc(roots, days, runs, max_bytes, session_days):
+    """
+    Apply the retention policy to logs and sessions, and delete unused answer values
+
+    The logs of each session's script, of every finished run, and in any .log.d
+    under ROOTS, are kept as the script's `retain` table says, with these options filling in for
+    what it leaves out. Large stored answer values that no session or log
+    refers to any more are deleted.
+    """
+    from hacenada import retention
+
+    moved = storage.shard_sessions()
+    if moved:
+        print(f"sessions: {moved} moved into buckets")
+    base = retention.Policy(days=days, runs=runs, max_bytes=max_bytes)
+    kept = retention.collect(base, session_days=session_days, roots=roots)
+    print(
+        f"logs: {kept.compacted} runs compacted, {kept.deleted} files deleted "
+        f"({kept.freed} bytes freed), {kept.unchanged} directories unchanged"
+    )
+    if session_days is not None:
+        print(f"sessions: {kept.sessions} dropped")
+    evicted, pruned = step_cache().evict(), print_cache().prune()
+    print(f"cache: {evicted} entries evicted, {pruned} printed outputs pruned")
+    stats = blob_store().collect()
+    print(
+        f"blobs: {stats.deleted} deleted ({stats.freed} bytes freed), {stats.kept} kept"
+    )
+
+
+@hacenada.group("storage")
+def storage_commands():
+    """
+    Manage how sessions are stored
+    """
+
+
+@storage_commands.command("migrate")
+@click.option(
+    "--to",
+    "to",
+    required=True,
+    type=click.Choice(tuple(storage.ENCODINGS)),
+    help="The encoding to move to",
+)
+@click.option(
+    "--jobs",
+    type=click.IntRange(min=1),
+    default=os.cpu_count() or 1,
+    help="Processes converting sessions",
+)
+def migrate_sessions(to, jobs):
+    """
+    Move every session to another storage encoding
+
+    Each session is converted, read back and compared before it replaces the
+    original. Sessions in use by another hacenada are left alone; run the
+    command again to migrate them, and any left by an interrupted migration.
+    """
+    from hacenada import migrate
+
+    stats = migrate.migrate(to, jobs)
+    for failed in stats.failed:
+        click.echo(f"** failed {failed}", err=True)
+    print(f"{stats.migrated} sessions migrated to {to}, {stats.already} already {to}")
+    if stats.busy:
+        print(
+            f"{stats.busy} sessions in use were left alone; run again to migrate them"
+        )
+    if stats.failed:
+        sys.exit(1)
 
 
-FORMAT_CHOICES = ("toml", "json", "markdown")
+FORMAT_CHOICES = ("toml", "json", "markdown", "ipynb")
 
 
 @hacenada.command("print")
@@ -151,19 +806,113 @@ def print_script(filename, format, with_answers):
     Print the question script in a readable format
 
     With --answers (the default), include the answers from the current session
+
+    FILENAME may also be a log written at the end of a session (json or compact),
+    in which case the answers come from the log.
     """
 
+    if filename and logfile.is_log(filename):
+        _script, _store = logfile.load_log(filename)
+        _print_formatted(format, _script, _store if with_answers else None)
+        return
+
+    # the output is remembered, keyed by the script, the session's storage and format;
+    # formats written incrementally are not, since that would hold the whole output
+    # in memory
+    cache = print_cache()
+    streamed = _writer(format) is not None
+    stored = storage.stored_path(filename) if filename and with_answers else None
+    if filename and (stored or not with_answers) and not streamed:
+        output = cache.fresh(cache.key(filename, stored, format))
+        if output is not None:
+            sys.stdout.write(output)
+            return
+
     if with_answers:
         filename, _store = _find_storage_somehow(filename)
+        stored = _store.path
     else:
-        _store = None
+        _store = stored = None
+    if streamed:
+        _print_formatted(format, _load_script(filename), _store)
+        return
+    key = cache.key(filename, stored, format)
+    try:
+        watched = cache.watch(script.source_files(filename), stored)
+    except ScriptError as e:
+        raise click.UsageError(f"** {filename}: {e}")
+    # read after the signatures are taken, so a change made meanwhile is noticed next
+    # time
+    revision = _store.revision if _store else 0
+    output = cache.get(key, watched, revision)
+    if output is not None:
+        sys.stdout.write(output)
+        return
+
+    _script = _load_script(filename)
+    out = _Tee(sys.stdout)
+    _print_formatted(format, _script, _store, out)
+    cache.put(key, watched, revision, out.getvalue())
 
-    _script = script.Script.from_scriptfile(filename)
 
+class _Tee(io.StringIO):
+    """
+    Write to another stream as well as remembering what was written
+    """
+
+    def __init__(self, other: typing.TextIO):
+        super().__init__()
+        self.other = other
+
+    def write(self, s: str) -> int:
+        self.other.write(s)
+        return super().write(s)
+
+
+def _print_formatted(
+    format: str,
+    _script: script.Script,
+    _store: SessionStorage,
+    out: typing.Optional[typing.TextIO] = None,
+):
+    """
+    Print the script and answers to out (stdout by default) using the format_*
+    function for format
+
+    Formats that have a streaming write_* function are written incrementally instead
+    """
     from hacenada import main
 
+    out = out or sys.stdout
+    writer = _writer(format)
+    if writer:
+        writer(_script, _store, out)
+        return
+
     formatter = getattr(main, f"format_{format}")
-    print(formatter(_script, _store))
+    print(formatter(_script, _store), file=out)
+
+
+def _writer(format: str) -> typing.Optional[typing.Callable]:
+    """
+    The streaming write_* function for format, if it has one
+    """
+    from hacenada import main
+
+    return getattr(main, f"write_{format}", None)
+
+
+def _answers(
+    storage: SessionStorage, resolve_blobs: bool = True
+) -> typing.List[STR_DICT]:
+    """
+    The answers in storage, with the values kept in the blob store in place of their
+    references
+    """
+    if not resolve_blobs:
+        return storage.answer.all()
+    blobs = blob_store()
+    return [dict(a, value=blobs.resolve(a["value"])) for a in storage.answer.all()]
 
 
 def format_toml(script: script.Script, storage: SessionStorage) -> str:
@@ -174,21 +923,29 @@ def format_toml(script: script.Script, storage: SessionStorage) -> str:
     print(toml.dumps({"hacenada": script.preamble}), file=_io)
     print(toml.dumps({"step": script.raw_steps}), file=_io)
     if storage:
-        print(toml.dumps({"answer": storage.answer.all()}), file=_io)
+        print(toml.dumps({"answer": _answers(storage)}), file=_io)
 
     return _io.getvalue()
 
 
-def format_json(script: script.Script, storage: SessionStorage) -> str:
+def format_json(
+    script: script.Script, storage: SessionStorage, resolve_blobs: bool = True
+) -> str:
     """
     Format the steps and answers as json
+
+    Without resolve_blobs, large answers stay references to the blob store, as logs
+    keep them.
     """
     ret = dict(
         hacenada=script.preamble,
         step=script.raw_steps,
     )
     if storage:
-        ret["answer"] = storage.answer.all()
+        ret["answer"] = _answers(storage, resolve_blobs)
+        ret["meta"] = dict(
+            description=storage.description, script_path=str(storage.script_path)
+        )
     return json.dumps(ret, indent=2, default=_json_default_datetime)
 
 
@@ -201,6 +958,32 @@ def _json_default_datetime(o):
     raise TypeError(f"can't encode {o!r}")  # pragma: nocover
 
 
+def _answer_lookup(storage: typing.Optional[SessionStorage]) -> Lookup:
+    """
+    Look up answer values by label in storage (all None without a storage)
+    """
+
+    def _lookup(label: str) -> typing.Any:
+        answered = storage.get_answer(label) if storage else None
+        return answered["value"] if answered else None
+
+    return _lookup
+
+
+def _shown(step: script.Step, value: typing.Any) -> typing.Any:
+    """
+    An answer as it is shown in logs; a wait step's is described
+    """
+    return wait.describe(value) if step["type"] == "wait" else value
+
+
+def _cached(answered: typing.Mapping[str, typing.Any]) -> str:
+    """
+    The note on an answer in logs that it was remembered, rather than given
+    """
+    return "cached, " if answered.get("cached") else ""
+
+
 def format_markdown(script: script.Script, storage: SessionStorage) -> str:
     """
     Form steps and answers as markdown
@@ -209,14 +992,14 @@ def format_markdown(script: script.Script, storage: SessionStorage) -> str:
     human-readable document
     """
     _io = io.StringIO()
-    print(f"# {script.preamble['name'] or storage.script_path}\n", file=_io)
-    print(f"{script.preamble['description'] or ''}\n", file=_io)
+    print(f"# {script.preamble.get('name') or storage.script_path}\n", file=_io)
+    print(f"{script.preamble.get('description') or ''}\n", file=_io)
     if storage and storage.description:
         desc = storage.description.replace("\n", " ").strip()
         print(f"### Current: **{desc}**\n", file=_io)
 
     print("## Steps\n", file=_io)
-    for step in script.overlay:
+    for step in script.steps(_answer_lookup(storage), show_templates=True):
         label = step["label"]
         print(f"[{label}]  {step['message'].strip()}\n", file=_io)
         # TODO: depending on step['type'], format and print interactive choices
@@ -225,7 +1008,14 @@ def format_markdown(script: script.Script, storage: SessionStorage) -> str:
             _answered = storage.get_answer(label)
             if _answered:
                 local_when = _answered["when"].astimezone().ctime()
-                print(f"**>> {_answered['value']} <<** ({local_when})\n", file=_io)
+                if _answered.get("skipped"):
+                    print(f"**(skipped)** ({local_when})\n", file=_io)
+                else:
+                    shown = _shown(step, _answered["value"])
+                    print(
+                        f"**>> {shown} <<** ({_cached(_answered)}{local_when})\n",
+                        file=_io,
+                    )
 
         if step["stop"]:
             print("------\n", file=_io)
@@ -233,30 +1023,114 @@ def format_markdown(script: script.Script, storage: SessionStorage) -> str:
     return _io.getvalue()
 
 
+IPYNB_HEADER = (
+    '{\n "nbformat": 4,\n "nbformat_minor": 4,\n "metadata": {},\n "cells": [\n'
+)
+IPYNB_FOOTER = "\n ]\n}\n"
+
+
+def write_ipynb(script: script.Script, storage: SessionStorage, out: typing.TextIO):
+    """
+    Write steps and answers as a Jupyter notebook, one cell at a time
+
+    Each step is a markdown cell; an answer follows as a markdown cell, or for
+    multi-line values (such as captured output) as a code cell holding the
+    value as its output. Nothing is accumulated, so memory use stays flat for
+    sessions of any length.
+    """
+
+    def _markdown(text: str) -> STR_DICT:
+        return dict(cell_type="markdown", metadata={}, source=text)
+
+    def _cells() -> typing.Iterator[STR_DICT]:
+        title = [f"# {script.preamble.get('name') or storage.script_path}\n"]
+        title.append(f"{script.preamble.get('description') or ''}\n")
+        if storage and storage.description:
+            desc = storage.description.replace("\n", " ").strip()
+            title.append(f"### Current: **{desc}**\n")
+        yield _markdown("\n".join(title))
+
+        answered = {a["label"]: a for a in storage.answer} if storage else {}
+        blobs = blob_store()
+        for step in script.steps(_answer_lookup(storage), show_templates=True):
+            label = step["label"]
+            yield _markdown(f"[{label}]  {step['message'].strip()}")
+
+            _answered = answered.get(label)
+            if not _answered:
+                continue
+            local_when = _answered["when"].astimezone().ctime()
+            value = blobs.resolve(_answered["value"])
+            if _answered.get("skipped"):
+                yield _markdown(f"**(skipped)** ({local_when})")
+            elif isinstance(value, str) and "\n" in value.strip():
+                output = dict(output_type="stream", name="stdout", text=value)
+                yield dict(
+                    cell_type="code",
+                    execution_count=None,
+                    metadata=dict(hacenada=dict(label=label, when=local_when)),
+                    outputs=[output],
+                    source="",
+                )
+            else:
+                shown = _shown(step, value)
+                yield _markdown(f"**>> {shown} <<** ({_cached(_answered)}{local_when})")
+
+    out.write(IPYNB_HEADER)
+    for n, cell in enumerate(_cells()):
+        if n:
+            out.write(",\n")
+        out.write("  ")
+        out.write(json.dumps(cell, default=_json_default_datetime))
+    out.write(IPYNB_FOOTER)
+
+
 def _log_path(script_path: pathlib.Path, description: str) -> pathlib.Path:
     """
     What filename will the log for this session have?
     """
+    from hacenada import retention
+
     logd_path = script_path.with_suffix(".log.d")
     logd_path.mkdir(exist_ok=True)
     dt = datetime.date.today().isoformat()
-    counter = len(list(logd_path.glob(f"{dt}*.log"))) + 1
+    counter = (
+        len(list(logd_path.glob(f"{dt}*.log")))
+        + len(retention.bundled(logd_path, dt))
+        + 1
+    )
     # make the description more url-like
     desc = urllib.parse.quote_plus(" ".join(description.split()))
 
     return logd_path / f"{dt}-{counter}--{desc}.log"
 
 
-def _log_and_cleanup(sesh: session.Session):
+def log_and_cleanup(sesh: session.Session) -> pathlib.Path:
     """
-    When done, write some logs and drop the db
+    When done, write some logs and drop the db, returning the markdown log's path
     """
     log_md = format_markdown(sesh.script, sesh.storage)
     fn_md = _log_path(sesh.storage.script_path, sesh.storage.description)
     fn_md.write_text(log_md)
-    log_json = format_json(sesh.script, sesh.storage)
-    fn_json = fn_md.with_suffix(".json")
-    fn_json.write_text(log_json)
+    if sesh.storage.encoding == "compact":
+        fn_log = logfile.write_compact(
+            fn_md.with_suffix(storage.ENCODINGS["compact"]), sesh.script, sesh.storage
+        )
+    else:
+        log_json = format_json(sesh.script, sesh.storage, resolve_blobs=False)
+        fn_log = fn_md.with_suffix(".json")
+        fn_log.write_text(log_json)
+    if any(blob.is_ref(a["value"]) for a in sesh.storage.answer):
+        blob_store().add_referrer(fn_log)
+    with fn_md.with_suffix(".ipynb").open("w") as fn_ipynb:
+        write_ipynb(sesh.script, sesh.storage, fn_ipynb)
+
+    from hacenada import retention
+
+    if "retain" in sesh.script.preamble:
+        retention.enforce([fn_md.parent])
+    else:
+        retention.remember(fn_md.parent)
 
-    print(f"{sesh.storage.script_path}: Cleaning up.  Log: {fn_md}")
     sesh.storage.drop()
+    return fn_md
@@ -0,0 +1,136 @@
+"""
+A cache of the answers of automated steps, so they aren't redone when nothing changed
+
+A wait step with `cache` set remembers its answer when its check succeeds,
+under a digest of the step (its type, message, condition and check) and the
+earlier answers it refers to. When a step with the same content is reached
+again with the same answers, in this session or a later one (even after
+--start-over), the remembered answer is used at once and recorded as cached.
+
+Each entry lives until its time to live passes. When the cache holds more than
+MAX_ENTRIES, the least recently used entries are evicted.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+import typing
+
+import attr
+
+from hacenada.const import STR_DICT
+
+
+# how long an answer is remembered, in seconds, for `cache = true`
+DEFAULT_TTL = 24 * 60 * 60
+
+MAX_ENTRIES = 500
+
+
+def cache_key(step: typing.Mapping[str, typing.Any], answers: STR_DICT) -> str:
+    """
+    The key of step's answer, given the values of the earlier answers it refers to
+    """
+    content = [
+        step["type"],
+        step["message"],
+        step.get("when"),
+        step.get("check"),
+        sorted(answers.items()),
+    ]
+    return hashlib.sha256(json.dumps(content, default=str).encode("utf-8")).hexdigest()
+
+
+def ttl_of(step: typing.Mapping[str, typing.Any]) -> typing.Optional[float]:
+    """
+    How long step's answer is remembered, or None if it isn't cached
+    """
+    cache = step.get("cache", False)
+    if cache is False:
+        return None
+    return DEFAULT_TTL if cache is True else float(cache)
+
+
+@attr.s(auto_attribs=True)
+class StepCache:
+    """
+    Remembered answers, one json file per key under root
+    """
+
+    root: Path
+    max_entries: int = MAX_ENTRIES
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def get(self, key: str, now: typing.Optional[float] = None) -> typing.Any:
+        """
+        The answer remembered under key, or None if there is none, it expired, or it
+        can't be read
+        """
+        now = time.time() if now is None else now
+        path = self._path(key)
+        try:
+            entry = json.loads(path.read_text())
+            expired = entry["expires"] <= now
+            value = entry["value"]
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+        if expired:
+            path.unlink()
+            return None
+        # the modification time says when an entry was last used, for eviction
+        os.utime(path, (now, now))
+        return value
+
+    def put(
+        self,
+        key: str,
+        value: typing.Any,
+        ttl: float,
+        now: typing.Optional[float] = None,
+    ):
+        """
+        Remember value under key for ttl seconds
+        """
+        now = time.time() if now is None else now
+        self.root.mkdir(parents=True, exist_ok=True)
+        entry = dict(value=value, expires=now + ttl)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f, default=str)
+        os.replace(tmp, self._path(key))
+        os.utime(self._path(key), (now, now))
+        if len(list(self.root.glob("*.json"))) > self.max_entries:
+            self.evict(now)
+
+    def evict(self, now: typing.Optional[float] = None) -> int:
+        """
+        Delete expired entries, then the least recently used beyond max_entries
+
+        Returns how many entries were deleted.
+        """
+        now = time.time() if now is None else now
+        if not self.root.is_dir():
+            return 0
+        live = []
+        deleted = 0
+        for path in self.root.glob("*.json"):
+            try:
+                expires = json.loads(path.read_text())["expires"]
+            except (OSError, ValueError, KeyError):
+                expires = now
+            if expires <= now:
+                path.unlink()
+                deleted += 1
+            else:
+                live.append((path.stat().st_mtime, path))
+        live.sort()
+        for _, path in live[: max(len(live) - self.max_entries, 0)]:
+            path.unlink()
+            deleted += 1
+        return deleted
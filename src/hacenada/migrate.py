@@ -0,0 +1,153 @@
+"""
+Move every session in HACENADA_HOME to another storage encoding
+
+Each session is converted while holding its lock, so a session in use by
+another hacenada is left alone (and counted as busy) rather than waited for.
+The converted storage is written aside, in STAGING, and read back; only when
+its to_structured() matches the original does it replace the original.
+
+Migration can be interrupted and run again: the sessions not yet in the new
+encoding are the ones left to do. If it was interrupted after a session's new
+storage was put in place but before the old one was removed, the one hacenada
+would open is kept (json, when both are present), and the other is replaced or
+removed.
+"""
+from __future__ import annotations
+
+import functools
+import multiprocessing
+import os
+from pathlib import Path
+import typing
+
+import attr
+
+from hacenada import blob, error, export, storage
+
+
+# where converted storages are written before they are checked, in HACENADA_HOME
+STAGING = "migrating"
+
+
+@attr.s(auto_attribs=True)
+class Migrated:
+    """
+    What happened to one session
+    """
+
+    path: Path
+    status: str  # "migrated", "busy", "gone" or "failed"
+    error: str = ""
+
+
+@attr.s(auto_attribs=True)
+class MigrateStats:
+    """
+    What a migration did
+    """
+
+    migrated: int = 0
+    already: int = 0
+    busy: int = 0
+    failed: typing.List[str] = attr.Factory(list)
+
+
+def _preferred(stored: Path) -> Path:
+    """
+    Of the storages of stored's session in every encoding, the one hacenada opens
+    """
+    candidates = [stored.with_suffix(suffix) for suffix in storage.ENCODINGS.values()]
+    return next(p for p in candidates if p.exists())
+
+
+def _read(stored: Path) -> typing.Dict:
+    """
+    The structured data of the session stored at stored
+    """
+    store = storage.HomeDirectoryStorage._from_json_path(stored)
+    try:
+        return store.to_structured()
+    finally:
+        store.db.close()
+
+
+def _convert(stored: Path, target: Path):
+    """
+    Write the session at stored in target's encoding, check it, and put it in place
+    of stored
+    """
+    data = _read(stored)
+    staged = storage.HACENADA_HOME / STAGING / target.name
+    staged.parent.mkdir(parents=True, exist_ok=True)
+    if staged.exists():
+        staged.unlink()
+    storage.HomeDirectoryStorage.from_structured(data, staged).db.close()
+    if _read(staged) != data:
+        raise error.StorageError(f"{staged} did not read back the same as {stored}")
+
+    os.replace(staged, target)
+    if blob.mentions(target):
+        storage.blob_store().add_referrer(target)
+
+
+def migrate_one(stored: Path, to: str) -> Migrated:
+    """
+    Move the session at stored to the encoding to, unless another hacenada holds it
+    """
+    target = stored.with_suffix(storage.ENCODINGS[to])
+    try:
+        with storage.locked(stored, timeout=0):
+            if not stored.exists():
+                return Migrated(stored, "gone")
+            if _preferred(stored) != target:
+                _convert(stored, target)
+            stored.unlink()
+    except error.StorageBusy:
+        return Migrated(stored, "busy")
+    except Exception as e:
+        return Migrated(stored, "failed", f"{stored}: {e}")
+    return Migrated(stored, "migrated")
+
+
+def _init_worker(home: Path):  # pragma: nocover
+    """
+    Share this process's HACENADA_HOME with a worker
+    """
+    storage.HACENADA_HOME = home
+
+
+def _migrated(
+    sessions: typing.List[Path], to: str, jobs: int
+) -> typing.Iterator[Migrated]:
+    """
+    Migrate sessions in a pool of jobs processes (or in this one, with 1), as each
+    finishes
+    """
+    convert = functools.partial(migrate_one, to=to)
+    if jobs <= 1:
+        yield from map(convert, sessions)
+        return
+    with multiprocessing.Pool(jobs, _init_worker, (storage.HACENADA_HOME,)) as pool:
+        yield from pool.imap_unordered(convert, sessions)
+
+
+def migrate(to: str, jobs: int = 1) -> MigrateStats:
+    """
+    Move every session in HACENADA_HOME to the encoding to, jobs at a time
+    """
+    suffix = storage.ENCODINGS[to]
+    stored = export.session_files(storage.HACENADA_HOME)
+    sessions = [p for p in stored if p.suffix != suffix]
+    # a session in both encodings is counted once, as it's migrated
+    left = {p.stem for p in sessions}
+    stats = MigrateStats(
+        already=sum(1 for p in stored if p.suffix == suffix and p.stem not in left)
+    )
+    for result in _migrated(sessions, to, jobs):
+        if result.status == "migrated":
+            stats.migrated += 1
+        elif result.status == "busy":
+            stats.busy += 1
+        elif result.status == "failed":
+            stats.failed.append(result.error)
+    return stats
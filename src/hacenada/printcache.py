@@ -0,0 +1,160 @@
+"""
+A cache of `hacenada print` output, so printing an unchanged session again is cheap
+
+An entry is kept for each script, session storage and format printed. It
+records the output, the session's revision (see HomeDirectoryStorage.revision),
+a digest of the contents of the script and its included fragments, and the
+stat signature of each of those files.
+
+When no file's signature has changed, the output is used without opening the
+script or the storage at all (fresh()). When a signature changed but the
+contents and revision did not (a file was touched, or copied back), the output
+is used too, and the signatures are brought up to date (get()).
+
+A file can be written again without its signature changing, if it keeps its
+size and is written within the resolution of its filesystem's timestamps.
+As git does with its index, an entry is only fresh when every file's
+modification time is well before its signatures were taken; until then the
+contents and revision are checked each time.
+"""
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import tempfile
+import time
+import typing
+
+import attr
+
+from hacenada.const import STR_DICT
+from hacenada.watch import signature
+
+
+# how long before its signature is taken a file must have been written for the
+# signature to be trusted: mtimes are as coarse as 2s (FAT), and NFS caches them
+RACY_NS = 2 * 10**9
+
+
+def _signature(path: str) -> typing.Optional[typing.List[int]]:
+    """
+    path's signature, as it is stored in an entry
+    """
+    sig = signature(Path(path))
+    return None if sig is None else list(sig)
+
+
+@attr.s(auto_attribs=True)
+class PrintCache:
+    """
+    Printed output, one json file per script, storage and format under root
+    """
+
+    root: Path
+
+    def key(self, script_path: Path, stored: typing.Optional[Path], format: str) -> str:
+        """
+        The key of the output of printing script_path, with the answers in stored if
+        any, in format
+        """
+        content = [str(Path(script_path).absolute()), str(stored or ""), format]
+        return hashlib.sha256(json.dumps(content).encode("utf-8")).hexdigest()
+
+    def _path(self, key: str) -> Path:
+        return self.root / f"{key}.json"
+
+    def _read(self, key: str) -> typing.Optional[STR_DICT]:
+        try:
+            return json.loads(self._path(key).read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _write(self, key: str, entry: STR_DICT):
+        self.root.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.root, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(entry, f)
+        os.replace(tmp, self._path(key))
+
+    @staticmethod
+    def watch(sources: typing.List[Path], stored: typing.Optional[Path]) -> STR_DICT:
+        """
+        The signatures of sources and stored, and a digest of the contents of sources
+
+        The signatures are taken first, so a file written while this runs is
+        seen as changed by the next fresh().
+        """
+        taken = time.time_ns()
+        files = [str(p) for p in sources] + ([str(stored)] if stored else [])
+        signatures = [[f, _signature(f)] for f in files]
+        digest = hashlib.sha256()
+        for path in sources:
+            digest.update(path.read_bytes())
+        return dict(signatures=signatures, digest=digest.hexdigest(), taken=taken)
+
+    @staticmethod
+    def _racy(entry: STR_DICT) -> bool:
+        """
+        Could a file of entry have changed since, without its signature changing?
+        """
+        taken = entry.get("taken", 0)
+        return any(
+            sig is not None and sig[0] + RACY_NS >= taken
+            for _, sig in entry["signatures"]
+        )
+
+    def fresh(self, key: str) -> typing.Optional[str]:
+        """
+        The output under key if none of the files it came from changed, looking only
+        at their stat
+        """
+        entry = self._read(key)
+        if entry is None:
+            return None
+        if any(_signature(f) != sig for f, sig in entry["signatures"]):
+            return None
+        if self._racy(entry):
+            return None
+        return entry["output"]
+
+    def get(self, key: str, watched: STR_DICT, revision: int) -> typing.Optional[str]:
+        """
+        The output under key if it came from the same contents (see watch()) and
+        revision
+        """
+        entry = self._read(key)
+        if entry is None or (entry["digest"], entry["revision"]) != (
+            watched["digest"],
+            revision,
+        ):
+            return None
+        if entry["signatures"] != watched["signatures"] or self._racy(entry):
+            signatures, taken = watched["signatures"], watched["taken"]
+            self._write(key, dict(entry, signatures=signatures, taken=taken))
+        return entry["output"]
+
+    def put(self, key: str, watched: STR_DICT, revision: int, output: str):
+        """
+        Remember output under key, as printed from the contents watched and revision
+        """
+        self._write(key, dict(watched, revision=revision, output=output))
+
+    def prune(self) -> int:
+        """
+        Delete entries whose script or storage is gone, and any that can't be read
+
+        Returns how many entries were deleted.
+        """
+        if not self.root.is_dir():
+            return 0
+        deleted = 0
+        for path in self.root.glob("*.json"):
+            entry = self._read(path.stem)
+            if entry is None or any(
+                not os.path.exists(f) for f, _ in entry["signatures"]
+            ):
+                path.unlink()
+                deleted += 1
+        return deleted
@@ -1,14 +1,41 @@
 """
 Render (or execute) steps
+
+inquirer, and the terminal libraries it brings, are only imported when an
+InquirerRender first renders a step; PlainRender needs nothing outside the
+standard library.
 """
+import os
+import sys
 import typing
 
-import inquirer
+import attr
 
+from hacenada import error
 from hacenada.abstract import Render
-from hacenada.const import STR_DICT
+from hacenada.const import STEP_TYPES, STR_DICT
 from hacenada.script import Step
 from hacenada.session import Session
+from hacenada.storage import Answer, blob_store
+
+
+def _title(step: Step, context: Session) -> str:
+    """
+    The line shown above each step: the session description (or script name) and label
+    """
+    if context.storage.description:
+        return f"{context.storage.description} : {step['label']}"
+    return f"{context.script.preamble['name']} : {step['label']}"
+
+
+# step types answered yes or no; every other step type takes a line of text
+CONFIRM_TYPES = ("message", "confirm")
+
+# the inquirer question type of each step type a renderer can display
+INQUIRER_QUESTIONS = {
+    typename: "confirm" if typename in CONFIRM_TYPES else "text"
+    for typename in STEP_TYPES
+}
 
 
 class InquirerRender(Render):
@@ -21,17 +48,9 @@ class InquirerRender(Render):
         """
         Return the inquirer question type for the given type name
         """
-        functions = {
-            "description": "text",
-            "input": "text",
-            "message": "confirm",
-            "confirm": "confirm",
-            # "editor": "editor",
-            # "choice": "choice",
-            # "password": "password",
-        }
+        import inquirer
 
-        return getattr(inquirer, functions[typename])
+        return getattr(inquirer, INQUIRER_QUESTIONS[typename])
 
     def render(self, step: Step, context: Session) -> STR_DICT:
         """
@@ -39,14 +58,103 @@ class InquirerRender(Render):
         """
         pyinq_prompt = self._inquirer_dispatch(step["type"])
 
-        if context.storage.description:
-            title = f"{context.storage.description} : {step['label']}"
-        else:
-            title = f"{context.script.preamble['name']} : {step['label']}"
-
-        message = f"{title}\n" f"{step['message']}\n>>"
+        message = f"{_title(step, context)}\n" f"{step['message']}\n>>"
 
         answered = pyinq_prompt(message)
 
         # FIXME: just return an Answer here
         return {step["label"]: answered}
+
+
+class PlainRender(Render):
+    """
+    Render with plain input() prompts, for pipes, dumb terminals and serial consoles
+    """
+
+    def _ask(self, prompt: str) -> str:
+        try:
+            return input(prompt)
+        except EOFError:
+            raise error.RenderError("no answer given (end of input)")
+
+    def render(self, step: Step, context: Session) -> STR_DICT:
+        """
+        Output a question to stdout, and read the answer from stdin
+        """
+        print(f"{_title(step, context)}\n{step['message']}")
+        if step["type"] not in CONFIRM_TYPES:
+            return {step["label"]: self._ask(">> ")}
+
+        while True:
+            reply = self._ask(">> Done? [Y/n] ").strip().lower()
+            if reply in ("", "y", "yes"):
+                return {step["label"]: True}
+            if reply in ("n", "no"):
+                return {step["label"]: False}
+
+
+RENDERERS: typing.Dict[str, typing.Type[Render]] = {
+    "inquirer": InquirerRender,
+    "plain": PlainRender,
+}
+
+
+def is_full_terminal() -> bool:
+    """
+    Are stdin and stdout a terminal capable of inquirer's interactive prompts?
+    """
+    term = os.environ.get("TERM", "")
+    return sys.stdin.isatty() and sys.stdout.isatty() and term not in ("", "dumb")
+
+
+def choose_renderer(name: str = "auto") -> Render:
+    """
+    The renderer called name; "auto" is inquirer on a full terminal, plain otherwise
+    """
+    if name == "auto":
+        name = "inquirer" if is_full_terminal() else "plain"
+    return RENDERERS[name]()
+
+
+@attr.s(auto_attribs=True)
+class ReplayRender(Render):
+    """
+    Render without a device, giving each step the answer recorded for it in a log
+    """
+
+    answers: STR_DICT
+    until: typing.Optional[str] = None
+    given: typing.List[str] = attr.Factory(list)
+
+    @classmethod
+    def from_answers(
+        cls, answers: typing.Iterable[Answer], until: typing.Optional[str] = None
+    ) -> "ReplayRender":
+        """
+        Constructor, from the answers of a log; skipped steps have no answer to give
+        """
+        blobs = blob_store()
+        recorded = {
+            a["label"]: blobs.resolve(a["value"])
+            for a in answers
+            if not a.get("skipped")
+        }
+        return cls(answers=recorded, until=until)
+
+    def render(self, step: Step, context: Session) -> STR_DICT:
+        """
+        Answer the step as it was answered before, stopping at the `until` label
+        """
+        label = step["label"]
+        if label == self.until:
+            raise error.ReplayStopped(f"stopped at [{label}]")
+        if label not in self.answers:
+            raise error.ReplayDiverged(f"no answer was recorded for [{label}]")
+        self.given.append(label)
+        return {label: self.answers[label]}
+
+    def render_waits(self, steps: typing.List[Step], context: Session) -> STR_DICT:
+        """
+        Answer wait steps as they were answered before, without running their checks
+        """
+        return {k: v for step in steps for k, v in self.render(step, context).items()}
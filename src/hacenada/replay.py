@@ -0,0 +1,79 @@
+"""
+Replay finished sessions from their logs
+
+A replay gives each step of a script the answer recorded for it in a log,
+without prompting. Replaying past logs against a changed script shows whether
+the script still accepts those runs; replaying up to a label fills in a live
+session so the operator can take over from there.
+"""
+from __future__ import annotations
+
+from pathlib import Path
+import typing
+
+import attr
+
+from hacenada import error, logfile, render, session
+from hacenada.abstract import SessionStorage
+from hacenada.script import Script
+from hacenada.storage import HomeDirectoryStorage
+
+
+@attr.s(auto_attribs=True)
+class ReplayResult:
+    """
+    What replaying one log did
+    """
+
+    log: Path
+    replayed: int = 0
+    finished: bool = False
+    stopped: bool = False
+    diverged: str = ""
+    unused: typing.List[str] = attr.Factory(list)
+
+
+def replay(
+    log: Path,
+    script: typing.Optional[Script] = None,
+    storage: typing.Optional[SessionStorage] = None,
+    until: typing.Optional[str] = None,
+) -> ReplayResult:
+    """
+    Replay the answers in log against script (by default, the script in the log)
+
+    Answers go to storage, or to a throwaway in-memory storage when none is given.
+    With until, stop before the step with that label.
+    """
+    data = logfile.read_log(log)
+    script = script or Script.from_structured(data)
+    storage = storage or HomeDirectoryStorage.from_structured({})
+    renderer = render.ReplayRender.from_answers(data["answer"], until=until)
+    options = session.SessionOptions(renderer=renderer, quiet=True)
+    sesh = session.Session(storage=storage, script=script, options=options)
+    sesh.reconcile()
+
+    result = ReplayResult(log=Path(log))
+    try:
+        while True:
+            sesh.step_session()
+    except error.ScriptFinished:
+        result.finished = True
+        result.unused = [k for k in renderer.answers if k not in renderer.given]
+    except error.ReplayStopped:
+        result.stopped = True
+    except error.ReplayDiverged as e:
+        result.diverged = str(e)
+
+    result.replayed = len(renderer.given)
+    return result
+
+
+def find_logs(path: Path) -> typing.List[Path]:
+    """
+    The log at path, or every log in the directory at path, in name order
+    """
+    path = Path(path)
+    if not path.is_dir():
+        return [path]
+    return sorted(p for p in path.iterdir() if p.suffix in logfile.LOG_SUFFIXES)
@@ -0,0 +1,287 @@
+"""
+Build a static HTML report site from the logs of every run of a script
+
+The site has an index of runs, a page per run, and a page per step label with
+the history of its answers across runs. A manifest in the site directory
+remembers what each page was built from, so rebuilding only touches pages for
+logs that were added, changed or removed since the last build.
+"""
+from __future__ import annotations
+
+import hashlib
+import html
+import json
+import os
+from pathlib import Path
+import re
+import typing
+
+import attr
+
+from hacenada import error, logfile
+from hacenada.script import Script
+from hacenada.storage import blob_store
+
+
+MANIFEST = "manifest.json"
+MANIFEST_VERSION = 1
+
+# how much of an answer to show on the label history pages
+PREVIEW_LENGTH = 200
+
+STYLE = """
+body { font-family: sans-serif; max-width: 60em; margin: auto; }
+pre { background: #f4f4f4; padding: 0.5em; white-space: pre-wrap; }
+table { border-collapse: collapse; }
+td, th {
+    border: 1px solid #ccc; padding: 0.25em 0.5em;
+    vertical-align: top; text-align: left;
+}
+"""
+
+
+@attr.s(auto_attribs=True)
+class ReportStats:
+    """
+    What a build did
+    """
+
+    runs: int = 0
+    built: int = 0
+    removed: int = 0
+    labels: int = 0
+    index: bool = False
+    failed: typing.List[str] = attr.Factory(list)
+
+
+def _safe_name(s: str) -> str:
+    """
+    A filename for a page about s
+    """
+    return re.sub(r"[^\w.-]+", "_", s)
+
+
+def run_page(log_name: str) -> str:
+    """
+    The site-relative path of the page for a log
+    """
+    return f"runs/{_safe_name(Path(log_name).stem)}.html"
+
+
+def label_page(label: str) -> str:
+    """
+    The site-relative path of the answer history page for a label
+    """
+    digest = hashlib.sha1(label.encode("utf-8")).hexdigest()[:8]
+    return f"labels/{_safe_name(label)}-{digest}.html"
+
+
+def _sort_key(log_name: str) -> typing.Tuple[str, int, str]:
+    """
+    Order logs by date, then by the run counter within the date
+    """
+    m = re.match(r"(\d{4}-\d\d-\d\d)-(\d+)--", log_name)
+    if m:
+        return (m.group(1), int(m.group(2)), log_name)
+    return ("", 0, log_name)
+
+
+def _page(title: str, body: str, depth: int = 0) -> str:
+    """
+    A complete html document
+    """
+    up = "../" * depth
+    return (
+        "<!DOCTYPE html>\n<html><head><meta charset='utf-8'>"
+        f"<title>{html.escape(title)}</title><style>{STYLE}</style></head>\n"
+        f"<body><p><a href='{up}index.html'>All runs</a></p>\n"
+        f"<h1>{html.escape(title)}</h1>\n{body}\n</body></html>\n"
+    )
+
+
+def _value(value: typing.Any) -> str:
+    return "" if value is None else str(value)
+
+
+def _summarize(log_name: str, data: typing.Dict) -> typing.Dict:
+    """
+    The manifest entry for a parsed log
+    """
+    answers = []
+    blobs = blob_store()
+    for answer in data["answer"]:
+        value = _value(blobs.resolve(answer["value"]))
+        if len(value) > PREVIEW_LENGTH:
+            value = value[:PREVIEW_LENGTH] + "…"
+        answers.append([answer["label"], value, answer["when"].isoformat()])
+
+    return dict(
+        name=data["hacenada"].get("name") or "",
+        description=data["meta"].get("description") or "",
+        page=run_page(log_name),
+        answers=answers,
+    )
+
+
+def _render_run(log_name: str, data: typing.Dict) -> str:
+    """
+    The page for a single run, with every step and its full answer
+    """
+    answers = {a["label"]: a for a in data["answer"]}
+    blobs = blob_store()
+    parts = [f"<p>{html.escape(data['meta'].get('description') or '')}</p>"]
+    parts.append(f"<p>Log: <code>{html.escape(log_name)}</code></p>")
+
+    script = Script.from_structured(data)
+
+    def _lookup(label: str) -> typing.Any:
+        return blobs.resolve(answers[label]["value"]) if label in answers else None
+
+    for step in script.steps(_lookup, show_templates=True):
+        label = step["label"]
+        answer = answers.get(label)
+        heading = f"[{html.escape(label)}]"
+        if answer:
+            href = html.escape("../" + label_page(label))
+            heading = f"<a href='{href}'>{heading}</a>"
+        parts.append(
+            f"<h3>{heading}</h3><pre>{html.escape(step['message'].strip())}</pre>"
+        )
+        if answer and answer.get("skipped"):
+            when = answer["when"].astimezone().ctime()
+            parts.append(f"<p>Skipped {html.escape(when)}</p>")
+        elif answer:
+            when = answer["when"].astimezone().ctime()
+            value = _value(blobs.resolve(answer["value"]))
+            parts.append(
+                f"<p>Answered {html.escape(when)}:</p>"
+                f"<pre>{html.escape(value)}</pre>"
+            )
+
+    return _page(data["hacenada"].get("name") or log_name, "\n".join(parts), depth=1)
+
+
+def _label_histories(
+    labels: typing.Set[str], runs: typing.Dict[str, typing.Dict]
+) -> typing.Dict[str, typing.List[str]]:
+    """
+    Table rows of answer history for each of labels, newest run first, in one pass
+    """
+    ret: typing.Dict[str, typing.List[str]] = {}
+    for log_name in sorted(runs, key=_sort_key, reverse=True):
+        entry = runs[log_name]
+        href = html.escape("../" + entry["page"])
+        for label, value, when in entry["answers"]:
+            if label in labels:
+                ret.setdefault(label, []).append(
+                    f"<tr><td><a href='{href}'>{html.escape(log_name)}</a></td>"
+                    f"<td>{html.escape(when)}</td>"
+                    f"<td><pre>{html.escape(value)}</pre></td></tr>"
+                )
+    return ret
+
+
+def _render_label(label: str, rows: typing.List[str]) -> str:
+    """
+    The answer history page for a label across all runs
+    """
+    body = "<table><tr><th>Run</th><th>When</th><th>Answer</th></tr>\n"
+    body += "\n".join(rows) + "</table>"
+    return _page(f"History of [{label}]", body, depth=1)
+
+
+def _render_index(title: str, runs: typing.Dict[str, typing.Dict]) -> str:
+    """
+    The index of all runs, newest first
+    """
+    rows = []
+    for log_name in sorted(runs, key=_sort_key, reverse=True):
+        entry = runs[log_name]
+        rows.append(
+            f"<tr><td><a href='{html.escape(entry['page'])}'>"
+            f"{html.escape(log_name)}</a></td>"
+            f"<td>{html.escape(entry['description'])}</td>"
+            f"<td>{len(entry['answers'])}</td></tr>"
+        )
+
+    body = f"<p>{len(runs)} runs</p>\n"
+    body += "<table><tr><th>Run</th><th>Description</th><th>Answers</th></tr>\n"
+    body += "\n".join(rows) + "</table>"
+    return _page(title, body)
+
+
+def _write(outdir: Path, relpath: str, content: str):
+    path = outdir / relpath
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(content)
+
+
+def build(logd: Path, outdir: Path, title: str = "") -> ReportStats:
+    """
+    Bring the site in outdir up to date with the logs in logd
+    """
+    manifest_path = outdir / MANIFEST
+    runs: typing.Dict[str, typing.Dict] = {}
+    if manifest_path.exists():
+        manifest = json.loads(manifest_path.read_text())
+        if manifest.get("version") == MANIFEST_VERSION:
+            runs = manifest["runs"]
+
+    present = {}
+    if logd.is_dir():
+        with os.scandir(logd) as dirents:
+            for dirent in dirents:
+                if Path(dirent.name).suffix in logfile.LOG_SUFFIXES:
+                    st = dirent.stat()
+                    present[dirent.name] = [st.st_mtime_ns, st.st_size]
+
+    stats = ReportStats()
+    touched_labels = set()
+
+    for log_name in set(runs) - set(present):
+        for label, _, _ in runs[log_name]["answers"]:
+            touched_labels.add(label)
+        (outdir / runs.pop(log_name)["page"]).unlink(missing_ok=True)
+        stats.removed += 1
+
+    for log_name, signature in present.items():
+        known = runs.get(log_name)
+        if known and known["signature"] == signature:
+            continue
+
+        try:
+            data = logfile.read_log(logd / log_name)
+            page = _render_run(log_name, data)
+        except (error.StorageError, error.ScriptError, ValueError):
+            stats.failed.append(log_name)
+            continue
+
+        entry = _summarize(log_name, data)
+        entry["signature"] = signature
+        for answers in (known or {}).get("answers", []), entry["answers"]:
+            touched_labels.update(label for label, _, _ in answers)
+        _write(outdir, entry["page"], page)
+        runs[log_name] = entry
+        stats.built += 1
+
+    histories = _label_histories(touched_labels, runs) if touched_labels else {}
+    for label in touched_labels:
+        if label in histories:
+            _write(outdir, label_page(label), _render_label(label, histories[label]))
+        else:
+            (outdir / label_page(label)).unlink(missing_ok=True)
+    stats.labels = len(touched_labels)
+
+    if stats.built or stats.removed or not (outdir / "index.html").exists():
+        names = (e["name"] for e in runs.values() if e["name"])
+        title = title or next(names, str(logd))
+        _write(outdir, "index.html", _render_index(title, runs))
+        stats.index = True
+        _write(
+            outdir,
+            MANIFEST,
+            json.dumps(dict(version=MANIFEST_VERSION, runs=runs)),
+        )
+
+    stats.runs = len(runs)
+    return stats
@@ -0,0 +1,319 @@
+"""
+Retention of logs and sessions: compact old runs, drop abandoned sessions
+
+A run is the files a finished session left in its script's .log.d (the
+markdown, machine-readable and notebook logs, which share a name). A policy
+keeps the runs newer than some days and the newest some number of runs; the
+others are compacted into a zip bundle per month, in the same directory. If
+the directory is still larger than a number of bytes, the oldest bundles and
+then the oldest runs are deleted. Session storages that haven't been touched
+for some days are dropped.
+
+What each .log.d looked like when the policy was last enforced is remembered
+in HACENADA_HOME, so a directory is only looked at again when it has changed,
+the policy has changed, or one of its runs is due to age out. Enforcing the
+policy is cheap enough to do after every run. Every .log.d a run is logged to
+is remembered there too, so the logs of finished sessions are found later.
+"""
+from __future__ import annotations
+
+import json
+from pathlib import Path
+import re
+import time
+import typing
+import zipfile
+
+import attr
+
+from hacenada import blob, complete, export, logfile, storage
+from hacenada.const import STR_DICT
+from hacenada.error import StorageBusy
+
+
+SECONDS_PER_DAY = 24 * 60 * 60
+
+# where the state of each .log.d is remembered, in HACENADA_HOME
+STATE = "retention.state"
+
+_RUN_RX = re.compile(r"(\d{4}-\d\d-\d\d)-(\d+)--")
+
+
+def bundle_name(date: str) -> str:
+    """
+    The name of the bundle for runs on date (YYYY-MM-DD): one per month
+    """
+    return f"bundle-{date[:7]}.zip"
+
+
+@attr.s(auto_attribs=True, frozen=True)
+class Policy:
+    """
+    How long to keep the runs of a script; None keeps them regardless
+    """
+
+    days: typing.Optional[int] = None
+    runs: typing.Optional[int] = None
+    max_bytes: typing.Optional[int] = None
+
+    @classmethod
+    def from_structured(cls, data: STR_DICT) -> Policy:
+        """
+        Constructor, from the (validated) `retain` table of a script
+        """
+        return cls(**data)
+
+    def over(self, base: Policy) -> Policy:
+        """
+        This policy, with base filling in what it leaves out
+        """
+        ours = {k: v for k, v in attr.asdict(self).items() if v is not None}
+        return attr.evolve(base, **ours)
+
+
+@attr.s(auto_attribs=True)
+class Run:
+    """
+    The files of one finished session in a .log.d
+    """
+
+    key: typing.Tuple[str, int, str]
+    files: typing.List[Path]
+    mtime: float
+
+    @property
+    def bundle(self) -> str:
+        """
+        The name of the bundle this run is compacted into, by month
+        """
+        return bundle_name(self.key[0])
+
+
+@attr.s(auto_attribs=True)
+class RetentionStats:
+    """
+    What enforcing a policy did
+    """
+
+    compacted: int = 0
+    deleted: int = 0
+    freed: int = 0
+    sessions: int = 0
+    unchanged: int = 0
+
+
+def runs_in(logd: Path) -> typing.List[Run]:
+    """
+    The runs in a .log.d, oldest first
+    """
+    grouped: typing.Dict[typing.Tuple[str, int, str], typing.List[Path]] = {}
+    for path in logd.iterdir():
+        m = _RUN_RX.match(path.name)
+        if m and path.is_file():
+            key = (m.group(1), int(m.group(2)), path.stem)
+            grouped.setdefault(key, []).append(path)
+
+    ret = []
+    for key, files in sorted(grouped.items()):
+        ret.append(Run(key, sorted(files), max(f.stat().st_mtime for f in files)))
+    return ret
+
+
+def compact(logd: Path, run: Run):
+    """
+    Move the files of run into its bundle
+    """
+    bundle = logd / run.bundle
+    with zipfile.ZipFile(bundle, "a", compression=zipfile.ZIP_DEFLATED) as zf:
+        present = set(zf.namelist())
+        for path in run.files:
+            if path.name not in present:
+                zf.write(path, path.name)
+    if any(blob.mentions(path) for path in run.files):
+        storage.blob_store().add_referrer(bundle)
+    for path in run.files:
+        path.unlink()
+
+
+def bundled(logd: Path, date: str) -> typing.List[str]:
+    """
+    The markdown logs of the runs on date (YYYY-MM-DD) that were compacted
+    """
+    bundle = logd / bundle_name(date)
+    if not bundle.exists():
+        return []
+    with zipfile.ZipFile(bundle) as zf:
+        return [n for n in zf.namelist() if n.startswith(date) and n.endswith(".log")]
+
+
+def policy_of(runs: typing.List[Run]) -> Policy:
+    """
+    The policy in the `retain` table of the script, as of its newest readable log
+    """
+    for run in reversed(runs):
+        for path in run.files:
+            if path.suffix in logfile.LOG_SUFFIXES:
+                try:
+                    preamble = logfile.read_log(path)["hacenada"]
+                except Exception:
+                    continue
+                return Policy.from_structured(preamble.get("retain", {}))
+    return Policy()
+
+
+def enforce_dir(
+    logd: Path, base: Policy, now: float, stats: RetentionStats
+) -> typing.Optional[float]:
+    """
+    Compact and delete runs in logd as the script's policy (over base) says
+
+    Returns when the oldest run kept will be due to age out, if ever.
+    """
+    runs = runs_in(logd)
+    policy = policy_of(runs).over(base)
+    keep = []
+    for n, run in enumerate(runs):
+        too_many = policy.runs is not None and n < len(runs) - policy.runs
+        too_old = (
+            policy.days is not None and run.mtime < now - policy.days * SECONDS_PER_DAY
+        )
+        if too_many or too_old:
+            compact(logd, run)
+            stats.compacted += 1
+        else:
+            keep.append(run)
+
+    if policy.max_bytes is not None:
+        bundles = sorted(logd.glob("bundle-*.zip"))
+        total = sum(p.stat().st_size for p in logd.iterdir() if p.is_file())
+        doomed = [[p] for p in bundles] + [r.files for r in keep]
+        while total > policy.max_bytes and doomed:
+            for path in doomed.pop(0):
+                size = path.stat().st_size
+                path.unlink()
+                stats.deleted += 1
+                stats.freed += size
+                total -= size
+        keep = [r for r in keep if r.files[0].exists()]
+
+    if policy.days is None or not keep:
+        return None
+    return min(r.mtime for r in keep) + policy.days * SECONDS_PER_DAY
+
+
+def _load_state() -> STR_DICT:
+    path = storage.HACENADA_HOME / STATE
+    try:
+        return json.loads(path.read_text())
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(state: STR_DICT):
+    path = storage.HACENADA_HOME / STATE
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(state, indent=1, sort_keys=True))
+
+
+def remember(logd: Path):
+    """
+    Remember logd, so collect() enforces retention on it from now on
+    """
+    state = _load_state()
+    if str(logd.resolve()) not in state:
+        state[str(logd.resolve())] = {}
+        _save_state(state)
+
+
+def enforce(
+    dirs: typing.Iterable[Path],
+    base: Policy = Policy(),
+    now: typing.Optional[float] = None,
+    stats: typing.Optional[RetentionStats] = None,
+) -> RetentionStats:
+    """
+    Enforce, in each .log.d of dirs, the policy of its script over base
+
+    A directory unchanged since it was last enforced with the same base policy,
+    and with no run due to age out, is skipped.
+    """
+    now = time.time() if now is None else now
+    stats = stats or RetentionStats()
+    state = _load_state()
+    for logd in dirs:
+        logd = Path(logd).resolve()
+        if not logd.is_dir():
+            state.pop(str(logd), None)
+            continue
+        remembered = state.get(str(logd), {})
+        due = remembered.get("due")
+        if (
+            remembered.get("mtime") == logd.stat().st_mtime_ns
+            and remembered.get("base") == attr.asdict(base)
+            and (due is None or now < due)
+        ):
+            stats.unchanged += 1
+            continue
+
+        due = enforce_dir(logd, base, now, stats)
+        state[str(logd)] = dict(
+            mtime=logd.stat().st_mtime_ns, base=attr.asdict(base), due=due
+        )
+    _save_state(state)
+    return stats
+
+
+def prune_sessions(days: int, now: typing.Optional[float] = None) -> typing.List[Path]:
+    """
+    Drop the session storages in HACENADA_HOME not written to for days
+
+    A session another hacenada holds the lock on is left alone. Returns the
+    storages dropped.
+    """
+    now = time.time() if now is None else now
+    dropped = []
+    for path in export.session_files(storage.HACENADA_HOME):
+        if path.stat().st_mtime >= now - days * SECONDS_PER_DAY:
+            continue
+        try:
+            with storage.locked(path, timeout=0):
+                path.unlink()
+                storage.summary_path(path).unlink(missing_ok=True)
+                storage.lock_path(path).unlink(missing_ok=True)
+        except StorageBusy:
+            continue
+        _forget_completion(path)
+        dropped.append(path)
+    return dropped
+
+
+def _forget_completion(stored: Path):
+    """
+    Remove the session stored at stored from the completion cache, matching its
+    scripts by storage name
+    """
+    for script_path in complete.load(storage.HACENADA_HOME):
+        if storage.session_path(Path(script_path), stored.suffix).name == stored.name:
+            complete.forget(storage.HACENADA_HOME, Path(script_path))
+
+
+def collect(
+    base: Policy = Policy(),
+    session_days: typing.Optional[int] = None,
+    roots: typing.Iterable[Path] = (),
+    now: typing.Optional[float] = None,
+) -> RetentionStats:
+    """
+    Enforce retention on the logs of every session's script, every .log.d a run was
+    logged to, and any .log.d under roots
+
+    With session_days, abandoned sessions are dropped too (after their logs are
+    found).
+    """
+    sessions = export.session_files(storage.HACENADA_HOME)
+    dirs = set(export.log_dirs(sessions, roots))
+    dirs.update(Path(logd) for logd in _load_state())
+    stats = RetentionStats()
+    if session_days is not None:
+        stats.sessions = len(prune_sessions(session_days, now))
+    return enforce(sorted(dirs), base, now, stats)
@@ -1,19 +1,194 @@
 """
 Script parser and understander
 """
+import hashlib
+import json
+from pathlib import Path
+import re
 import typing
 
 import attr
 import toml
 
+from hacenada import codec, error
+from hacenada.const import RETAIN_KEYS, SCRIPT_STEP_TYPES, WAIT_KEYS
+from hacenada.expr import Expression, Lookup, compile_expression
 
-class Step(typing.TypedDict):
+
+# compiled scripts: the suffix, and the artifact format version. Bump the version
+# whenever the records, or what preprocessing puts in a step's overlay, change:
+# 2 added `when` conditions to the overlay
+# 3 added foreach expansion
+# 4 added wait steps
+COMPILED_SUFFIX = ".hcnc"
+COMPILED_VERSION = 4
+
+# a parser turns the raw bytes of a script file into structured data, raising
+# ValueError when it can't
+ScriptParser = typing.Callable[[bytes], typing.Dict]
+PARSERS: typing.Dict[str, ScriptParser] = {}
+
+# parsed files by (suffix, content hash), so a fragment shared by many scripts
+# is only parsed once. The parsed data is shared: don't modify it.
+PARSE_CACHE_SIZE = 256
+_parse_cache: typing.Dict[typing.Tuple[str, str], typing.Dict] = {}
+
+
+def parser(*suffixes: str) -> typing.Callable[[ScriptParser], ScriptParser]:
+    """
+    Register the decorated function as the parser for files with these suffixes
+    """
+
+    def _register(fn: ScriptParser) -> ScriptParser:
+        for suffix in suffixes:
+            PARSERS[suffix] = fn
+        return fn
+
+    return _register
+
+
+@parser(".toml")
+def parse_toml(raw: bytes) -> typing.Dict:
+    return toml.loads(raw.decode("utf-8"))
+
+
+@parser(".json")
+def parse_json(raw: bytes) -> typing.Dict:
+    return json.loads(raw)
+
+
+@parser(".yaml", ".yml")
+def parse_yaml(raw: bytes) -> typing.Dict:
+    """
+    YAML scripts are available when PyYAML is installed
+    """
+    try:
+        import yaml
+    except ImportError:
+        raise error.ScriptError("YAML scripts need PyYAML: pip install pyyaml")
+
+    try:
+        return yaml.safe_load(raw)
+    except yaml.YAMLError as e:
+        raise ValueError(str(e))
+
+
+def parse_file(path: Path) -> typing.Dict:
+    """
+    Parse one script or fragment file with the parser registered for its suffix
+    """
+    fn = PARSERS.get(path.suffix)
+    if fn is None:
+        raise error.ScriptError(
+            f"{path}: don't know how to read {path.suffix or 'extensionless'} files "
+            f"(known: {', '.join(sorted(PARSERS))})"
+        )
+    try:
+        raw = path.read_bytes()
+    except OSError as e:
+        raise error.ScriptError(f"{path}: {e.strerror}")
+
+    key = (path.suffix, hashlib.sha256(raw).hexdigest())
+    if key not in _parse_cache:
+        try:
+            data = fn(raw)
+        except ValueError as e:
+            raise error.ScriptError(f"{path}: {e}")
+        if not isinstance(data, dict):
+            raise error.ScriptError(f"{path}: expected a table at the top level")
+        if len(_parse_cache) >= PARSE_CACHE_SIZE:
+            del _parse_cache[next(iter(_parse_cache))]
+        _parse_cache[key] = data
+
+    return _parse_cache[key]
+
+
+def load_structured(
+    path: Path, _including: typing.Tuple[Path, ...] = ()
+) -> typing.Dict:
+    """
+    Parse a script file, composing the steps of any included fragments
+
+    `include = [...]` in the [hacenada] section lists fragment files, relative to
+    the including file. Their steps come first, in the order listed, followed by
+    the file's own steps. Fragments may include other fragments.
+    """
+    path = Path(path).absolute()
+    if path in _including:
+        raise error.ScriptError(f"{path}: included from itself")
+
+    data = parse_file(path)
+    includes = (data.get("hacenada") or {}).get("include") or []
+    if not includes:
+        return data
+
+    steps: typing.List[typing.Dict] = []
+    for fragment in includes:
+        included = load_structured(path.parent / fragment, _including + (path,))
+        steps.extend(included.get("step") or [])
+    steps.extend(data.get("step") or [])
+    return dict(data, step=steps)
+
+
+def source_files(path: Path) -> typing.List[Path]:
+    """
+    The files a script is loaded from: itself, then its included fragments, depth first
+
+    A compiled script is loaded from itself alone.
+    """
+    path = Path(path).absolute()
+    if path.suffix == COMPILED_SUFFIX:
+        return [path]
+    ret = [path]
+    for fragment in (parse_file(path).get("hacenada") or {}).get("include") or []:
+        ret.extend(source_files(path.parent / fragment))
+    return ret
+
+
+def step_digest(step: typing.Dict) -> str:
+    """
+    A digest of what a step asks (its type, message and condition), ignoring its label
+
+    An answer belongs to the same question for as long as this stays the same.
+    """
+    content = [step["type"], step["message"], step.get("when")]
+    return hashlib.sha1(json.dumps(content).encode("utf-8")).hexdigest()[:16]
+
+
+class _RequiredStep(typing.TypedDict):
     type: str
     message: str
     label: str
     stop: bool
 
 
+class Step(_RequiredStep, total=False):
+    when: str  # source of an expression; the step is skipped when it's false
+    # a list of items, or the label of an earlier answer listing them; the step
+    # is a template, expanded into one step per item
+    foreach: typing.Union[typing.List[str], str]
+    template: str  # in an expanded step, the label of the foreach step
+    # wait steps: a shell command polled until it succeeds, and how often and how long
+    check: str
+    interval: float
+    timeout: float
+    cache: typing.Union[
+        bool, float
+    ]  # remember the answer (for this many seconds); see memo.py
+
+
+def _split_items(value: typing.Any) -> typing.List[str]:
+    """
+    The items of a foreach over an answer: a list as-is, or a string split on commas
+    and spaces
+    """
+    if value is None:
+        return []
+    if isinstance(value, list):
+        return [str(v) for v in value]
+    return [item for item in re.split(r"[,\s]+", str(value)) if item]
+
+
 @attr.s(auto_attribs=True)
 class Script:
     """
@@ -23,6 +198,10 @@ class Script:
     preamble: dict = attr.Factory(dict)
     raw_steps: list = attr.Factory(list)
     overlay: list = attr.Factory(list)  # steps after preprocessing
+    # compiled `when` expressions by label, see compile_conditions()
+    conditions: typing.Dict[str, Expression] = attr.ib(
+        factory=dict, eq=False, repr=False
+    )
 
     @staticmethod
     def autolabel(step, n):
@@ -32,39 +211,350 @@ class Script:
         """
         Run a preprocessor on each step, setting defaults and such.
         """
-        overlay = []
-        for n, item in enumerate(steps):
+        return [self.preprocess_step(item, n) for n, item in enumerate(steps)]
+
+    def preprocess_step(self, item: typing.Dict, n: int) -> Step:
+        """
+        Preprocess the raw step item, which is step number n
+        """
+        step = Step(
+            type=item.get("type", "message"),
+            message=item["message"],
+            stop=item.get("stop", True),
+            label=item.get("label", ""),
+        )
+
+        if not step["label"]:
+            step["label"] = self.autolabel(step, n)
+
+        if "when" in item:
+            step["when"] = item["when"]
+
+        if "foreach" in item:
+            foreach = item["foreach"]
+            step["foreach"] = (
+                foreach if isinstance(foreach, str) else [str(i) for i in foreach]
+            )
+
+        for key in WAIT_KEYS:
+            if key in item:
+                step[key] = item[key]  # type: ignore
+
+        return step
+
+    def steps(
+        self, lookup: Lookup, show_templates: bool = False
+    ) -> typing.Iterator[Step]:
+        """
+        Every step in order, expanding each foreach step only as it is reached
+
+        lookup gives the answers of earlier steps, for a foreach over an answer.
+        With show_templates, a foreach step with no items (yet) is given as it is,
+        for printing.
+        """
+        for step in self.overlay:
+            if "foreach" not in step:
+                yield step
+                continue
+            expanded = False
+            for expanded_step in self.expand(step, lookup):
+                expanded = True
+                yield expanded_step
+            if show_templates and not expanded:
+                yield step
+
+    @staticmethod
+    def expand(template: Step, lookup: Lookup) -> typing.Iterator[Step]:
+        """
+        The steps of a foreach step, one per item, with {item} in the message filled in
+        """
+        items = template["foreach"]
+        if isinstance(items, str):
+            items = _split_items(lookup(items))
+        for item in items:
             step = Step(
-                type=item.get("type", "message"),
-                message=item["message"],
-                stop=item.get("stop", True),
-                label=item.get("label", ""),
+                type=template["type"],
+                message=template["message"].replace("{item}", item),
+                stop=template["stop"],
+                label=f"{template['label']}[{item}]",
+                template=template["label"],
             )
+            if "when" in template:
+                step["when"] = template["when"]
+            for key in WAIT_KEYS:
+                if key in template:
+                    step[key] = template[key]  # type: ignore
+            if "check" in step:
+                step["check"] = step["check"].replace("{item}", item)
+            yield step
+
+    def template_label(self, label: str) -> str:
+        """
+        The label of the step that label belongs to: its foreach step, or itself
+        """
+        base, bracket, _ = label.partition("[")
+        if bracket and any(s["label"] == base and "foreach" in s for s in self.overlay):
+            return base
+        return label
+
+    def compile_conditions(self, reuse: typing.Iterable[Expression] = ()):
+        """
+        Compile the `when` expression of each step, once for the life of the script
+
+        Expressions in reuse, already compiled from the same source, are not compiled
+        again.
+        """
+        known = {expression.source: expression for expression in reuse}
+        self.conditions = {
+            step["label"]: known.get(step["when"]) or compile_expression(step["when"])
+            for step in self.overlay
+            if "when" in step
+        }
 
-            if not step["label"]:
-                step["label"] = self.autolabel(step, n)
+    def step_digests(self) -> typing.Dict[str, str]:
+        """
+        The digest of each step's content by label, in order; see step_digest()
+        """
+        return {step["label"]: step_digest(step) for step in self.overlay}
 
-            overlay.append(step)
+    def references(self, step: Step) -> typing.Set[str]:
+        """
+        The labels of the earlier answers step depends on: in its condition, and its
+        foreach
+        """
+        key = step.get("template", step["label"])
+        condition = self.conditions.get(key)
+        ret = set(condition.names) if condition else set()
+        template = next((s for s in self.overlay if s["label"] == key), step)
+        foreach = template.get("foreach")
+        if isinstance(foreach, str):
+            ret.add(foreach)
+        return ret
 
-        return overlay
+    def should_show(self, step: Step, lookup: Lookup) -> bool:
+        """
+        Is step's condition (if it has one) true, given lookup for earlier answers?
+        """
+        condition = self.conditions.get(step.get("template", step["label"]))
+        return condition is None or condition(lookup)
+
+    @classmethod
+    def validate(cls, data: typing.Dict) -> typing.List[str]:
+        """
+        Check structured script data, returning a list of problems (empty when valid)
+        """
+        if not isinstance(data.get("hacenada"), dict):
+            return ["missing [hacenada] section"]
+        steps = data.get("step")
+        if not isinstance(steps, list) or not steps:
+            return ["missing [[step]] sections"]
+
+        problems = cls._validate_retain(data["hacenada"].get("retain", {}))
+        labels: typing.Dict[str, int] = {}
+        for n, item in enumerate(steps):
+            if not isinstance(item, dict):
+                problems.append(f"step {n}: not a table")
+                continue
+            if not isinstance(item.get("message"), str):
+                problems.append(f"step {n}: missing message")
+            _type = item.get("type", "message")
+            if _type not in SCRIPT_STEP_TYPES:
+                problems.append(f"step {n}: unknown type {_type!r}")
+            if not isinstance(item.get("stop", True), bool):
+                problems.append(f"step {n}: stop must be true or false")
+            label = item.get("label") or cls.autolabel({"type": _type}, n)
+            if label in labels:
+                problems.append(
+                    f"step {n}: label {label!r} already used by step {labels[label]}"
+                )
+            if _type == "wait" or any(k in item for k in WAIT_KEYS):
+                problems.extend(cls._validate_wait(n, item))
+            if "when" in item:
+                problems.extend(cls._validate_when(n, item["when"], labels))
+            if "foreach" in item:
+                problems.extend(cls._validate_foreach(n, item["foreach"], labels))
+            labels.setdefault(label, n)
+
+        return problems
+
+    @staticmethod
+    def _validate_retain(retain: typing.Any) -> typing.List[str]:
+        """
+        Problems with the retention policy of the script's logs
+        """
+        if not isinstance(retain, dict):
+            return ["retain must be a table"]
+        return [
+            f"retain: {k} must be a number of {RETAIN_KEYS[k]}"
+            if k in RETAIN_KEYS
+            else f"retain: unknown key {k!r}"
+            for k, v in retain.items()
+            if k not in RETAIN_KEYS
+            or not isinstance(v, int)
+            or isinstance(v, bool)
+            or v < 0
+        ]
+
+    @staticmethod
+    def _validate_wait(n: int, item: typing.Dict) -> typing.List[str]:
+        """
+        Problems with the check of wait step n
+        """
+        if item.get("type") != "wait":
+            keys = ", ".join(k for k in WAIT_KEYS if k in item)
+            return [f"step {n}: {keys} only apply to wait steps"]
+        problems = []
+        if not isinstance(item.get("check"), str) or not item["check"].strip():
+            problems.append(f"step {n}: a wait step needs a check command")
+        for key in "interval", "timeout":
+            value = item.get(key, 1)
+            if (
+                isinstance(value, bool)
+                or not isinstance(value, (int, float))
+                or value <= 0
+            ):
+                problems.append(f"step {n}: {key} must be a number of seconds")
+        cache = item.get("cache", True)
+        if not isinstance(cache, bool) and (
+            not isinstance(cache, (int, float)) or cache <= 0
+        ):
+            problems.append(
+                f"step {n}: cache must be true, false or a number of seconds"
+            )
+        return problems
+
+    @staticmethod
+    def _validate_when(n: int, when: typing.Any, earlier: typing.Container[str]):
+        """
+        Problems with the `when` expression of step n
+        """
+        if not isinstance(when, str):
+            return [f"step {n}: when must be a string"]
+        try:
+            expression = compile_expression(when)
+        except error.ExpressionError as e:
+            return [f"step {n}: {e}"]
+        return [
+            f"step {n}: when refers to {name!r}, which is not an earlier step"
+            for name in sorted(expression.names)
+            if name not in earlier
+        ]
+
+    @staticmethod
+    def _validate_foreach(n: int, foreach: typing.Any, earlier: typing.Container[str]):
+        """
+        Problems with the `foreach` of step n
+        """
+        if isinstance(foreach, str):
+            if foreach in earlier:
+                return []
+            return [
+                f"step {n}: foreach refers to {foreach!r}, which is not an earlier step"
+            ]
+        if isinstance(foreach, list) and foreach:
+            if all(isinstance(i, (str, int, float)) for i in foreach):
+                return []
+        return [
+            f"step {n}: foreach must be a list of items, "
+            "or the label of an earlier step"
+        ]
 
     @classmethod
     def from_scriptfile(cls, scriptfile):
         """
-        Constructor, creates a Script() instance from a filename containing .toml
+        Constructor, creates a Script() instance from a script filename
+
+        The file is parsed according to its suffix (see PARSERS). A compiled
+        script (see compile()) is loaded as-is, without parsing or preprocessing
+        again.
         """
-        with open(scriptfile) as f:
-            data = toml.load(f)
+        if Path(scriptfile).suffix == COMPILED_SUFFIX:
+            return cls.from_compiled(Path(scriptfile).read_bytes())
 
-        return cls.from_structured(data)
+        return cls.from_structured(load_structured(scriptfile))
 
     @classmethod
     def from_structured(cls, data):
         """
         Constructor, creates from structured data
         """
+        problems = cls.validate(data)
+        if problems:
+            raise error.ScriptError("; ".join(problems))
+
         self = cls()
         self.raw_steps = data["step"]
         self.overlay = self.preprocess_steps(data["step"])
         self.preamble = data["hacenada"]
+        self.compile_conditions()
+        return self
+
+    def reload(self, scriptfile) -> "Script":
+        """
+        Load an edited version of this script from scriptfile
+
+        Steps that did not change (the same raw step in the same position) are
+        reused as they are, without preprocessing them or compiling their
+        conditions again.
+        """
+        if Path(scriptfile).suffix == COMPILED_SUFFIX:
+            return self.from_compiled(Path(scriptfile).read_bytes())
+
+        data = load_structured(scriptfile)
+        problems = self.validate(data)
+        if problems:
+            raise error.ScriptError("; ".join(problems))
+
+        new = type(self)(preamble=data["hacenada"], raw_steps=data["step"])
+        old = dict(enumerate(self.raw_steps))
+        for n, item in enumerate(new.raw_steps):
+            if old.get(n) == item:
+                new.overlay.append(self.overlay[n])
+            else:
+                new.overlay.append(new.preprocess_step(item, n))
+        new.compile_conditions(reuse=self.conditions.values())
+        return new
+
+    def compile(self) -> bytes:
+        """
+        Produce a versioned, compact artifact of the validated and preprocessed script
+        """
+
+        def _records():
+            yield ["compiled", COMPILED_VERSION]
+            yield ["hacenada", self.preamble]
+            for raw in self.raw_steps:
+                yield ["step", raw]
+            for step in self.overlay:
+                yield ["overlay", step]
+
+        return codec.dump_records(_records())
+
+    @classmethod
+    def from_compiled(cls, data: bytes):
+        """
+        Constructor, creates from a compiled artifact
+        """
+        self = cls()
+        try:
+            records = list(codec.load_records(data))
+        except error.CodecError as e:
+            raise error.ScriptError(f"not a compiled script: {e}")
+
+        if not records or records[0][0] != "compiled":
+            raise error.ScriptError("not a compiled script")
+        if records[0][1] != COMPILED_VERSION:
+            raise error.ScriptError(
+                f"compiled script version {records[0][1]} is not supported, "
+                "recompile it"
+            )
+
+        for key, value in records[1:]:
+            if key == "hacenada":
+                self.preamble = value
+            elif key == "step":
+                self.raw_steps.append(value)
+            elif key == "overlay":
+                self.overlay.append(value)
+        self.compile_conditions()
         return self
@@ -3,11 +3,16 @@ Read/write from the .session file, manage which step we're on, manage logs
 """
 from __future__ import annotations
 
+import datetime
+import itertools
+import typing
+
 import attr
 
-from hacenada import error
+from hacenada import error, memo, wait
 from hacenada.abstract import Render, SessionStorage
-from hacenada.script import Script
+from hacenada.const import STR_DICT
+from hacenada.script import Script, Step
 
 
 @attr.s(auto_attribs=True)
@@ -16,7 +21,23 @@ class SessionOptions:
     Options for a Session
     """
 
-    renderer: Render
+    # None when steps are answered some other way, as driver.AsyncSession does
+    renderer: typing.Optional[Render] = None
+    quiet: bool = False
+    # called with an event dict as each step is shown, answered or skipped
+    on_event: typing.Optional[typing.Callable[[STR_DICT], None]] = None
+    # where the answers of steps with `cache` set are remembered; None caches nothing
+    cache: typing.Optional[memo.StepCache] = None
+
+
+@attr.s(auto_attribs=True)
+class Reconciliation:
+    """
+    What reconciling stored answers with an edited script did
+    """
+
+    relabeled: typing.Dict[str, str] = attr.Factory(dict)
+    invalidated: typing.List[str] = attr.Factory(list)
 
 
 @attr.s(auto_attribs=True, slots=True)
@@ -39,25 +60,250 @@ class Session:
     def step_session(self):
         """
         Advance the session to the next question step, render, and collect the answer
-        """
-        index = len(self.storage.answer)
-        remaining = self.script.overlay[index:]
-
-        while remaining:
-            step = remaining.pop(0)
-            q_a = self.options.renderer.render(step, context=self)
 
-            self.storage.save_answer(q_a)
-            posthandler = getattr(self, f"post_{step['type']}", lambda *a: None)
-            posthandler(step["label"], step["type"], q_a[step["label"]])
-            if step["stop"]:
+        Steps are produced lazily, so a foreach step is only expanded when reached.
+        Wait steps reached together are waited for together, except those whose
+        answer is cached.
+        """
+        remaining = self.remaining()
+        while True:
+            group, remaining = self.next_group(remaining)
+            if group is None:
                 break
+            if group[0]["type"] == "wait":
+                q_a = self.recall(group)
+                recalled = set(q_a)
+                waiting = [each for each in group if each["label"] not in recalled]
+                if waiting:
+                    q_a.update(
+                        self.options.renderer.render_waits(waiting, context=self)
+                    )
+                self.record(group, q_a, recalled)
+            else:
+                self.record(group, self.options.renderer.render(group[0], context=self))
+            if group[-1]["stop"]:
+                break
+
+        # each stop is a point to undo to
+        self.storage.checkpoint()
 
         # did we reach the end?
-        if len(remaining) == 0:
+        if next(remaining, None) is None:
+            self.emit("finished")
             raise error.ScriptFinished("all steps have been seen")
 
-        print("---------------")
+        if not self.options.quiet:
+            print("---------------")
+
+    def remaining(self) -> typing.Iterator[Step]:
+        """
+        The steps not answered (or skipped) yet, in order
+        """
+        answered = self.answered_labels()
+        return (
+            s
+            for s in self.script.steps(self.answer_value)
+            if s["label"] not in answered
+        )
+
+    def next_group(
+        self, remaining: typing.Iterator[Step]
+    ) -> typing.Tuple[typing.Optional[typing.List[Step]], typing.Iterator[Step]]:
+        """
+        The next steps of remaining to answer (None at the end), showing them, and
+        the steps after
+
+        Steps whose condition is false are recorded as skipped on the way. Wait
+        steps reached together are gathered; any other step comes alone.
+        """
+        for step in remaining:
+            if not self.script.should_show(step, self.answer_value):
+                self.storage.skip_step(step["label"])
+                self.emit("skipped", step)
+                continue
+            group = [step]
+            if step["type"] == "wait":
+                group, remaining = self._gather_waits(step, remaining)
+            for each in group:
+                self.emit("shown", each)
+            return group, remaining
+        return None, remaining
+
+    def record(
+        self,
+        group: typing.List[Step],
+        q_a: STR_DICT,
+        recalled: typing.AbstractSet[str] = frozenset(),
+    ):
+        """
+        Save the answers to group, remembering the cached ones; recalled came from
+        the cache
+
+        Raise WaitTimedOut, after saving the others, if any wait step's check did not
+        succeed.
+        """
+        keys = self._cache_keys(
+            [each for each in group if each["label"] not in recalled]
+        )
+        timed_out = []
+        for each in group:
+            label = each["label"]
+            if each["type"] == "wait" and not q_a[label]["ok"]:
+                timed_out.append(label)
+                continue
+            fields = dict(value=q_a[label])
+            if label in recalled:
+                self.storage.save_cached(label, q_a[label])
+                fields["cached"] = True
+            else:
+                self.storage.save_answer({label: q_a[label]})
+                if self.options.cache and label in keys:
+                    self.options.cache.put(
+                        keys[label], q_a[label], typing.cast(float, memo.ttl_of(each))
+                    )
+            self.emit("answered", each, **fields)
+            posthandler = getattr(self, f"post_{each['type']}", lambda *a: None)
+            posthandler(label, each["type"], q_a[label])
+        if timed_out:
+            labels = ", ".join(f"[{label}]" for label in timed_out)
+            raise error.WaitTimedOut(f"the check for {labels} did not succeed in time")
+
+    @staticmethod
+    def _gather_waits(
+        step: Step, remaining: typing.Iterator[Step]
+    ) -> typing.Tuple[typing.List[Step], typing.Iterator[Step]]:
+        """
+        The wait steps reached along with step, and the steps after them
+
+        Wait steps that follow one with `stop = false` are gathered, unless
+        they have a condition, which can't be known until the others are answered.
+        """
+        group = [step]
+        while not group[-1]["stop"]:
+            following = next(remaining, None)
+            if following is None:
+                break
+            if following["type"] != "wait" or "when" in following:
+                return group, itertools.chain([following], remaining)
+            group.append(following)
+        return group, remaining
+
+    def _cache_keys(self, steps: typing.List[Step]) -> typing.Dict[str, str]:
+        """
+        The cache key of each of steps whose answer is cached, by label
+        """
+        if self.options.cache is None:
+            return {}
+        return {
+            step["label"]: memo.cache_key(
+                step,
+                {
+                    name: self.answer_value(name)
+                    for name in self.script.references(step)
+                },
+            )
+            for step in steps
+            if memo.ttl_of(step) is not None
+        }
+
+    def recall(self, steps: typing.List[Step]) -> STR_DICT:
+        """
+        The answers of steps remembered in the cache, by label, showing each one
+        """
+        keys = self._cache_keys(steps)
+        ret: STR_DICT = {}
+        cache = self.options.cache
+        for step in steps:
+            label = step["label"]
+            value = cache.get(keys[label]) if cache and label in keys else None
+            if value is None:
+                continue
+            ret[label] = value
+            if not self.options.quiet:
+                message = step["message"].strip()
+                print(f"{label}: {message}\n>> cached: {wait.describe(value)}")
+        return ret
+
+    def emit(self, event: str, step: typing.Optional[Step] = None, **fields):
+        """
+        Tell the on_event hook (if there is one) what just happened
+        """
+        if self.options.on_event is None:
+            return
+        ret: STR_DICT = dict(
+            event=event,
+            when=datetime.datetime.now(datetime.timezone.utc).isoformat(),
+            script=str(self.storage.script_path),
+            session=self.storage.description,
+        )
+        if step:
+            ret.update(label=step["label"], type=step["type"])
+        ret.update(fields)
+        self.options.on_event(ret)
+
+    def answered_labels(self) -> typing.Set[str]:
+        """
+        The labels of every step answered (or skipped) so far
+        """
+        return {answer["label"] for answer in self.storage.answer}
+
+    def reconcile(self) -> Reconciliation:
+        """
+        Match stored answers to the steps of the script, which may have been edited
+
+        Answers are matched by label, and when a step's content changed under
+        its label, by content to a step under another label (e.g. an autolabel
+        that shifted when a step was inserted). Answers whose question changed or
+        went away are discarded, so that their steps are asked again.
+        """
+        ret = Reconciliation()
+        previous = self.storage.step_digests
+        current = self.script.step_digests()
+        answered = [a["label"] for a in self.storage.answer]
+
+        moving = []
+        claimed = set()
+        for label in answered:
+            # the answers of an expanded foreach step stand or fall with the foreach
+            # step
+            key = self.script.template_label(label)
+            if key in current and previous.get(key, current[key]) == current[key]:
+                claimed.add(label)
+            elif key != label:
+                ret.invalidated.append(label)
+            else:
+                moving.append(label)
+
+        for label in moving:
+            digest = previous.get(label)
+            target = next(
+                (
+                    new
+                    for new, d in current.items()
+                    if d == digest and new not in claimed
+                ),
+                None,
+            )
+            if target:
+                ret.relabeled[label] = target
+                claimed.add(target)
+            else:
+                ret.invalidated.append(label)
+
+        for label in ret.invalidated:
+            self.storage.forget_answer(label)
+        if ret.relabeled:
+            self.storage.relabel_answers(ret.relabeled)
+        if previous != current:
+            self.storage.step_digests = current
+        return ret
+
+    def answer_value(self, label: str):
+        """
+        The value of an earlier answer, or None if it was skipped or not given
+        """
+        answered = self.storage.get_answer(label)
+        return answered["value"] if answered else None
 
     def post_description(self, _, __, value):
         """
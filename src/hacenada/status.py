@@ -0,0 +1,102 @@
+"""
+What every session in progress is up to, for `hacenada status`
+
+Each session storage keeps a summary beside it (see
+HomeDirectoryStorage.summary()), rewritten whenever the session changes, so
+listing sessions reads one small file for each rather than opening every
+storage and script. A session stored before summaries were kept is opened once,
+to write its summary.
+"""
+from __future__ import annotations
+
+import datetime
+import json
+from pathlib import Path
+import typing
+
+import attr
+
+from hacenada import error, export, storage
+
+
+@attr.s(auto_attribs=True)
+class SessionStatus:
+    """
+    One session, as its summary describes it
+    """
+
+    stored: Path
+    script_path: Path
+    description: str = ""
+    done: int = 0
+    total: int = 0
+    current: typing.Optional[str] = None
+    last_answer: typing.Optional[datetime.datetime] = None
+    error: str = ""
+
+
+def _summary(stored: Path) -> typing.Dict:
+    """
+    The summary of the session at stored, written first if there is none
+    """
+    path = storage.summary_path(stored)
+    if not path.exists():
+        store = storage.HomeDirectoryStorage._from_json_path(stored)
+        try:
+            store.write_summary()
+        finally:
+            store.db.close()
+    return json.loads(path.read_text())
+
+
+def read(stored: Path) -> SessionStatus:
+    """
+    The status of the session stored at stored
+    """
+    try:
+        summary = _summary(stored)
+    except (error.CodecError, json.JSONDecodeError, OSError) as e:
+        return SessionStatus(
+            stored, storage.script_of(stored, {}), error=f"{stored}: {e}"
+        )
+    script_path = storage.script_of(stored, summary)
+    last_answer = summary["last_answer"]
+    return SessionStatus(
+        stored,
+        script_path,
+        summary["description"],
+        summary["done"],
+        summary["total"],
+        summary["current"],
+        datetime.datetime.fromisoformat(last_answer) if last_answer else None,
+    )
+
+
+def collect(home: Path) -> typing.List[SessionStatus]:
+    """
+    The status of every session in home, the most recently answered first
+    """
+    found = [read(stored) for stored in export.session_files(home)]
+    never = datetime.datetime.min.replace(tzinfo=datetime.timezone.utc)
+    return sorted(
+        found, key=lambda s: (s.last_answer or never, str(s.script_path)), reverse=True
+    )
+
+
+def ago(
+    when: typing.Optional[datetime.datetime],
+    now: typing.Optional[datetime.datetime] = None,
+) -> str:
+    """
+    How long before now when was, roughly: 45s, 12m, 3h or 2d
+    """
+    if when is None:
+        return "-"
+    seconds = max(
+        ((now or datetime.datetime.now(datetime.timezone.utc)) - when).total_seconds(),
+        0,
+    )
+    for unit, size in (("d", 86400), ("h", 3600), ("m", 60)):
+        if seconds >= size:
+            return f"{int(seconds // size)}{unit}"
+    return f"{int(seconds)}s"
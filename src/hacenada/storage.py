@@ -3,17 +3,25 @@ Built-in storage abstractions
 """
 from __future__ import annotations
 
+import contextlib
 import datetime
+import fcntl
+import hashlib
+import json
 import os
 from pathlib import Path
+import tempfile
+import time
 import typing
 
 import attr
 from tinydb import TinyDB, table, where
+from tinydb.storages import MemoryStorage, Storage
 from tinydb_serialization import SerializationMiddleware, Serializer
 
-from hacenada import error
+from hacenada import blob, complete, error, memo, printcache
 from hacenada.abstract import SessionStorage
+from hacenada.codec import CompactStorage
 from hacenada.const import STR_DICT
 
 
@@ -21,13 +29,224 @@ ENCODING = "utf-8"
 XDG_CONFIG_HOME = os.environ.get("XDG_CONFIG_HOME", Path.home() / ".config")
 HACENADA_HOME = Path(XDG_CONFIG_HOME) / "hacenada"
 
+# storage file suffix for each supported encoding
+ENCODINGS = {"json": ".json", "compact": ".hcnb"}
+DEFAULT_ENCODING = "json"
 
-class Answer(typing.TypedDict):
+# how long to wait for another hacenada to let go of a session, and how often to look
+LOCK_TIMEOUT = 5.0
+LOCK_POLL = 0.1
+
+# how many checkpoints a session keeps to undo to
+CHECKPOINTS = 20
+
+# session storages are kept in buckets under this directory of HACENADA_HOME, one
+# bucket for the scripts of each directory, so that no directory grows huge
+SESSIONS = "sessions"
+BUCKET_DIGITS = 3
+
+
+class _RequiredAnswer(typing.TypedDict):
     label: str
     value: typing.Any
     when: datetime.datetime
 
 
+class Answer(_RequiredAnswer, total=False):
+    skipped: bool  # only present (and true) when the step was skipped
+    cached: bool  # only present (and true) when the answer was remembered; see memo.py
+
+
+def blob_store() -> blob.BlobStore:
+    """
+    The blob store for large answer values, under HACENADA_HOME
+    """
+    return blob.BlobStore(HACENADA_HOME / "blobs")
+
+
+def step_cache() -> memo.StepCache:
+    """
+    The cache of automated steps' answers, under HACENADA_HOME
+    """
+    return memo.StepCache(HACENADA_HOME / "cache")
+
+
+def print_cache() -> printcache.PrintCache:
+    """
+    The cache of printed output, under HACENADA_HOME
+    """
+    return printcache.PrintCache(HACENADA_HOME / "print")
+
+
+def lock_path(stored: Path) -> Path:
+    """
+    The lock file of the session stored at stored, shared by all its encodings
+    """
+    return stored.with_suffix(".lock")
+
+
+def summary_path(stored: Path) -> Path:
+    """
+    The summary of the session stored at stored, shared by all its encodings; see
+    HomeDirectoryStorage.summary()
+    """
+    return stored.with_suffix(".summary")
+
+
+@contextlib.contextmanager
+def locked(
+    stored: Path, timeout: typing.Optional[float] = None
+) -> typing.Iterator[None]:
+    """
+    Hold the lock on the session stored at stored while the block runs
+
+    Raise StorageBusy if another hacenada holds it for longer than timeout
+    seconds (by default, LOCK_TIMEOUT).
+    """
+    stored.parent.mkdir(parents=True, exist_ok=True)
+    with open(lock_path(stored), "a") as f:
+        deadline = time.monotonic() + (LOCK_TIMEOUT if timeout is None else timeout)
+        while True:
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except BlockingIOError:
+                if time.monotonic() >= deadline:
+                    raise error.StorageBusy(f"{stored} is in use by another hacenada")
+                time.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def bucket(directory: Path) -> Path:
+    """
+    The directory holding the session storages of the scripts in directory
+
+    Buckets are named for the directory as the storages' own names spell it
+    (see _normalize_path()), so a storage's bucket follows from its name once
+    its script's file name is known.
+    """
+    return _bucket_of(_normalize_path(Path(directory).absolute()))
+
+
+def _bucket_of(normal: str) -> Path:
+    digest = hashlib.sha1(normal.encode("utf-8")).hexdigest()[:BUCKET_DIGITS]
+    return HACENADA_HOME / SESSIONS / digest
+
+
+def session_path(script_path: Path, suffix: str) -> Path:
+    """
+    Where the storage of script_path's session is kept, in the encoding with suffix
+    """
+    absolute = Path(script_path).absolute()
+    return bucket(absolute.parent) / _normalize_path(absolute, suffix)
+
+
+def _in_directory(name: str, normal: str) -> bool:
+    """
+    Is the storage named name, starting with the directory spelled normal, for a
+    script directly in that directory?
+
+    The rest of its name could also spell a directory below and a script in
+    that; such a storage is in a different bucket, unless the two share one.
+    """
+    rest = len(normal) + 2
+    parts = Path(name).stem[rest:].split("__")
+    here = _bucket_of(normal)
+    return not any(
+        _bucket_of("__".join([normal, *parts[:i]])) == here
+        for i in range(1, len(parts))
+    )
+
+
+def _read_meta(stored: Path) -> STR_DICT:
+    """
+    The meta properties of the session stored at stored, or none if it can't be read
+    """
+    if not stored.exists():
+        # opening it would create it
+        return {}
+    db = _new_db(stored)
+    try:
+        found = db.table("meta").all()
+    except (OSError, ValueError, error.StorageError):
+        found = []
+    finally:
+        db.close()
+    return dict(found[0]) if found else {}
+
+
+def script_of(stored: Path, meta: typing.Optional[STR_DICT] = None) -> Path:
+    """
+    The script the session stored at stored was made for
+
+    meta is its meta properties (or its summary); if not given, its summary
+    is read, or else the storage itself. A session records its script's
+    absolute path. For one made before it did, the directory is spelled out
+    from the storage's name, which can't tell a "__" in a directory's name
+    from a separator, and the file name is the one recorded in its script_path.
+    """
+    if meta is None:
+        try:
+            meta = json.loads(summary_path(stored).read_text())
+        except (OSError, ValueError):
+            meta = _read_meta(stored)
+    if meta.get("script"):
+        return Path(meta["script"])
+    recorded = Path(meta.get("script_path") or stored.stem.rpartition("__")[2])
+    normal = _directory_of(stored, recorded.stem)
+    return Path("/" + normal.replace("__", "/")) / recorded.name
+
+
+def _directory_of(stored: Path, script_stem: str) -> str:
+    """
+    The directory part of a storage's name, for a script whose file name (without
+    suffix) is script_stem
+    """
+    if stored.stem.endswith("__" + script_stem):
+        return stored.stem[: -len(script_stem) - 2]
+    return stored.stem.rpartition("__")[0]
+
+
+def _shard(flat: Path) -> Path:
+    """
+    Move a storage kept directly in HACENADA_HOME, as older versions did, and its
+    summary, into its bucket
+    """
+    target = bucket(script_of(flat).parent) / flat.name
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(flat, target)
+    if summary_path(flat).exists():
+        os.replace(summary_path(flat), summary_path(target))
+    # blobs it refers to must stay alive, so collection has to read it where it is
+    blob_store().move_referrer(flat, target)
+    return target
+
+
+def _remove_bucket(stored: Path):
+    """
+    Remove the bucket the storage at stored was in, if nothing else is kept there
+    """
+    if stored.parent.parent == HACENADA_HOME / SESSIONS:
+        with contextlib.suppress(OSError):
+            stored.parent.rmdir()
+
+
+def shard_sessions() -> int:
+    """
+    Move every storage kept directly in HACENADA_HOME into its bucket, returning how
+    many were moved
+    """
+    flat = [
+        p for suffix in ENCODINGS.values() for p in HACENADA_HOME.glob(f"*{suffix}")
+    ]
+    for stored in flat:
+        _shard(stored)
+    return len(flat)
+
+
 def _normalize_path(pth: Path, suffix: typing.Optional[str] = None) -> str:
     """
     Produce a string version of pth replacing / with __ to produce a legal filename
@@ -41,6 +260,24 @@ def _normalize_path(pth: Path, suffix: typing.Optional[str] = None) -> str:
     return s.strip("/").replace("/", "__")
 
 
+class _Pending(Storage):
+    """
+    The tables of a storage as read once, changed in memory until they're written
+    together
+
+    See HomeDirectoryStorage._one_write().
+    """
+
+    def __init__(self, data: STR_DICT):
+        self.data = data
+
+    def read(self) -> STR_DICT:
+        return self.data
+
+    def write(self, data: STR_DICT):
+        self.data = data
+
+
 @attr.s(auto_attribs=True)
 class HomeDirectoryStorage(SessionStorage):
     """
@@ -50,18 +287,114 @@ class HomeDirectoryStorage(SessionStorage):
     db: TinyDB
     answer: table.Table
     meta: table.Table
+    path: typing.Optional[Path] = None
 
     def to_structured(self):
-        return dict(meta=self.meta.all()[0], answer=self.answer.all())
+        ret = dict(meta=self.meta.all()[0], answer=self.answer.all())
+        if len(self.checkpoints):
+            ret["checkpoint"] = self.checkpoints.all()
+        return ret
+
+    def replace_structured(self, data: STR_DICT):
+        """
+        Make this storage hold data, in the shape to_structured() returns
+
+        Only the answers that changed are written, all in one write, and large string
+        values go to the blob store, as they do when answers are saved one at a time.
+        The checkpoints in data are ignored: writing the answers keeps this storage's
+        own.
+        """
+        wanted = data.get("answer") or []
+        labels = {a["label"] for a in wanted}
+        current = {a["label"]: a for a in self.answer.all()}
+        changed = [a for a in wanted if current.get(a["label"]) != a]
+        meta = dict(data.get("meta") or {})
+        if not (current.keys() - labels or changed or self.meta.all()[0] != meta):
+            return
+        with self._one_write():
+            for label in current.keys() - labels:
+                self.forget_answer(label)
+            for answered in changed:
+                value = self._answer(answered["label"], answered["value"])["value"]
+                self._put(typing.cast(Answer, dict(answered, value=value)))
+            if self.meta.all()[0] != meta:
+                self.update_meta(**meta)
 
     @classmethod
-    def from_path(cls, path: Path) -> HomeDirectoryStorage:
+    def from_structured(
+        cls, data: STR_DICT, path: typing.Optional[Path] = None
+    ) -> HomeDirectoryStorage:
+        """
+        A storage holding data in the same shape as to_structured() returns
+
+        It is in memory, unless a path (which must not exist yet) is given to write it
+        to.
+        """
+        db = TinyDB(storage=MemoryStorage) if path is None else _new_db(path)
+        self = cls(db=db, answer=db.table("answer"), meta=db.table("meta"), path=path)
+        self.meta.insert(dict(data.get("meta") or {}))
+        self.answer.insert_multiple(data.get("answer") or [])
+        self.checkpoints.insert_multiple(data.get("checkpoint") or [])
+        return self
+
+    @contextlib.contextmanager
+    def lock(self, timeout: typing.Optional[float] = None) -> typing.Iterator[None]:
+        """
+        Hold the lock on this session while the block runs; see locked()
+
+        If the session was migrated to another encoding before the lock was
+        taken, it is opened again from there. An in-memory storage has nothing
+        to lock.
+        """
+        if self.path is None:
+            yield
+            return
+        with locked(self.path, timeout):
+            moved = [
+                self.path.with_suffix(suffix)
+                for suffix in ENCODINGS.values()
+                if self.path.with_suffix(suffix).exists()
+            ]
+            if not self.path.exists() and moved:
+                self.db.close()
+                self.db = _new_db(moved[0])
+                self.answer, self.meta, self.path = (
+                    self.db.table("answer"),
+                    self.db.table("meta"),
+                    moved[0],
+                )
+            yield
+
+    @property
+    def encoding(self) -> str:
+        """
+        The encoding this storage is kept in, which is also used for its log
+        """
+        if self.path is not None and self.path.suffix == ENCODINGS["compact"]:
+            return "compact"
+        return DEFAULT_ENCODING
+
+    @classmethod
+    def from_path(
+        cls, path: Path, encoding: typing.Optional[str] = None
+    ) -> HomeDirectoryStorage:
         """
         From the path to the .toml script, find the storage in the homedir
+
+        An existing storage is opened in whatever encoding it was created with;
+        asking for a different encoding than the existing one is an error.
         """
-        normal = _normalize_path(path.absolute(), suffix=".json")
-        self = cls._from_json_path(HACENADA_HOME / normal)
-        self.script_path = path
+        found = _existing_encoding(path)
+        if encoding is None:
+            encoding = found or DEFAULT_ENCODING
+        elif found and found != encoding:
+            raise error.StorageError(
+                f"Storage for {path} is already {found}-encoded, "
+                f"cannot open it as {encoding}"
+            )
+
+        self = cls._from_json_path(session_path(path, ENCODINGS[encoding]))
+        self.update_meta(script_path=str(path), script=str(Path(path).absolute()))
         return self
 
     #  @classmethod
@@ -74,11 +407,21 @@ class HomeDirectoryStorage(SessionStorage):
         """
         Try to infer the session storage from the directory we're currently in.
 
-        Looks for any storage.json that has a prefix of the current absolute cwd path.
+        Looks for the storage of a script in the current directory, in the
+        directory's bucket; any left directly in HACENADA_HOME are moved there first.
         """
         cwd = Path.cwd()
-        normal = _normalize_path(cwd, "")
-        any_json = list(HACENADA_HOME.glob(f"{normal}*.json"))
+        normal = _normalize_path(cwd)
+        for suffix in ENCODINGS.values():
+            for flat in HACENADA_HOME.glob(f"{normal}__*{suffix}"):
+                if _in_directory(flat.name, normal):
+                    _shard(flat)
+        any_json = [
+            found
+            for suffix in ENCODINGS.values()
+            for found in bucket(cwd).glob(f"{normal}__*{suffix}")
+            if _in_directory(found.name, normal)
+        ]
         if len(any_json) > 1:
             raise error.MultipleNextFound(
                 f"Multiple possible storages found: {[str(p) for p in any_json]}"
@@ -91,7 +434,7 @@ class HomeDirectoryStorage(SessionStorage):
     @classmethod
     def _from_json_path(cls, path: Path) -> HomeDirectoryStorage:
         """
-        SessionStorage from a Path to a .json tinydb
+        SessionStorage from a Path to a tinydb, in the encoding implied by its suffix
         """
         path.parent.mkdir(parents=True, exist_ok=True)
         db = _new_db(path)
@@ -99,43 +442,328 @@ class HomeDirectoryStorage(SessionStorage):
         meta = db.table("meta")
         if len(meta) == 0:
             meta.insert({})
-        return cls(db=db, answer=answer, meta=meta)
+        return cls(db=db, answer=answer, meta=meta, path=path)
 
     def save_answer(self, answer: STR_DICT):
         """
         Save one answer to tinydb
+
+        Large string values go to the blob store, and only a reference is saved.
         """
         k, v = list(answer.items())[0]
-        d = Answer(label=k, value=v, when=datetime.datetime.now())
-        self.answer.upsert(d, where("label") == list(answer.keys())[0])
+        self._put(self._answer(k, v))
+
+    def save_cached(self, label: str, value: typing.Any):
+        """
+        Save one answer to tinydb, marked as remembered from an earlier run
+        """
+        d = self._answer(label, value)
+        d["cached"] = True
+        self._put(d)
+
+    def _answer(self, k: str, v: typing.Any) -> Answer:
+        """
+        The record of answer v to step k, with a large string value moved to the blob
+        store
+        """
+        if (
+            self.path is not None
+            and isinstance(v, str)
+            and len(v.encode("utf-8")) > blob.BLOB_THRESHOLD
+        ):
+            blobs = blob_store()
+            v = blobs.put(v)
+            blobs.add_referrer(self.path)
+        return Answer(label=k, value=v, when=datetime.datetime.now())
+
+    def skip_step(self, label: str):
+        """
+        Record a skipped step, with no value
+        """
+        self._put(
+            Answer(label=label, value=None, when=datetime.datetime.now(), skipped=True)
+        )
+
+    def _put(self, d: Answer):
+        """
+        Save d in place of the answer with its label, remembering that answer for undo()
+        """
+        with self._one_write():
+            self._remember([d["label"]])
+            self._replace(d)
+            self.update_meta()
+
+    def _replace(self, d: Answer):
+        """
+        Replace the answer with d's label by d, in place (so no earlier mark
+        survives), or add it
+        """
+
+        def _replace(doc):
+            doc.clear()
+            doc.update(d)
+
+        if not self.answer.update(_replace, where("label") == d["label"]):
+            self.answer.insert(d)
+
+    def forget_answer(self, label: str):
+        """
+        Delete an answer from tinydb
+        """
+        with self._one_write():
+            self._remember([label])
+            self.answer.remove(where("label") == label)
+            self.update_meta()
+
+    def relabel_answers(self, relabel: typing.Dict[str, str]):
+        """
+        Move answers to new labels in one write
+        """
+        with self._one_write():
+            self._remember(list(relabel) + list(relabel.values()))
+            answers = self.answer.all()
+            for answer in answers:
+                answer["label"] = relabel.get(answer["label"], answer["label"])
+            self.answer.truncate()
+            self.answer.insert_multiple(answers)
+            self.update_meta()
+
+    @property
+    def checkpoints(self) -> table.Table:
+        """
+        What the answers were before each change since a checkpoint, oldest first
+
+        Each record holds, for every label changed between one checkpoint and the
+        next, its answer as it was before (None if it had none), and likewise the
+        meta properties an answer sets, such as the description. The last record
+        is open, collecting changes, until checkpoint() seals it.
+        """
+        return self.db.table("checkpoint")
+
+    def _remember(self, labels: typing.List[str], meta: typing.Sequence[str] = ()):
+        """
+        Note what the answers with labels, and meta properties, are before they change
+
+        Those the open record already has are left as they are.
+        """
+        records = self.checkpoints.all()
+        is_open = bool(records) and not records[-1]["sealed"]
+        record: STR_DICT = (
+            dict(records[-1]) if is_open else dict(before={}, meta={}, sealed=False)
+        )
+        before, props = dict(record["before"]), dict(record["meta"])
+        new = [label for label in labels if label not in before]
+        new_meta = [key for key in meta if key not in props]
+        if not (new or new_meta):
+            return
+        for label in new:
+            answered = self.answer.get(where("label") == label)
+            before[label] = dict(answered) if answered else None
+        for key in new_meta:
+            props[key] = self.meta.all()[0].get(key)
+        record.update(before=before, meta=props)
+        if is_open:
+            self.checkpoints.update(record, doc_ids=[records[-1].doc_id])
+        else:
+            self.checkpoints.insert(record)
+
+    def checkpoint(self):
+        """
+        Seal the changes made since the last checkpoint, so undo() goes back to here
+
+        Only the last CHECKPOINTS are kept.
+        """
+        records = self.checkpoints.all()
+        if not records or records[-1]["sealed"]:
+            return
+        self.checkpoints.update({"sealed": True}, doc_ids=[records[-1].doc_id])
+        if len(records) > CHECKPOINTS:
+            self.checkpoints.remove(
+                doc_ids=[r.doc_id for r in records[: len(records) - CHECKPOINTS]]
+            )
+
+    def undo(self) -> typing.Optional[typing.List[str]]:
+        """
+        Put the answers back as they were at the last checkpoint, or the one before if
+        nothing changed since
+
+        Returns the labels of the answers put back, or None if there is no checkpoint
+        to go back to.
+        """
+        records = self.checkpoints.all()
+        if not records:
+            return None
+        record = records[-1]
+        with self._one_write():
+            for label, answered in record["before"].items():
+                if answered is None:
+                    self.answer.remove(where("label") == label)
+                else:
+                    self._replace(typing.cast(Answer, answered))
+            self.checkpoints.remove(doc_ids=[record.doc_id])
+            props = self.meta.all()[0]
+            props.update(record["meta"])
+            self.meta.truncate()
+            self.meta.insert({k: v for k, v in props.items() if v is not None})
+            self.update_meta()
+        return sorted(record["before"])
+
+    @property
+    def step_digests(self) -> typing.Dict[str, str]:
+        """
+        The step digests saved in the meta properties
+        """
+        return self.meta.all()[0].get("steps", {})
+
+    @step_digests.setter
+    def step_digests(self, value: typing.Dict[str, str]):
+        """
+        Save the step digests in the meta properties
+        """
+        self.update_meta(steps=value)
 
     def update_meta(self, **kw):
         """
         Save any property k=v pair to the meta properties
+
+        Setting properties to the values they already have is not a change.
         """
         props = self.meta.all()[0]
-        props.update(kw)
-        self.meta.update(props)
+        if kw and all(props.get(k) == v for k, v in kw.items()):
+            return
+        with self._one_write():
+            props.update(kw)
+            props["revision"] = props.get("revision", 0) + 1
+            self.meta.update(props)
+
+    @contextlib.contextmanager
+    def _one_write(self) -> typing.Iterator[None]:
+        """
+        Make the changes in the block with one write of the storage, and one of its
+        summary
+
+        The tables are read once and changed in memory; if the block raises,
+        nothing is written. A block within another is part of the outer one.
+        """
+        real = self.answer.storage
+        if isinstance(real, _Pending):
+            yield
+            return
+        pending = _Pending(real.read() or {})
+        tables = [self.answer, self.meta, self.checkpoints]
+        # tinydb has no public way to point a table at another storage
+        for t in tables:
+            t._storage = pending
+        try:
+            yield
+            real.write(pending.data)
+            if self.path is not None:
+                self.write_summary()
+        finally:
+            for t in tables:
+                t._storage = real
+                t.clear_cache()
+                t._next_id = None
+
+    def summary(self) -> STR_DICT:
+        """
+        What `hacenada status` shows of this session, from the storage alone
+
+        Steps are those of the script when the answers were last reconciled (see
+        step_digests); a foreach step is done when any of its items is answered.
+        """
+        props = self.meta.all()[0]
+        answers = self.answer.all()
+        answered = {a["label"].partition("[")[0] for a in answers} | {
+            a["label"] for a in answers
+        }
+        steps = list(props.get("steps", {}))
+        # naive times are local, as DateTimeSerializer takes them
+        last = max(
+            (a["when"].astimezone(datetime.timezone.utc) for a in answers), default=None
+        )
+        return dict(
+            script_path=props.get("script_path", ""),
+            script=props.get("script", ""),
+            description=props.get("description", ""),
+            done=sum(1 for label in steps if label in answered),
+            total=len(steps),
+            current=next((label for label in steps if label not in answered), None),
+            last_answer=last.isoformat() if last else None,
+            revision=props.get("revision", 0),
+        )
+
+    def write_summary(self):
+        """
+        Write summary() beside the storage, where listing sessions can read it without
+        opening them
+        """
+        path = summary_path(typing.cast(Path, self.path))
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.summary(), f)
+        os.replace(tmp, path)
+
+    @property
+    def revision(self) -> int:
+        """
+        How many times the session has changed: every write counts one
+        """
+        return self.meta.all()[0].get("revision", 0)
 
     def get_answer(self, label: str) -> typing.Optional[Answer]:
         """
         Look up an answer by label string in tinydb
+
+        A value kept in the blob store is loaded in full.
         """
         ans = self.answer.get(where("label") == label)
         if ans is None:
             return None
 
-        return Answer(label=ans["label"], value=ans["value"], when=ans["when"])
+        value = blob_store().resolve(ans["value"])
+        ret = Answer(label=ans["label"], value=value, when=ans["when"])
+        if ans.get("skipped"):
+            ret["skipped"] = True
+        if ans.get("cached"):
+            ret["cached"] = True
+        return ret
 
     @classmethod
     def drop_path(cls, toml_path):
         """
         Drop the storage corresponding to toml_path, which is a .toml filename
+
+        The storage file is removed in every encoding, so the next session may
+        choose a different one.
+        """
+        absolute = Path(toml_path).absolute()
+        _existing_encoding(absolute)
+        stored = session_path(absolute, ENCODINGS[DEFAULT_ENCODING])
+        with locked(stored):
+            for suffix in ENCODINGS.values():
+                session_path(absolute, suffix).unlink(missing_ok=True)
+            summary_path(stored).unlink(missing_ok=True)
+            lock_path(stored).unlink(missing_ok=True)
+        _remove_bucket(stored)
+        complete.forget(HACENADA_HOME, absolute)
+
+    def drop(self):
         """
-        store = cls.from_path(toml_path)
-        store.answer.truncate()
-        store.meta.truncate()
-        store.meta.insert({})
+        Delete the storage, with its summary and lock file, when its session is finished
+
+        The caller holds the session's lock (see lock()), so it isn't taken
+        again. An in-memory storage has nothing to delete.
+        """
+        if self.path is None:
+            return
+        script_path = self.script_path
+        self.db.close()
+        self.path.unlink(missing_ok=True)
+        summary_path(self.path).unlink(missing_ok=True)
+        lock_path(self.path).unlink(missing_ok=True)
+        _remove_bucket(self.path)
+        complete.forget(HACENADA_HOME, script_path)
 
     @property
     def description(self) -> str:
@@ -147,9 +775,12 @@ class HomeDirectoryStorage(SessionStorage):
     @description.setter
     def description(self, value: str):
         """
-        Set the meta description of the session in tinydb
+        Set the meta description of the session in tinydb, remembering it for undo()
         """
-        self.update_meta(description=value)
+        with self._one_write():
+            if value != self.description:
+                self._remember([], meta=["description"])
+            self.update_meta(description=value)
 
     @property
     def script_path(self) -> Path:
@@ -185,10 +816,43 @@ class DateTimeSerializer(Serializer):
         return ret
 
 
+def stored_path(script_path: Path) -> typing.Optional[Path]:
+    """
+    Where the storage of script_path's session is, without opening it, or None if
+    there is none
+    """
+    found = _existing_encoding(script_path)
+    if found is None:
+        return None
+    return session_path(script_path, ENCODINGS[found])
+
+
+def _existing_encoding(script_path: Path) -> typing.Optional[str]:
+    """
+    The encoding of the storage already present for script_path, if any
+
+    A storage left directly in HACENADA_HOME is moved into its bucket.
+    """
+    absolute = Path(script_path).absolute()
+    found = None
+    for encoding, suffix in ENCODINGS.items():
+        flat = HACENADA_HOME / _normalize_path(absolute, suffix)
+        if flat.exists():
+            _shard(flat)
+        if found is None and session_path(absolute, suffix).exists():
+            found = encoding
+    return found
+
+
 def _new_db(path: Path) -> TinyDB:
     """
     Construct a TinyDB with our customizations
+
+    Compact storage encodes datetimes natively; json needs the serializer.
     """
+    if path.suffix == ENCODINGS["compact"]:
+        return TinyDB(path, storage=CompactStorage)
+
     serialization = SerializationMiddleware()
     serialization.register_serializer(DateTimeSerializer(), "TinyDate")
     return TinyDB(path, storage=serialization)
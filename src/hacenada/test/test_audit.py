@@ -0,0 +1,148 @@
+"""
+Test the audit event stream
+"""
+import json
+import socket
+import threading
+import time
+from unittest.mock import patch
+
+import attr
+from pytest import mark, raises
+
+from hacenada import audit
+
+
+@attr.s(auto_attribs=True)
+class GatedSink(audit.MemorySink):
+    """
+    A sink that holds up every write until the gate opens
+    """
+
+    gate: threading.Event = attr.Factory(threading.Event)
+
+    def write(self, lines):
+        self.gate.wait()
+        super().write(lines)
+
+
+def test_batches():
+    """
+    Are queued events written together, with the common fields added?
+    """
+    sink = GatedSink()
+    log = audit.AuditLog(sink=sink, fields={"host": "h"}, batch_size=10)
+    log.emit({"event": "shown", "label": "q0"})
+    for n in range(50):
+        log.emit({"event": "answered", "label": f"q{n}", "value": n})
+    sink.gate.set()
+    log.close()
+
+    assert len(sink.lines) == 51
+    assert 6 <= sink.batches <= 7
+    assert sink.events[0] == {"host": "h", "event": "shown", "label": "q0"}
+    assert sink.events[-1]["value"] == 49
+
+
+def test_never_blocks():
+    """
+    When the sink is stuck, are events dropped rather than waited for?
+    """
+    sink = GatedSink()
+    log = audit.AuditLog(sink=sink, queue_size=2)
+    log.emit({"event": "shown"})
+    while not log._queue.empty():
+        # wait for the writer to take it and get stuck
+        time.sleep(0.001)
+    for n in range(10):
+        log.emit({"event": "answered", "value": n})
+    assert log.dropped == 8
+
+    with patch.object(sink, "close") as m_close:
+        log.close(timeout=0.01)
+        sink.gate.set()
+    m_close.assert_not_called()
+
+
+def test_failures():
+    """
+    Are events the sink refuses counted, without stopping later writes?
+    """
+    sink = audit.MemorySink()
+    log = audit.AuditLog(sink=sink)
+    with patch.object(sink, "write", side_effect=OSError):
+        log.emit({"event": "lost"})
+        log.close()
+    assert log.failed == 1
+
+
+def test_shorten():
+    """
+    Are long answers cut short?
+    """
+    sink = audit.MemorySink()
+    log = audit.AuditLog(sink=sink)
+    log.emit({"event": "answered", "value": "x" * 5000})
+    log.close()
+    assert sink.events[0]["value"] == "x" * audit.MAX_VALUE + "… (5000 characters)"
+
+
+def test_file_sink(tmp_path):
+    sink = audit.open_sink(f"file:{tmp_path}/audit.jsonl")
+    sink.write(['{"a": 1}\n'])
+    sink.write(['{"b": 2}\n', '{"c": 3}\n'])
+    sink.close()
+    assert (tmp_path / "audit.jsonl").read_text().count("\n") == 3
+
+
+def test_unix_socket_sink(tmp_path):
+    """
+    Do I send to a unix socket, and reconnect after it goes away?
+    """
+    path = tmp_path / "audit.sock"
+    sink = audit.open_sink(f"unix:{path}")
+    with raises(OSError):
+        sink.write(["nobody listening\n"])
+
+    server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    server.bind(str(path))
+    server.listen(1)
+    sink.write(['{"a": 1}\n'])
+    conn, _ = server.accept()
+    sink.close()
+    assert conn.recv(100) == b'{"a": 1}\n'
+    conn.close()
+    server.close()
+
+
+def test_syslog_sink():
+    import syslog
+
+    sink = audit.open_sink("syslog:")
+    with patch.object(syslog, "openlog") as m_open, patch.object(
+        syslog, "syslog"
+    ) as m_log:
+        sink.write(['{"a": 1}\n', '{"b": 2}\n'])
+    m_open.assert_called_once_with("hacenada", 0, syslog.LOG_USER)
+    m_log.assert_called_with(syslog.LOG_INFO, '{"b": 2}')
+    assert audit.open_sink("syslog:runbooks") == audit.SyslogSink("runbooks")
+
+
+@mark.parametrize("name", ["file:", "http://x", "nope", "memory:"])
+def test_open_sink_unknown(name):
+    with raises(ValueError, match="unknown audit sink"):
+        audit.open_sink(name)
+
+
+def test_to():
+    """
+    Does every event say who ran the session, and where?
+    """
+    with patch.object(audit, "open_sink", return_value=audit.MemorySink()):
+        log = audit.AuditLog.to("syslog:")
+    log.emit({"event": "shown"})
+    log.close()
+    event = log.sink.events[0]
+    assert event["host"] == socket.gethostname()
+    assert set(event) == {"user", "host", "event"}
+    json.dumps(event)
@@ -0,0 +1,85 @@
+"""
+Test the content-addressed store for large answers
+"""
+import os
+import time
+
+from pytest import fixture
+
+from hacenada import blob
+
+
+@fixture
+def blobs(tmp_path):
+    return blob.BlobStore(tmp_path / "blobs")
+
+
+def test_put_get(blobs):
+    """
+    Is a value stored once, compressed, and read back by reference?
+    """
+    value = "big answer\n" * 1000
+    ref = blobs.put(value)
+    assert ref == blob.BlobRef(blob=ref["blob"], size=len(value))
+    assert blob.is_ref(ref)
+    assert not blob.is_ref(value)
+    assert not blob.is_ref({"label": "q1"})
+    assert not blob.is_ref({"blob": "my favourite", "size": 3})
+    assert not blob.is_ref({"blob": ref["blob"], "size": 3, "color": "red"})
+    assert not blob.is_ref({"blob": ref["blob"], "size": "3"})
+
+    stored = list(blobs.root.glob("??/*"))
+    assert len(stored) == 1
+    assert stored[0].stat().st_size < len(value)
+
+    # the same value again is deduplicated
+    assert blobs.put(value) == ref
+    assert len(list(blobs.root.glob("??/*"))) == 1
+
+    assert blobs.get(ref) == value
+    assert blobs.resolve(ref) == value
+    assert blobs.resolve("small") == "small"
+
+
+def test_collect(blobs, tmp_path):
+    """
+    Do I delete only old blobs that no existing referrer mentions?
+    """
+    assert blobs.referrers() == []
+    kept = blobs.put("kept" * 2000)
+    orphan = blobs.put("orphan" * 2000)
+    young = blobs.put("young" * 2000)
+
+    referrer = tmp_path / "session.json"
+    referrer.write_text(f'{{"value": {{"blob": "{kept["blob"]}"}}}}')
+    blobs.add_referrer(referrer)
+    blobs.add_referrer(referrer)
+    gone = tmp_path / "gone.json"
+    blobs.add_referrer(gone)
+    assert blobs.referrers() == [referrer, gone]
+
+    old = time.time() - blob.GRACE_SECONDS - 10
+    for ref in kept, orphan:
+        os.utime(blobs._path(ref["blob"]), (old, old))
+
+    stats = blobs.collect()
+    assert stats.kept == 2
+    assert stats.deleted == 1
+    assert stats.freed > 0
+    assert not blobs._path(orphan["blob"]).exists()
+    assert blobs._path(young["blob"]).exists()
+    assert blobs.referrers() == [referrer]
+
+    # once the referrer is gone, so is the blob
+    referrer.unlink()
+    stats = blobs.collect(now=time.time() + blob.GRACE_SECONDS + 10)
+    assert stats.deleted == 2
+    assert blobs.referrers() == []
+
+
+def test_collect_empty(blobs):
+    """
+    Can I collect a store that was never used?
+    """
+    assert blobs.collect() == blob.CollectStats()
+    assert not blobs.root.exists()
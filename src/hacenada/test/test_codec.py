@@ -0,0 +1,121 @@
+"""
+Test the compact binary encoding
+"""
+import datetime
+
+from pytest import mark, raises
+
+from hacenada import codec, error, storage
+
+
+NOW = datetime.datetime(2022, 6, 7, 12, 30, 15, 123456, tzinfo=datetime.timezone.utc)
+
+
+@mark.parametrize(
+    "value",
+    [
+        None,
+        True,
+        False,
+        0,
+        -(2**63),
+        3.25,
+        "",
+        "héllo\nthere",
+        b"\x00\xff",
+        [],
+        [1, "two", [3.0, None]],
+        {"label": "q1", "value": {"nested": [True]}, "when": NOW},
+        NOW,
+    ],
+)
+def test_round_trip(value):
+    """
+    Does every supported type survive dumps/loads?
+    """
+    assert codec.loads(codec.dumps(value)) == value
+
+
+def test_naive_datetime():
+    """
+    Are naive datetimes treated as local time and decoded as aware UTC?
+    """
+    naive = datetime.datetime(2022, 6, 7, 12, 30, 15)
+    decoded = codec.loads(codec.dumps(naive))
+    assert decoded.tzinfo is not None
+    assert decoded == naive.astimezone(datetime.timezone.utc)
+
+
+def test_encode_errors():
+    """
+    Do unsupported values raise a CodecError?
+    """
+    with raises(error.CodecError, match="can't encode"):
+        codec.dumps(object())
+    with raises(error.CodecError, match="out of range"):
+        codec.dumps(2**64)
+
+
+def test_records():
+    """
+    Do record streams round trip, and reject garbage?
+    """
+    records = [["hacenada", {"name": "x"}], ["step", {"message": "m"}]]
+    data = codec.dump_records(records)
+    assert codec.is_compact(data)
+    assert list(codec.load_records(data)) == records
+
+    with raises(error.CodecError, match="bad header"):
+        list(codec.load_records(b"{}"))
+    with raises(error.CodecError, match="truncated record"):
+        list(codec.load_records(data[:-1]))
+    with raises(error.CodecError, match="truncated record"):
+        list(codec.load_records(data + b"\x01"))
+    with raises(error.CodecError, match="unknown tag"):
+        list(codec.load_records(codec.HEADER + b"\x01\x00\x00\x00Z"))
+    with raises(error.CodecError, match="length mismatch"):
+        list(codec.load_records(codec.HEADER + b"\x02\x00\x00\x00NN"))
+    with raises(error.CodecError, match="corrupt record"):
+        list(codec.load_records(codec.HEADER + b"\x02\x00\x00\x00i\x00"))
+    with raises(error.CodecError, match="corrupt value"):
+        codec.loads(b"s\x05\x00\x00\x00\xff\xff\xff\xff\xff")
+
+
+def test_compact_storage(tmp_path):
+    """
+    Does a TinyDB kept in CompactStorage hold documents, empty tables and datetimes?
+    """
+    path = tmp_path / "db.hcnb"
+    db = storage._new_db(path)
+    db.table("meta").insert({})
+    db.table("answer").insert({"label": "q1", "value": "a1", "when": NOW})
+    db.table("empty")
+    db.close()
+
+    db = storage._new_db(path)
+    assert db.table("answer").all() == [{"label": "q1", "value": "a1", "when": NOW}]
+    assert db.table("meta").all() == [{}]
+    assert codec.is_compact(path.read_bytes())
+
+
+def test_size(tmp_path):
+    """
+    Is a session with large captured answers smaller compact?
+
+    How much faster it reads is measured by tools/bench-codec.
+    """
+    captured = 'captured "output"\twith \\escapes\n' * 2000
+    docs = [
+        dict(label=f"step-{n}", value=captured if n % 5 == 0 else "yes", when=NOW)
+        for n in range(100)
+    ]
+
+    sizes = {}
+    for encoding, suffix in storage.ENCODINGS.items():
+        path = tmp_path / f"session{suffix}"
+        db = storage._new_db(path)
+        db.table("answer").insert_multiple(docs)
+        db.close()
+        sizes[encoding] = path.stat().st_size
+
+    assert sizes["compact"] < sizes["json"]
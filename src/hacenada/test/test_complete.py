@@ -0,0 +1,131 @@
+"""
+Test shell completion from the completion cache
+"""
+import os
+import subprocess
+import sys
+from unittest.mock import patch
+
+from click.testing import CliRunner
+
+from hacenada import complete, main, storage
+
+
+def test_remember_forget(tmp_path):
+    """
+    Are sessions' scripts and labels recorded, and removed, only writing when something
+    changed?
+    """
+    home = tmp_path / "home"
+    assert complete.load(home) == {}
+    complete.remember(home, tmp_path / "a.toml", ["q1", "q2"])
+    written = (home / complete.CACHE).stat().st_mtime_ns
+    complete.remember(home, tmp_path / "a.toml", ["q1", "q2"])
+    assert (home / complete.CACHE).stat().st_mtime_ns == written
+    complete.remember(home, tmp_path / "b.toml", ["q3"])
+    assert complete.load(home) == {
+        str(tmp_path / "a.toml"): ["q1", "q2"],
+        str(tmp_path / "b.toml"): ["q3"],
+    }
+    complete.forget(home, tmp_path / "a.toml")
+    complete.forget(home, tmp_path / "a.toml")
+    assert list(complete.load(home)) == [str(tmp_path / "b.toml")]
+
+
+def test_candidates():
+    """
+    Are commands, session scripts and labels completed?
+    """
+    entries = {
+        "/work/deploy.toml": ["q1", "cert"],
+        "/elsewhere/other.toml": ["q1", "done"],
+    }
+    assert complete.candidates(entries, [], "/work") == list(complete.COMMANDS)
+    assert complete.candidates(entries, ["st"], "/work") == [
+        "start",
+        "status",
+        "storage",
+    ]
+    assert complete.candidates(entries, ["next", ""], "/work") == [
+        "/elsewhere/other.toml",
+        "deploy.toml",
+    ]
+    assert complete.candidates(entries, ["print", "--format=json", "d"], "/work") == [
+        "deploy.toml"
+    ]
+    assert complete.candidates(entries, ["next", "--"], "/work") == []
+    assert complete.candidates(entries, ["start", "d"], "/work") == []
+    assert complete.candidates(entries, ["start", "--start-over", "d"], "/work") == [
+        "deploy.toml"
+    ]
+    assert complete.candidates(entries, ["replay", "--until", ""], "/work") == [
+        "cert",
+        "done",
+        "q1",
+    ]
+    until = ["replay", "--script", "deploy.toml", "--until", "c"]
+    assert complete.candidates(entries, until, "/work") == ["cert"]
+    assert complete.candidates(entries, ["gc", ""], "/work") == []
+
+
+def test_commands():
+    """
+    Are all of hacenada's commands completed?
+    """
+    assert complete.COMMANDS == tuple(sorted(main.hacenada.commands))
+    assert complete.default_home() == storage.HACENADA_HOME
+
+
+def test_kept_up_to_date(my_project):
+    """
+    Do start and next record the session in progress, and a finished or dropped
+    session go?
+    """
+    runner = CliRunner()
+    home = storage.HACENADA_HOME
+    runner.invoke(
+        main.start, ["--renderer=plain", "project.toml"], input="completing\n"
+    )
+    assert complete.load(home) == {str(my_project): ["q1", "message-1"]}
+    runner.invoke(main.next, ["--renderer=plain"], input="y\n")
+    assert complete.load(home) == {}
+
+    complete.remember(home, my_project, ["q1"])
+    storage.HomeDirectoryStorage.drop_path(my_project)
+    assert complete.load(home) == {}
+
+
+def test_shell(tmp_path, capsys):
+    """
+    Does the completion code hacenada prints run this module, which completes from
+    the cache?
+    """
+    runner = CliRunner()
+    invoked = runner.invoke(main.completion, ["bash"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert f"{sys.executable} -m hacenada.complete" in invoked.stdout
+    assert (
+        "compdef _hacenada hacenada" in runner.invoke(main.completion, ["zsh"]).stdout
+    )
+
+    complete.remember(tmp_path / "hacenada", tmp_path / "work/deploy.toml", ["q1"])
+    (tmp_path / "work").mkdir()
+    completed = subprocess.run(
+        [sys.executable, "-m", "hacenada.complete", "next", "de"],
+        env=dict(
+            os.environ,
+            XDG_CONFIG_HOME=str(tmp_path),
+            PYTHONPATH=os.pathsep.join(sys.path),
+        ),
+        cwd=tmp_path / "work",
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    assert completed.stdout == "deploy.toml\n"
+
+    with patch.object(
+        complete, "default_home", return_value=tmp_path / "hacenada"
+    ), patch.object(os, "getcwd", return_value=str(tmp_path)):
+        complete.main(["undo", ""])
+    assert capsys.readouterr().out == "work/deploy.toml\n"
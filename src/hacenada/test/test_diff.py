@@ -0,0 +1,131 @@
+"""
+Test comparing two runs of a script
+"""
+import datetime
+import time
+
+from hacenada import diff, script, storage
+
+
+T0 = datetime.datetime(2026, 1, 1, tzinfo=datetime.timezone.utc)
+
+
+def run(name, steps, answers):
+    """
+    A run of a script with steps, answered with (label, value, minutes after T0)
+    """
+    data = dict(
+        hacenada={"name": name},
+        step=steps,
+        answer=[
+            dict(
+                label=label, value=value, when=T0 + datetime.timedelta(minutes=minutes)
+            )
+            for label, value, minutes in answers
+        ],
+    )
+    return diff.Run.of(
+        name,
+        script.Script.from_structured(data),
+        storage.HomeDirectoryStorage.from_structured(data),
+    )
+
+
+def test_compare():
+    """
+    Are steps matched by label, and changed steps, answers and timings reported in
+    order?
+    """
+    a = run(
+        "a",
+        [
+            {"message": "env", "label": "env"},
+            {"message": "gone", "label": "gone"},
+            {"message": "hosts", "label": "hosts", "foreach": ["x", "y"]},
+            {"message": "deploy", "label": "deploy"},
+        ],
+        [
+            ("env", "prod", 0),
+            ("gone", True, 1),
+            ("hosts[x]", "ok", 2),
+            ("hosts[y]", "ok", 3),
+            ("deploy", True, 5),
+        ],
+    )
+    b = run(
+        "b",
+        [
+            {"message": "new", "label": "new"},
+            {"message": "env", "label": "env"},
+            {"message": "hosts", "label": "hosts", "foreach": ["x", "y"]},
+            {"message": "deploy", "label": "deploy", "when": "env == 'prod'"},
+        ],
+        [
+            ("new", 1, 0),
+            ("env", "prod", 0),
+            ("hosts[x]", "ok", 2),
+            ("hosts[y]", "down", 3),
+            ("deploy", True, 95),
+        ],
+    )
+    changes, same = diff.compare(a, b, timing_threshold=120)
+    assert [(c.label, c.what, c.a, c.b) for c in changes] == [
+        ("new", "step added", "", "new"),
+        ("new", "answer changed", "(not answered)", "1"),
+        ("gone", "step removed", "gone", ""),
+        ("gone", "answer changed", "true", "(not answered)"),
+        ("hosts[y]", "answer changed", "ok", "down"),
+        ("deploy", "step changed", "deploy", "deploy (when: env == 'prod')"),
+        ("deploy", "timing", "2.0m", "1.5h"),
+    ]
+    assert same == 3
+    assert diff.compare(a, a) == ([], 6)
+
+
+def test_previews():
+    assert diff._show_answer({"value": None, "skipped": True}) == "(skipped)"
+    assert (
+        diff._preview({"blob": "a" * 64, "size": 70000})
+        == "<70000 byte value aaaaaaaaaaaa>"
+    )
+    assert diff._preview("line one\nline two") == "line one line two"
+    assert len(diff._preview("x" * 500)) == diff.PREVIEW_LENGTH
+    assert [diff._took(s) for s in (None, 59, 90, 7200)] == [
+        "0s",
+        "59s",
+        "1.5m",
+        "2.0h",
+    ]
+
+
+def test_order():
+    """
+    Are labels only in the first run kept after the label they followed?
+    """
+    assert diff._order(["x", "a", "y", "b", "z"], ["a", "b", "c"]) == [
+        "x",
+        "a",
+        "y",
+        "b",
+        "z",
+        "c",
+    ]
+
+
+def test_linear():
+    """
+    Does comparing runs of thousands of steps take about as long per step as small ones?
+    """
+
+    def timed(n):
+        steps = [{"message": f"step {i}", "label": f"s{i}"} for i in range(n)]
+        answers = [(f"s{i}", i, i) for i in range(n)]
+        a, b = run("a", steps, answers), run(
+            "b", steps, answers[:-1] + [(f"s{n - 1}", "changed", n - 1)]
+        )
+        started = time.perf_counter()
+        changes, same = diff.compare(a, b)
+        assert (len(changes), same) == (1, n - 1)
+        return time.perf_counter() - started
+
+    assert timed(4000) < timed(400) * 40
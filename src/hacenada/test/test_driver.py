@@ -0,0 +1,199 @@
+"""
+Test driving sessions from an event loop
+"""
+import asyncio
+import copy
+import time
+from unittest.mock import patch
+
+from pytest import raises
+
+from hacenada import abstract, driver, error, logfile, memo, script, storage
+
+
+class ChatRender(abstract.AsyncRender):
+    """
+    Answers each step after a pause, as a person in a chat would
+    """
+
+    def __init__(self, answers, pause=0.0):
+        self.answers = answers
+        self.pause = pause
+
+    async def render(self, step, context):
+        await asyncio.sleep(self.pause)
+        return {step["label"]: self.answers[step["label"]]}
+
+
+def _logged(script_path):
+    """
+    The storage written to the json log of script_path's only finished session
+    """
+    (log,) = script_path.with_suffix(".log.d").glob("*.json")
+    return logfile.load_log(log)[1]
+
+
+WAITS = {
+    "hacenada": {"name": "waits"},
+    "step": [
+        {"message": "env", "label": "env"},
+        {
+            "type": "wait",
+            "message": "up",
+            "label": "up",
+            "check": "true",
+            "cache": True,
+            "stop": False,
+        },
+        {
+            "type": "wait",
+            "message": "down",
+            "label": "down",
+            "check": "false",
+            "timeout": 0.05,
+        },
+        {"message": "skip me", "label": "skipped", "when": "env == 'never'"},
+    ],
+}
+
+
+def test_next_step_answer(my_project, scriptie):
+    """
+    Are steps given one at a time, answered, and saved to storage?
+    """
+    events = []
+
+    async def drive():
+        store = driver.ThreadedStorage.for_script(my_project)
+        sesh = await driver.AsyncSession.open(scriptie, store, on_event=events.append)
+        step = await sesh.next_step()
+        assert step["label"] == "q1"
+        assert (await sesh.next_step()) == step
+        with raises(error.StepNotPending, match=r"\[message-1\] is not the step"):
+            await sesh.answer("message-1", True)
+        await sesh.answer("q1", "from chat")
+        assert store.storage.description == "from chat"
+        # q1 is a stop, so undo can go back to before it
+        assert [c["sealed"] for c in store.storage.checkpoints] == [True]
+        assert (await sesh.next_step())["label"] == "message-1"
+        await sesh.answer("message-1", True)
+        assert await sesh.next_step() is None
+        assert await sesh.next_step() is None
+
+    asyncio.run(drive())
+    # the finished session is logged and removed, as next does
+    assert storage.stored_path(my_project) is None
+    saved = _logged(my_project)
+    assert [a["label"] for a in saved.answer] == ["q1", "message-1"]
+    assert saved.description == "from chat"
+    assert list(my_project.with_suffix(".log.d").glob("*.ipynb"))
+    assert [e["event"] for e in events] == [
+        "shown",
+        "answered",
+        "shown",
+        "answered",
+        "finished",
+    ]
+
+
+def test_run_concurrently(my_project, scriptie, tmp_path):
+    """
+    Do many sessions, each waiting on people, run at once in one loop?
+    """
+    paths = []
+    for n in range(20):
+        paths.append(tmp_path / f"project{n}.toml")
+        paths[-1].write_text(my_project.read_text())
+
+    async def drive_all():
+        renderer = ChatRender({"q1": "chat", "message-1": True}, pause=0.1)
+        sessions = [
+            await driver.AsyncSession.open(
+                scriptie, driver.ThreadedStorage.for_script(p), renderer
+            )
+            for p in paths
+        ]
+        await asyncio.gather(*(sesh.run() for sesh in sessions))
+        return sessions
+
+    started = time.monotonic()
+    sessions = asyncio.run(drive_all())
+    assert time.monotonic() - started < 1.5
+    assert all(sesh.finished for sesh in sessions)
+    for p in paths:
+        assert storage.stored_path(p) is None
+        assert len(_logged(p).answer) == 2
+
+    async def no_renderer():
+        sesh = await driver.AsyncSession.open(
+            scriptie, driver.ThreadedStorage.for_script(paths[0])
+        )
+        await sesh.step()
+
+    with raises(error.RenderError, match="no renderer"):
+        asyncio.run(no_renderer())
+
+
+def test_waits(my_project, tmp_path):
+    """
+    Are wait steps waited for in the loop, remembered, and a timeout reported after
+    saving the rest?
+    """
+    waits = script.Script.from_structured(WAITS)
+    cache = memo.StepCache(tmp_path / "cache")
+
+    async def drive(renderer=None):
+        store = driver.ThreadedStorage(
+            storage.HomeDirectoryStorage.from_path(my_project)
+        )
+        sesh = await driver.AsyncSession.open(waits, store, renderer, cache=cache)
+        assert (await sesh.next_step())["label"] == "env"
+        await sesh.answer("env", "prod")
+        with raises(error.WaitTimedOut, match=r"\[down\]"):
+            await sesh.next_step()
+        return store.storage
+
+    saved = asyncio.run(drive())
+    assert [a["label"] for a in saved.answer] == ["env", "up"]
+    assert saved.get_answer("up")["value"]["ok"]
+
+    # on another run, up is remembered; the renderer's waits are used
+    storage.HomeDirectoryStorage.drop_path(my_project)
+    saved = asyncio.run(drive(ChatRender({"env": "prod"})))
+    assert saved.get_answer("up")["cached"]
+
+    # once down succeeds, the skipped step is recorded and the script is finished
+    done = copy.deepcopy(WAITS)
+    done["step"][2]["check"] = "true"
+    sesh = asyncio.run(
+        driver.AsyncSession.open(
+            script.Script.from_structured(done), driver.ThreadedStorage(saved)
+        )
+    )
+    assert asyncio.run(sesh.next_step()) is None
+    assert storage.stored_path(my_project) is None
+    assert _logged(my_project).get_answer("skipped")["skipped"]
+
+
+def test_open_reconciles(my_project, scriptie):
+    """
+    Are answers to steps that were edited away discarded, and the change saved, when
+    the session is opened?
+    """
+    store = driver.ThreadedStorage.for_script(my_project)
+    store.storage.save_answer({"gone": "old"})
+    asyncio.run(driver.AsyncSession.open(scriptie, store))
+    assert store.storage.get_answer("gone") is None
+
+
+def test_threaded_storage_locks(my_project, scriptie):
+    """
+    Does a ThreadedStorage wait for the session's lock, as the commands do?
+    """
+    store = driver.ThreadedStorage.for_script(my_project)
+    with storage.locked(store.storage.path), patch.object(storage, "LOCK_TIMEOUT", 0):
+        with raises(error.StorageBusy):
+            asyncio.run(driver.AsyncSession.open(scriptie, store))
+    assert asyncio.run(store.load())["meta"]
+    asyncio.run(abstract.AsyncSessionStorage.checkpoint(store))
+    asyncio.run(abstract.AsyncSessionStorage.finish(store, scriptie))
@@ -0,0 +1,202 @@
+"""
+Test exporting answers for analytics
+"""
+import csv
+import io
+import json
+import sys
+from unittest.mock import MagicMock, patch
+
+from click.testing import CliRunner
+from pytest import fixture, raises
+
+from hacenada import const, error, export, logfile, main, storage
+
+
+@fixture
+def exported(my_project, scriptie, storagie):
+    """
+    An ongoing session of my_project, and a json and a compact log of earlier runs
+    """
+    storagie.save_answer({"q1": "ongoing"})
+    storagie.description = "ongoing"
+
+    logd = my_project.with_suffix(".log.d")
+    logd.mkdir()
+    # the script_path logged is as it was given, relative to wherever next ran
+    store = storage.HomeDirectoryStorage.from_structured(
+        {"meta": {"description": "first", "script_path": "elsewhere/project.toml"}}
+    )
+    store.save_answer({"q1": "first"})
+    store.save_answer({"message-1": True})
+    (logd / "2022-06-01-1--first.json").write_text(main.format_json(scriptie, store))
+    # as a log without a script_path: only its directory's name says whose it is
+    store.script_path = ""
+    logfile.write_compact(logd / "2022-06-02-1--second.hcnb", scriptie, store)
+    (logd / "2022-06-01-1--first.md").write_text("not a machine-readable log")
+    return my_project
+
+
+def _summary(rows):
+    return [
+        (r["source"], r["run"], r["run_date"], r["label"], r["type"], r["value"])
+        for r in rows
+    ]
+
+
+def test_answer_rows(exported):
+    """
+    Do I find every answer of every session and log, with the step it answers?
+    """
+    stats = export.ExportStats()
+    rows = list(export.answer_rows(stats))
+    today = rows[0]["answered_at"][:10]
+    assert _summary(rows) == [
+        ("session", rows[0]["run"], today, "q1", "description", "ongoing"),
+        ("log", "2022-06-01-1--first", "2022-06-01", "q1", "description", "first"),
+        ("log", "2022-06-01-1--first", "2022-06-01", "message-1", "message", True),
+        ("log", "2022-06-02-1--second", "2022-06-02", "q1", "description", "first"),
+        ("log", "2022-06-02-1--second", "2022-06-02", "message-1", "message", True),
+    ]
+    assert stats == export.ExportStats(sessions=1, logs=2, rows=5)
+    assert {r["script"] for r in rows} == {"hola"}
+    assert rows[0]["script_path"] == str(exported)
+    assert rows[1]["script_path"] == str(exported)
+    assert rows[1]["script_path"].endswith("project.toml")
+    assert rows[3]["script_path"] == str(exported.with_suffix(""))
+    assert rows[1]["description"] == "first"
+    assert list(rows[0]) == list(export.COLUMNS)
+
+
+def test_parallel(exported):
+    """
+    Do worker processes give the same rows, in the same order?
+    """
+    expected = list(export.answer_rows(export.ExportStats()))
+    with patch.object(export, "WINDOW", 1):
+        assert list(export.answer_rows(export.ExportStats(), jobs=2)) == expected
+
+
+def test_roots_and_failures(exported, tmp_path):
+    """
+    Do I find logs under other directories, and skip what I can't read?
+    """
+    elsewhere = tmp_path / "a/b/other.log.d"
+    elsewhere.mkdir(parents=True)
+    (elsewhere / "2022-07-01-1--x.json").write_text("{not json")
+    (tmp_path / "lone.log.d").mkdir()
+    (tmp_path / "lone.log.d/2022-07-02-1--y.hcnb").write_bytes(b"garbage")
+    (storage.HACENADA_HOME / "gone__away.json").write_text("{not json")
+
+    stats = export.ExportStats()
+    rows = list(export.answer_rows(stats, [tmp_path / "a", tmp_path / "lone.log.d"]))
+    assert len(rows) == 5
+    assert (stats.sessions, stats.logs) == (2, 4)
+    assert len(stats.failed) == 3
+    assert stats.failed[0].startswith(str(storage.HACENADA_HOME / "gone__away.json"))
+
+
+def test_script_missing(exported):
+    """
+    Is a session still exported when its script can't be loaded?
+    """
+    exported.unlink()
+    rows = list(export.answer_rows(export.ExportStats()))
+    assert (rows[0]["script"], rows[0]["type"], rows[0]["value"]) == ("", "", "ongoing")
+
+
+def test_session_busy(exported, storagie):
+    """
+    Is a session read under its lock, and closed after, or skipped while it is in use?
+    """
+    opened = []
+    real = storage.HomeDirectoryStorage._from_json_path
+
+    def _open(stored):
+        opened.append(real(stored))
+        return opened[-1]
+
+    with patch.object(
+        storage.HomeDirectoryStorage, "_from_json_path", side_effect=_open
+    ):
+        assert not export.parse_session(storagie.path).error
+        assert opened[0].db._opened is False
+        with patch.object(storage, "LOCK_TIMEOUT", 0), storagie.lock():
+            assert (
+                "in use by another hacenada"
+                in export.parse_session(storagie.path).error
+            )
+    assert len(opened) == 1
+
+
+def test_writers():
+    """
+    Does the CLI offer exactly the formats there are writers for?
+    """
+    assert tuple(export.WRITERS) == const.EXPORT_FORMATS
+
+
+def test_write_csv_jsonl():
+    """
+    Are rows written as csv and json lines, with non-text values as json in csv?
+    """
+    rows = [dict.fromkeys(export.COLUMNS, "x"), dict.fromkeys(export.COLUMNS, "y")]
+    rows[1].update(value=["a", "b"], skipped=True)
+
+    out = io.BytesIO()
+    export.WRITERS["csv"](rows, out)
+    read = list(csv.DictReader(io.StringIO(out.getvalue().decode("utf-8"))))
+    assert [r["value"] for r in read] == ["x", '["a", "b"]']
+    assert list(read[0]) == list(export.COLUMNS)
+
+    out = io.BytesIO()
+    export.WRITERS["jsonl"](rows, out)
+    assert [json.loads(line) for line in out.getvalue().splitlines()] == rows
+
+
+def test_write_parquet():
+    """
+    Are rows written to parquet in batches, when pyarrow is available?
+    """
+    rows = [dict.fromkeys(export.COLUMNS, "x") for n in range(5)]
+    rows[4]["value"] = None
+    pyarrow = MagicMock()
+    modules = {"pyarrow": pyarrow, "pyarrow.parquet": pyarrow.parquet}
+    with patch.dict(sys.modules, modules), patch.object(export, "PARQUET_BATCH", 2):
+        export.WRITERS["parquet"](iter(rows), io.BytesIO())
+    pw = pyarrow.parquet.ParquetWriter.return_value.__enter__.return_value
+    assert pw.write_table.call_count == 3
+    batches = [c[0][0] for c in pyarrow.Table.from_pylist.call_args_list]
+    assert [len(b) for b in batches] == [2, 2, 1]
+    assert batches[2][0]["value"] is None
+
+    with patch.dict(sys.modules, {"pyarrow": None}):
+        with raises(error.ExportError, match="needs pyarrow"):
+            export.WRITERS["parquet"]([], io.BytesIO())
+
+
+def test_export_cli(exported, tmp_path):
+    """
+    Does the export command write every answer, and say what it did?
+    """
+    runner = CliRunner(mix_stderr=False)
+    out = tmp_path / "answers.jsonl"
+    invoked = runner.invoke(
+        main.export_answers, ["--format=jsonl", f"--output={out}", "--jobs=1"]
+    )
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert len(out.read_text().splitlines()) == 5
+    assert invoked.stderr == "5 answers from 1 sessions and 2 logs\n"
+
+    (exported.with_suffix(".log.d") / "2022-06-03-1--bad.json").write_text("")
+    invoked = runner.invoke(main.export_answers, ["--jobs=1"])
+    assert invoked.exit_code == 1
+    assert invoked.stdout.startswith(",".join(export.COLUMNS))
+    assert "** skipped " in invoked.stderr
+
+    with patch.dict(sys.modules, {"pyarrow": None}):
+        invoked = runner.invoke(
+            main.export_answers, ["--format=parquet", f"--output={out}"]
+        )
+    assert invoked.exit_code == 2
+    assert "parquet export needs pyarrow" in invoked.stderr
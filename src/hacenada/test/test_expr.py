@@ -0,0 +1,85 @@
+"""
+Test the expression language for step conditions
+"""
+import re
+
+from pytest import mark, raises
+
+from hacenada import error, expr
+
+
+ANSWERS = {
+    "deploy_kind": "new",
+    "skip-dns": False,
+    "region": "us-east-1",
+    "count": "3",
+    "description": "hello",
+    "message-1": True,
+}
+
+
+@mark.parametrize(
+    "source,expected",
+    [
+        ['deploy_kind == "new"', True],
+        ["deploy_kind != 'new'", False],
+        ['deploy_kind == "new" and not skip-dns', True],
+        ["skip-dns or message-1", True],
+        ["not not message-1", True],
+        ['region in ["us-east-1", "eu-west-1"]', True],
+        ['region not in ["us-east-1"]', False],
+        ['"east" in region', True],
+        ["(count >= 3 or unanswered) and description != ''", True],
+        ["count > 2.5 and count < 4 and count <= 3", True],
+        ["count == -3", False],
+        ["unanswered == none", True],
+        ["unanswered", False],
+        ["true and not false", True],
+        ['"say \\"hi\\"" == "say \\"hi\\""', True],
+        ['count == "3" and count == 3 and count == 3.0', True],
+        ["count >= 10", False],
+        ["count in [1, 3] and 3 in [count]", True],
+        ['count not in ["1", 2]', True],
+        ["region < 3", False],
+        ['count < "x"', True],
+        ['"x" in unanswered', False],
+        ["[]", False],
+    ],
+)
+def test_evaluate(source, expected):
+    """
+    Do expressions evaluate correctly against answers?
+    """
+    compiled = expr.compile_expression(source)
+    assert compiled(ANSWERS.get) is expected
+
+
+def test_names():
+    """
+    Do I know which labels an expression refers to?
+    """
+    compiled = expr.compile_expression("a == 1 or (b and c in [d, 'e'])")
+    assert compiled.names == {"a", "b", "c", "d"}
+    assert compiled == expr.compile_expression("a == 1 or (b and c in [d, 'e'])")
+
+
+@mark.parametrize(
+    "source,match",
+    [
+        ["", "expected a value, found the end"],
+        ["a ==", "expected a value, found the end"],
+        ["(a", "expected ')', found the end"],
+        ["a b", "unexpected 'b'"],
+        ['"abc', "unexpected '\"abc'"],
+        ["[a b]", "expected ',', found 'b'"],
+        ["a == and", "unexpected 'and'"],
+        [")", "unexpected ')'"],
+        ["a = 1", "unexpected '= 1'"],
+    ],
+)
+def test_errors(source, match):
+    """
+    Are malformed expressions rejected when compiled?
+    """
+    with raises(error.ExpressionError, match=re.escape(match)):
+        expr.compile_expression(source)
@@ -0,0 +1,111 @@
+"""
+Test the storage load-testing harness
+"""
+from unittest.mock import patch
+
+from click.testing import CliRunner
+from pytest import mark
+
+from hacenada import loadtest, main, storage
+
+
+def test_run_worker(my_project, tmp_path):
+    """
+    Does a worker run and time its sessions, and clean up after them?
+    """
+    job = loadtest.WorkerJob(
+        worker=3, home=tmp_path, backend="compact", sessions=2, steps=5, answer_size=40
+    )
+    result = loadtest.run_worker(job)
+    assert result.sessions == 2
+    assert len(result.latencies) == 10
+    assert result.errors == {} and result.corrupted == 0
+    assert list(tmp_path.glob("*.hcnb")) == []
+
+
+def test_run_worker_problems(my_project, tmp_path):
+    """
+    Do I count errors, and answers that don't read back as they were given?
+    """
+    job = loadtest.WorkerJob(
+        worker=0, home=tmp_path, backend="json", sessions=3, steps=2, answer_size=4
+    )
+    with patch.object(
+        storage.HomeDirectoryStorage, "get_answer", return_value={"value": "garbled"}
+    ):
+        assert loadtest.run_worker(job).corrupted == 3
+
+    with patch.dict(loadtest.BACKENDS, json=lambda path: 1 / 0):
+        assert loadtest.run_worker(job).errors == {"ZeroDivisionError": 3}
+
+
+@mark.parametrize(
+    "values,pct,expected",
+    [[[], 50, 0.0], [[1, 2, 3, 4], 50, 2], [[1, 2, 3, 4], 99, 4], [[5], 1, 5]],
+)
+def test_percentile(values, pct, expected):
+    """
+    Do I pick the nearest-rank percentile?
+    """
+    assert loadtest.percentile(values, pct) == expected
+
+
+def test_run(my_project, tmp_path):
+    """
+    Do worker processes share a home, and their results add up?
+    """
+    stats = loadtest.run(tmp_path, workers=2, sessions=2, steps=3)
+    assert (stats.sessions, stats.steps, stats.errors, stats.corrupted) == (
+        4,
+        12,
+        {},
+        0,
+    )
+    assert stats.latencies == sorted(stats.latencies)
+    assert stats.throughput > 0
+    assert "json: 4 sessions in 2 workers, 12 steps in" in stats.report()
+
+
+def test_run_errors(my_project, tmp_path):
+    """
+    Are errors from every worker added up?
+    """
+
+    class _InProcess:
+        def __init__(self, _):
+            self.map = lambda fn, jobs: [fn(job) for job in jobs]
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *_):
+            pass
+
+    with patch.object(loadtest.multiprocessing, "Pool", _InProcess), patch.dict(
+        loadtest.BACKENDS, json=lambda path: 1 / 0
+    ):
+        stats = loadtest.run(tmp_path, workers=2, sessions=2, steps=1)
+    assert stats.errors == {"ZeroDivisionError": 4}
+    assert "errors: ZeroDivisionError: 4" in stats.report()
+
+
+def test_load_test_command(my_project):
+    """
+    Do I print the report, and fail when anything went wrong?
+    """
+    runner = CliRunner()
+    stats = loadtest.LoadStats(backend="json", workers=1, sessions=1, steps=1)
+    with patch.object(loadtest, "run", return_value=stats) as m_run:
+        invoked = runner.invoke(
+            main.load_test, ["--workers=1", "--sessions=1", "--steps=1"]
+        )
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "throughput: 0.0 steps/s" in invoked.stdout
+    assert "errors: 0\n" in invoked.stdout
+    assert m_run.call_args[1]["workers"] == 1
+
+    stats.errors = {"OSError": 2}
+    with patch.object(loadtest, "run", return_value=stats):
+        invoked = runner.invoke(main.load_test, ["--home", "elsewhere"])
+    assert invoked.exit_code == 1
+    assert "errors: OSError: 2" in invoked.stdout
@@ -0,0 +1,58 @@
+"""
+Test reading and writing the machine-readable session logs
+"""
+from pathlib import Path
+
+from hacenada import codec, logfile, main, storage
+
+
+def test_is_log():
+    """
+    Do I tell logs from scripts?
+    """
+    assert logfile.is_log(Path("x.log.d/2022-06-07-1--hi.hcnb"))
+    assert logfile.is_log(Path("anywhere/run.hcnb"))
+    assert logfile.is_log(Path("x.log.d/2022-06-07-1--hi.json"))
+    assert not logfile.is_log(Path("project/script.json"))
+    assert not logfile.is_log(Path("project/script.toml"))
+
+
+def test_round_trip(tmp_path, scriptie, storagie):
+    """
+    Do both log encodings load back to the same script and answers?
+    """
+    storagie.save_answer({"q1": "hello\nmultiline"})
+    storagie.description = "a description"
+    logd = tmp_path / "project.log.d"
+    logd.mkdir()
+
+    json_path = logd / "run.json"
+    json_path.write_text(main.format_json(scriptie, storagie))
+    compact_path = logfile.write_compact(logd / "run.hcnb", scriptie, storagie)
+    assert codec.is_compact(compact_path.read_bytes())
+
+    from_json = logfile.read_log(json_path)
+    from_compact = logfile.read_log(compact_path)
+    assert from_json == from_compact
+    assert from_compact["answer"] == storagie.answer.all()
+    assert from_compact["meta"]["description"] == "a description"
+
+    script, store = logfile.load_log(compact_path)
+    assert script.overlay == scriptie.overlay
+    assert store.get_answer("q1") == storagie.get_answer("q1")
+    assert store.description == "a description"
+    assert isinstance(store, storage.HomeDirectoryStorage)
+
+
+def test_script_only(tmp_path, scriptie):
+    """
+    Can I read a log written without any answers?
+    """
+    path = logfile.write_compact(tmp_path / "bare.hcnb", scriptie, None)
+    data = logfile.read_log(path)
+    assert data["answer"] == []
+    assert data["meta"] == {}
+
+    json_path = tmp_path / "bare.json"
+    json_path.write_text(main.format_json(scriptie, None))
+    assert logfile.read_log(json_path)["answer"] == []
@@ -1,20 +1,31 @@
 """
 Test the command-line for regressions
 """
+import datetime
+import io
+import json
+import os
 import pathlib
 import re
-from unittest.mock import Mock, patch
+import typing
+from unittest.mock import ANY, Mock, patch
+import zipfile
 
 import click
 from click.testing import CliRunner
 from pytest import fixture, mark, raises
+import toml
 
-from hacenada import error, main
+from hacenada import error, main, printcache, script, storage
 
 
 @fixture
-def runner() -> CliRunner:
-    return CliRunner()
+def runner() -> typing.Iterator[CliRunner]:
+    """
+    A CliRunner, which (for the renderer) passes for a full terminal
+    """
+    with patch("hacenada.render.is_full_terminal", return_value=True):
+        yield CliRunner()
 
 
 def test_handle_filename(my_project):
@@ -65,6 +76,14 @@ INVOCATION_MATCHERS = {
         r"^# hola.*oh noo\n\n.*\*\*>> hello description <<\*\* \(.*\)\n\n---",
         re.M | re.DOTALL,
     ),
+    "print-ipynb": re.compile(
+        r'^{\s+"nbformat": 4,.*"source": "\[message-1\]  shame.*to it"}\s*\]\s*}\s*$',
+        re.M | re.DOTALL,
+    ),
+    "print-ipynb-answers": re.compile(
+        r'^{\s+"nbformat": 4,.*"source": "\*\*>> hello description <<\*\* \(.*\)"}',
+        re.M | re.DOTALL,
+    ),
 }
 
 
@@ -77,6 +96,8 @@ INVOCATION_MATCHERS = {
         [["--format=toml", "project.toml", "--answers"], "print-toml-answers"],
         [["--format=json", "project.toml", "--answers"], "print-json-answers"],
         [["--format=markdown", "project.toml", "--answers"], "print-markdown-answers"],
+        [["--format=ipynb", "project.toml", "--no-answers"], "print-ipynb"],
+        [["--format=ipynb", "project.toml", "--answers"], "print-ipynb-answers"],
     ],
     ids=[
         "print-toml",
@@ -85,6 +106,8 @@ INVOCATION_MATCHERS = {
         "print-toml-answers",
         "print-json-answers",
         "print-markdown-answers",
+        "print-ipynb",
+        "print-ipynb-answers",
     ],
 )
 def test_print(
@@ -116,13 +139,76 @@ def test_print_filename_antics(runner: CliRunner, my_project: pathlib.Path, stor
     storagie.db.close()
 
     # this invocation fails, storage file has disappeared
-    for found in my_project.parent.parent.glob("*.json"):
+    for found in my_project.parent.parent.glob("sessions/*/*.json"):
         found.unlink()
     invoked = runner.invoke(main.print_script, cli_args)
     assert invoked.exit_code > 0
     assert re.search(r"No possible storage found", invoked.stdout)
 
 
+def test_print_cached(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Is printing an unchanged session served from the cache, and redone when it changes?
+    """
+    storagie.save_answer({"q1": "hello description"})
+    cli_args = ["--format=json", "project.toml"]
+    first = runner.invoke(main.print_script, cli_args)
+    assert first.exit_code == 0, f"{first.exit_code} {first.exception}"
+
+    # just written, so the stat can't be trusted yet and the storage is read
+    with patch.object(main, "_load_script", autospec=True) as m_load:
+        again = runner.invoke(main.print_script, cli_args)
+    assert again.stdout == first.stdout
+    m_load.assert_not_called()
+
+    # written long enough ago for their stat to be trusted
+    for path in my_project, storagie.path:
+        os.utime(path, ns=(10**9, 10**9))
+    runner.invoke(main.print_script, cli_args)
+
+    with patch.object(main, "_load_script", autospec=True) as m_load, patch.object(
+        storage.HomeDirectoryStorage, "from_path", autospec=True
+    ) as m_from_path:
+        again = runner.invoke(main.print_script, cli_args)
+    assert again.stdout == first.stdout
+    m_load.assert_not_called()
+    m_from_path.assert_not_called()
+
+    # touched but unchanged: the storage is opened, but nothing is printed anew
+    os.utime(my_project, ns=(0, 0))
+    with patch.object(main, "_load_script", autospec=True) as m_load:
+        again = runner.invoke(main.print_script, cli_args)
+    assert again.stdout == first.stdout
+    m_load.assert_not_called()
+
+    storagie.save_answer({"message-1": True})
+    changed = runner.invoke(main.print_script, cli_args)
+    assert '"label": "message-1"' in changed.stdout
+
+    # without a filename, the storage is found first
+    assert runner.invoke(main.print_script, ["--format=json"]).stdout == changed.stdout
+    assert (
+        runner.invoke(
+            main.print_script, ["--format=json", "--no-answers", "project.toml"]
+        ).exit_code
+        == 0
+    )
+
+    # a notebook is written as it's made, never held in memory to be cached
+    with patch.object(printcache.PrintCache, "put", autospec=True) as m_put:
+        notebook = runner.invoke(main.print_script, ["--format=ipynb", "project.toml"])
+    assert json.loads(notebook.stdout)["cells"]
+    m_put.assert_not_called()
+
+    my_project.write_text("[[step\n")
+    invoked = runner.invoke(main.print_script, cli_args)
+    assert invoked.exit_code > 0
+    assert "** project.toml:" in invoked.stdout
+
+    my_project.unlink()
+    assert ", 2 printed outputs pruned" in runner.invoke(main.gc).stdout
+
+
 def test_start(runner: CliRunner, my_project: pathlib.Path):
     """
     Do we handle all the states of starting and starting over?
@@ -175,10 +261,682 @@ def test_next(runner: CliRunner, my_project: pathlib.Path, storagie):
     assert storagie.get_answer("message-1")["value"] == "yes"
     assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
     assert "project.toml: Cleaning up.  Log: " in invoked.stdout
+    logd = my_project.with_suffix(".log.d")
+    assert len(list(logd.glob("*.ipynb"))) == 1
 
-    # this invocation fails, storage file has disappeared
-    for found in my_project.parent.parent.glob("*.json"):
-        found.unlink()
+    # this invocation fails, the finished session's storage was dropped
     invoked = runner.invoke(main.next)
     assert "No possible storage" in invoked.stdout
     assert invoked.exit_code > 0
+
+
+def test_plain_renderer(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Can I run a session with plain prompts, from a pipe?
+    """
+    invoked = runner.invoke(
+        main.start, ["--renderer=plain", "project.toml"], input="piped\n"
+    )
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "hola : q1\noh noo\n>> " in invoked.stdout
+
+    invoked = runner.invoke(main.next, ["--renderer=plain"], input="")
+    assert invoked.exit_code == 1
+    assert "** no answer given (end of input)" in invoked.output
+
+
+def test_audit(runner: CliRunner, my_project: pathlib.Path, tmp_path: pathlib.Path):
+    """
+    Can I send audit events for a session to a sink?
+    """
+    audit_path = tmp_path / "audit.jsonl"
+    invoked = runner.invoke(
+        main.start,
+        ["--renderer=plain", f"--audit=file:{audit_path}", "project.toml"],
+        input="piped\n",
+    )
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    events = [json.loads(line) for line in audit_path.read_text().splitlines()]
+    assert [e["event"] for e in events] == ["shown", "answered"]
+    assert events[1]["value"] == "piped"
+    assert {"user", "host", "when", "script"} <= set(events[1])
+
+    for name in "bogus:", "memory:":
+        invoked = runner.invoke(main.next, [f"--audit={name}"])
+        assert invoked.exit_code == 2
+        assert f"unknown audit sink '{name}'" in invoked.output
+
+    invoked = runner.invoke(
+        main.next,
+        ["--renderer=plain"],
+        input="y\n",
+        env={"HACENADA_AUDIT": f"unix:{tmp_path}/none.sock"},
+    )
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "** audit: 0 events dropped, 3 could not be delivered" in invoked.stdout
+
+
+def test_undo(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Does undo go back a run of next at a time, so a mistyped answer can be given again?
+    """
+    runner.invoke(main.start, ["--renderer=plain", "project.toml"], input="typo\n")
+    invoked = runner.invoke(main.undo, [])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert invoked.stdout == "project.toml: undid the answers to [q1]\n"
+
+    invoked = runner.invoke(main.next, ["--renderer=plain"], input="fixed\n")
+    assert "hola : q1\noh noo\n>> " in invoked.stdout
+    assert storage.HomeDirectoryStorage.from_path(my_project).description == "fixed"
+
+    assert runner.invoke(main.undo, ["project.toml"]).exit_code == 0
+    invoked = runner.invoke(main.undo, ["project.toml"])
+    assert invoked.exit_code == 1
+    assert "** project.toml: nothing to undo" in invoked.output
+
+
+def test_status(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Does status list sessions in progress, as a table or json?
+    """
+    runner.invoke(
+        main.start, ["--renderer=plain", "project.toml"], input="in progress\n"
+    )
+    (storage.HACENADA_HOME / "broken.json").write_text("{not json")
+    invoked = runner.invoke(main.session_status, [])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert re.search(r"^SCRIPT +DESCRIPTION +STEP +LAST ANSWER\n", invoked.stdout, re.M)
+    assert re.search(
+        rf"^{my_project} +in progress +1/2 \[message-1\] +\d+s$", invoked.stdout, re.M
+    )
+    assert "** " + str(storage.HACENADA_HOME / "broken.json") in invoked.output
+
+    (storage.HACENADA_HOME / "broken.json").unlink()
+    invoked = runner.invoke(main.session_status, ["--format=json"])
+    (row,) = json.loads(invoked.stdout)
+    assert row == dict(
+        script=str(my_project),
+        description="in progress",
+        done=1,
+        total=2,
+        current="message-1",
+        last_answer=ANY,
+    )
+
+    # a finished session is gone: not listed, and its script can be started again
+    runner.invoke(main.next, ["--renderer=plain"], input="y\n")
+    invoked = runner.invoke(main.session_status, ["--format=json"])
+    assert json.loads(invoked.stdout) == []
+    assert not list(storage.HACENADA_HOME.glob("sessions/*/*"))
+    invoked = runner.invoke(
+        main.start, ["--renderer=plain", "project.toml"], input="again\n"
+    )
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+
+
+def test_diff(runner: CliRunner, my_project: pathlib.Path, scriptie, storagie):
+    """
+    Does diff compare a log with a session in progress, or with itself?
+    """
+    logd = my_project.with_suffix(".log.d")
+    logd.mkdir()
+    logged = storage.HomeDirectoryStorage.from_structured({})
+    logged.save_answer({"q1": "last week"})
+    logged.save_answer({"message-1": True})
+    log = logd / "2026-01-01-1--last-week.json"
+    log.write_text(main.format_json(scriptie, logged))
+    storagie.save_answer({"q1": "this week"})
+
+    invoked = runner.invoke(main.diff_runs, [str(log), "project.toml"])
+    assert invoked.exit_code == 1, f"{invoked.exit_code} {invoked.exception}"
+    assert invoked.stdout == (
+        "[q1] answer changed\n  - last week\n  + this week\n"
+        "[message-1] answer changed\n  - true\n  + (not answered)\n"
+        "2 steps differ, 0 the same\n"
+    )
+    invoked = runner.invoke(main.diff_runs, [str(log), str(log)])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert invoked.stdout == "0 steps differ, 2 the same\n"
+
+    (logd / "broken.json").write_text("{not json")
+    invoked = runner.invoke(main.diff_runs, [str(logd / "broken.json"), str(log)])
+    assert invoked.exit_code == 2
+    assert "broken.json: could not be read" in invoked.output
+    other = my_project.with_name("other.toml")
+    other.write_text(my_project.read_text())
+    invoked = runner.invoke(main.diff_runs, [str(log), str(other)])
+    assert (
+        "other.toml is neither a log nor a script with a session in progress"
+        in invoked.output
+    )
+
+
+def test_next_edited_script(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Does next pick up where it left off when a step was inserted mid-session?
+    """
+    p_render = patch(
+        "hacenada.render.InquirerRender.render",
+        autospec=True,
+        side_effect=[{"q1": "edited"}, {"new": True}],
+    )
+    with p_render as m_render:
+        runner.invoke(main.start, ["project.toml"])
+        inserted = (
+            '[[step]]\nmessage = "new"\nlabel = "new"\n\n[[step]]\nmessage = "shame'
+        )
+        my_project.write_text(
+            my_project.read_text().replace('[[step]]\nmessage = "shame', inserted)
+        )
+        invoked = runner.invoke(main.next, [])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    # the inserted step is asked next
+    assert m_render.call_args_list[1][0][1]["label"] == "new"
+
+
+def test_watch(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Do I reload the script and reconcile answers each time it changes?
+    """
+    storagie.save_answer({"q1": "watched"})
+    storagie.save_answer({"message-1": True})
+    original = my_project.read_text()
+
+    fragment = my_project.with_name("extra.toml")
+    fragment.write_text('[[step]]\nmessage = "extra"\nlabel = "extra"\n')
+
+    def _changes(sources):
+        assert sources == [my_project]
+        my_project.write_text(original.replace('label = "q1"', 'label = "renamed"'))
+        yield
+        my_project.write_text(original.replace('label = "q1"', "oops"))
+        yield
+        my_project.write_text(original.replace("shame", "blame"))
+        yield
+        yield
+        # the script is being stepped meanwhile
+        with storage.locked(storagie.path), patch.object(storage, "LOCK_TIMEOUT", 0):
+            yield
+        # a fragment included from now on is watched too
+        my_project.write_text(
+            original.replace("[[step]]", 'include = ["extra.toml"]\n\n[[step]]', 1)
+        )
+        yield
+        assert sources == [my_project, fragment]
+        raise KeyboardInterrupt
+
+    with patch("hacenada.watch.changes", side_effect=_changes):
+        invoked = runner.invoke(main.watch_script, ["project.toml"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "Key name found without value" in invoked.stdout
+    assert "(keeping the previous version)" in invoked.stdout
+    assert invoked.stdout.splitlines() == [
+        "project.toml: watching for changes, Ctrl-C to stop",
+        "project.toml: the answer to [q1] now belongs to [renamed]",
+        ANY,
+        "project.toml: the answer to [renamed] now belongs to [q1]",
+        "** project.toml: [message-1] was changed or removed, its answer was discarded",
+        "project.toml: reloaded, all answers still apply",
+        f"** {storagie.path} is in use by another hacenada "
+        "(trying again at the next change)",
+        "project.toml: reloaded, all answers still apply",
+    ]
+
+
+def test_compact_session(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Does a compact session write a compact log that print can read back?
+    """
+    p_render = patch(
+        "hacenada.render.InquirerRender.render",
+        autospec=True,
+        side_effect=[{"q1": "compact run"}, {"message-1": True}],
+    )
+    with p_render:
+        invoked = runner.invoke(main.start, ["--encoding=compact", "project.toml"])
+        assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+        invoked = runner.invoke(main.next, [])
+        assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+
+    logs = list(my_project.with_suffix(".log.d").glob("*.hcnb"))
+    assert len(logs) == 1
+    assert not list(my_project.with_suffix(".log.d").glob("*.json"))
+
+    invoked = runner.invoke(main.print_script, ["--format=markdown", str(logs[0])])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "**>> compact run <<**" in invoked.stdout
+
+    invoked = runner.invoke(
+        main.print_script, ["--format=json", "--no-answers", str(logs[0])]
+    )
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert '"answer"' not in invoked.stdout
+
+
+def test_replay(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Can I replay a directory of logs, against their own script or a changed one?
+    """
+    storagie.save_answer({"q1": "first run"})
+    storagie.save_answer({"message-1": True})
+    with patch("hacenada.render.InquirerRender.render", autospec=True):
+        runner.invoke(main.next)
+    logd = my_project.with_suffix(".log.d")
+
+    invoked = runner.invoke(main.replay_logs, [str(logd)])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert ": 2 steps replayed" in invoked.stdout
+    assert "1 of 1 logs replayed cleanly" in invoked.stdout
+
+    (logd / "garbage.json").write_text("{")
+    my_project.write_text(
+        my_project.read_text() + '[[step]]\nmessage = "new"\nlabel = "new"\n'
+    )
+    invoked = runner.invoke(main.replay_logs, ["--script", "project.toml", str(logd)])
+    assert invoked.exit_code == 1
+    assert "garbage.json: could not be read" in invoked.stdout
+    assert "no answer was recorded for [new], after 2 steps" in invoked.stdout
+    assert "0 of 2 logs replayed cleanly" in invoked.stdout
+
+    my_project.write_text(
+        my_project.read_text().split("[[step]]")[0]
+        + '[[step]]\nmessage = "x"\nlabel = "q1"\n'
+    )
+    invoked = runner.invoke(main.replay_logs, ["--script", "project.toml", str(logd)])
+    assert (
+        "answers were recorded for steps never reached: [message-1]" in invoked.stdout
+    )
+
+
+def test_replay_until(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Can I replay part of a log into a session, and take over from there?
+    """
+    storagie.save_answer({"q1": "first run"})
+    storagie.save_answer({"message-1": True})
+    with patch("hacenada.render.InquirerRender.render", autospec=True):
+        runner.invoke(main.next)
+    log = str(next(my_project.with_suffix(".log.d").glob("*.json")))
+
+    invoked = runner.invoke(main.replay_logs, ["--until", "message-1", log])
+    assert "--until needs --script and a single log" in invoked.stdout
+    invoked = runner.invoke(
+        main.replay_logs, ["--script", "project.toml", "--until", "nope", log]
+    )
+    assert "project.toml has no step [nope]" in invoked.stdout
+
+    args = ["--script", "project.toml", "--until", "message-1", log]
+    invoked = runner.invoke(main.replay_logs, ["--start-over"] + args)
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert (
+        "1 steps replayed; run `hacenada next project.toml` to continue"
+        in invoked.stdout
+    )
+    replayed = storage.HomeDirectoryStorage.from_path(my_project).to_structured()
+    assert [(a["label"], a["value"]) for a in replayed["answer"]] == [
+        ("q1", "first run")
+    ]
+
+    invoked = runner.invoke(main.replay_logs, args)
+    assert "will not overwrite an ongoing session" in invoked.stdout
+
+    # a step with no recorded answer leaves the session at that step
+    my_project.write_text(
+        my_project.read_text().replace('label = "q1"', 'label = "q2"')
+    )
+    invoked = runner.invoke(main.replay_logs, ["--start-over"] + args)
+    assert "no answer was recorded for [q2]" in invoked.stdout
+    assert "0 steps replayed" in invoked.stdout
+
+    my_project.write_text(
+        my_project.read_text().replace('"q2"', '"q1"') + 'when = "q1 == 1"\n'
+    )
+    invoked = runner.invoke(main.replay_logs, ["--start-over"] + args)
+    assert invoked.exit_code == 1
+    assert "[message-1] was skipped in this replay" in invoked.stdout
+
+
+def test_start_encoding_mismatch(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Do we refuse to switch the encoding of an ongoing session?
+    """
+    invoked = runner.invoke(main.start, ["--encoding=compact", "project.toml"])
+    assert invoked.exit_code > 0
+    assert "already json-encoded" in invoked.stdout
+
+
+def test_compile(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Can I compile a script and run the compiled copy in its place?
+    """
+    invoked = runner.invoke(main.compile_script, ["project.toml"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "2 steps compiled to project.hcnc" in invoked.stdout
+
+    with patch(
+        "hacenada.render.InquirerRender.render",
+        autospec=True,
+        return_value={"q1": "compiled"},
+    ):
+        invoked = runner.invoke(main.start, ["project.hcnc"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+
+    invoked = runner.invoke(main.print_script, ["--format=markdown", "project.hcnc"])
+    assert "**>> compiled <<**" in invoked.stdout
+
+    invoked = runner.invoke(main.compile_script, ["project.toml", "-o", "other.hcnc"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert pathlib.Path("other.hcnc").exists()
+
+
+def test_invalid_script(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Are script problems reported before any step is shown?
+    """
+    my_project.write_text('[hacenada]\nname = "x"\n[[step]]\ntype = "input"\n')
+    invoked = runner.invoke(main.compile_script, ["project.toml"])
+    assert invoked.exit_code > 0
+    assert "project.toml: step 0: missing message" in invoked.stdout
+
+
+def test_write_ipynb(scriptie, storagie):
+    """
+    Do I stream a valid notebook, with captured output as a code cell?
+    """
+    storagie.save_answer({"q1": "one line"})
+    storagie.save_answer({"message-1": "captured\noutput\n"})
+    storagie.description = "nb"
+
+    out = io.StringIO()
+    with patch.object(out, "write", wraps=out.write) as m_write:
+        main.write_ipynb(scriptie, storagie, out)
+    # written piecewise, not as one document
+    assert m_write.call_count > 5
+
+    notebook = json.loads(out.getvalue())
+    assert notebook["nbformat"] == 4
+    cells = notebook["cells"]
+    assert [c["cell_type"] for c in cells] == [
+        "markdown",
+        "markdown",
+        "markdown",
+        "markdown",
+        "code",
+    ]
+    assert "### Current: **nb**" in cells[0]["source"]
+    assert cells[2]["source"].startswith("**>> one line <<**")
+    assert cells[4]["outputs"][0]["text"] == "captured\noutput\n"
+    assert cells[4]["metadata"]["hacenada"]["label"] == "message-1"
+
+
+def test_skipped_output(scriptie, storagie):
+    """
+    Do skipped steps show as skipped, rather than as an empty answer?
+    """
+    storagie.skip_step("q1")
+    assert "**(skipped)** (" in main.format_markdown(scriptie, storagie)
+
+    out = io.StringIO()
+    main.write_ipynb(scriptie, storagie, out)
+    cells = json.loads(out.getvalue())["cells"]
+    assert cells[2]["source"].startswith("**(skipped)** (")
+
+
+FOREACH_TOML = """
+[hacenada]
+name = "fan-out"
+description = ""
+
+[[step]]
+type = "input"
+message = "which regions?"
+label = "regions"
+
+[[step]]
+message = "deploy to {item}"
+label = "deploy"
+foreach = "regions"
+"""
+
+
+def test_print_foreach(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Do I print the steps of a foreach, or the foreach step itself when it has none yet?
+    """
+    my_project.write_text(FOREACH_TOML)
+    invoked = runner.invoke(
+        main.print_script, ["--format=markdown", "--no-answers", "project.toml"]
+    )
+    assert "[deploy]  deploy to {item}" in invoked.stdout
+
+    _script = script.Script.from_scriptfile(my_project)
+    _store = storage.HomeDirectoryStorage.from_structured({})
+    _store.save_answer({"regions": "east west"})
+    _store.save_answer({"deploy[east]": True})
+    printed = main.format_markdown(_script, _store)
+    assert "[deploy[east]]  deploy to east\n\n**>> True <<**" in printed
+    assert "[deploy[west]]  deploy to west\n\n------" in printed
+
+    logd = my_project.with_suffix(".log.d")
+    logd.mkdir()
+    (logd / "2022-06-01-1--fan.json").write_text(main.format_json(_script, _store))
+    invoked = runner.invoke(main.report_site, ["project.toml"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    run = (
+        my_project.with_suffix(".report.d") / "runs/2022-06-01-1--fan.html"
+    ).read_text()
+    assert "deploy to west" in run
+
+
+def test_report(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Can I build the report site of a script's runs?
+    """
+    storagie.description = "reported"
+    logd = my_project.with_suffix(".log.d")
+    logd.mkdir()
+    (logd / "2022-06-07-1--reported.json").write_text(
+        main.format_json(script.Script.from_scriptfile(my_project), storagie)
+    )
+    (logd / "2022-06-07-2--broken.json").write_text("{")
+
+    invoked = runner.invoke(main.report_site, ["project.toml"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "2022-06-07-2--broken.json: could not be read" in invoked.stdout
+    assert "project.report.d: 1 runs (1 built, 0 removed)" in invoked.stdout
+    assert (my_project.parent / "project.report.d/index.html").exists()
+
+
+def test_large_answer_logs(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Do logs reference large answers, and does gc keep them while referenced?
+    """
+    big = "captured output\n" * 1000
+    storagie.save_answer({"q1": big})
+    with patch(
+        "hacenada.render.InquirerRender.render",
+        autospec=True,
+        return_value={"message-1": True},
+    ):
+        invoked = runner.invoke(main.next)
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+
+    logd = my_project.with_suffix(".log.d")
+    (log_json,) = logd.glob("*.json")
+    assert big not in log_json.read_text()
+    assert big in next(logd.glob("*.log")).read_text()
+    notebook = json.loads(next(logd.glob("*.ipynb")).read_text())
+    assert notebook["cells"][2]["outputs"][0]["text"] == big
+
+    invoked = runner.invoke(main.print_script, ["--format=markdown", str(log_json)])
+    assert big.strip() in invoked.stdout
+    invoked = runner.invoke(main.print_script, ["--format=json", str(log_json)])
+    assert json.loads(invoked.stdout)["answer"][0]["value"] == big
+    invoked = runner.invoke(main.print_script, ["--format=toml", str(log_json)])
+    assert toml.loads(invoked.stdout)["answer"][0]["value"] == big
+
+    invoked = runner.invoke(main.gc)
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "blobs: 0 deleted (0 bytes freed), 1 kept" in invoked.stdout
+
+
+def test_retention(runner: CliRunner, my_project: pathlib.Path, storagie):
+    """
+    Is a script's retention policy enforced after each run, and by gc?
+    """
+    my_project.write_text(
+        my_project.read_text().replace("[[step]]", "retain = {runs = 1}\n\n[[step]]", 1)
+    )
+    logd = my_project.with_suffix(".log.d")
+    for n in range(3):
+        with patch(
+            "hacenada.render.InquirerRender.render",
+            autospec=True,
+            side_effect=[{"q1": f"run {n}"}, {"message-1": True}],
+        ):
+            runner.invoke(main.start, ["--start-over", "project.toml"])
+            invoked = runner.invoke(main.next)
+        assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+
+    dt = datetime.date.today().isoformat()
+    assert sorted(p.name for p in logd.glob("*.log")) == [f"{dt}-3--run+2.log"]
+    (bundle,) = logd.glob("bundle-*.zip")
+    with zipfile.ZipFile(bundle) as zf:
+        assert f"{dt}-2--run+1.json" in zf.namelist()
+
+    # a session kept as older versions did is moved first, then dropped
+    with patch(
+        "hacenada.render.InquirerRender.render",
+        autospec=True,
+        return_value={"q1": "abandoned"},
+    ):
+        runner.invoke(main.start, ["project.toml"])
+    (stored,) = my_project.parent.parent.glob("sessions/*/*.json")
+    stored.rename(my_project.parent.parent / stored.name)
+    invoked = runner.invoke(main.gc, ["--days=0", "--session-days=0"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "sessions: 1 moved into buckets" in invoked.stdout
+    assert (
+        "logs: 1 runs compacted, 0 files deleted (0 bytes freed), "
+        "0 directories unchanged" in invoked.stdout
+    )
+    assert "sessions: 1 dropped" in invoked.stdout
+    assert not list(logd.glob("*.log"))
+
+
+def test_gc_finished(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Does gc find the logs of a finished run, with no session or directory given?
+    """
+    with patch(
+        "hacenada.render.InquirerRender.render",
+        autospec=True,
+        side_effect=[{"q1": "done"}, {"message-1": True}],
+    ):
+        runner.invoke(main.start, ["project.toml"])
+        runner.invoke(main.next)
+    assert storage.stored_path(my_project) is None
+    invoked = runner.invoke(main.gc, ["--runs=0"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert "logs: 1 runs compacted" in invoked.stdout
+    assert list(my_project.with_suffix(".log.d").glob("bundle-*.zip"))
+
+
+WAIT_STEP = """\
+[[step]]
+type = "wait"
+message = "cert issued"
+label = "cert"
+check = "echo issued"
+"""
+
+
+def test_wait_step(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Does next wait for a wait step's check, and log how the wait went?
+    """
+    waiting = WAIT_STEP + "\n"
+    shame = '[[step]]\nmessage = "shame'
+    my_project.write_text(my_project.read_text().replace(shame, waiting + shame))
+    runner.invoke(
+        main.start, ["--renderer=plain", "project.toml"], input="waiting run\n"
+    )
+    invoked = runner.invoke(main.next, ["--renderer=plain"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert (
+        "cert: cert issued\n>> waiting for: echo issued\n[cert] succeeded after 1 check"
+        in invoked.stdout
+    )
+
+    invoked = runner.invoke(main.next, ["--renderer=plain"], input="y\n")
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    (log,) = my_project.with_suffix(".log.d").glob("*.log")
+    assert re.search(
+        r"\[cert\]  cert issued\n\n\*\*>> succeeded after 1 check, [\d.]+s <<\*\*",
+        log.read_text(),
+    )
+
+
+def test_cached_wait_step(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Is a cached wait step satisfied at once after --start-over, and logged as cached?
+    """
+    waiting = WAIT_STEP + "cache = true\n\n"
+    shame = '[[step]]\nmessage = "shame'
+    my_project.write_text(my_project.read_text().replace(shame, waiting + shame))
+    runner.invoke(main.start, ["--renderer=plain", "project.toml"], input="first run\n")
+    invoked = runner.invoke(main.next, ["--renderer=plain"])
+    assert ">> waiting for: echo issued" in invoked.stdout
+
+    runner.invoke(
+        main.start,
+        ["--renderer=plain", "--start-over", "project.toml"],
+        input="second run\n",
+    )
+    with patch("hacenada.wait.wait_for", autospec=True) as m_wait_for:
+        invoked = runner.invoke(main.next, ["--renderer=plain"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    m_wait_for.assert_not_called()
+    assert "cert: cert issued\n>> cached: succeeded after 1 check" in invoked.stdout
+
+    runner.invoke(main.next, ["--renderer=plain"], input="y\n")
+    (log,) = my_project.with_suffix(".log.d").glob("*.log")
+    assert re.search(
+        r"\*\*>> succeeded after 1 check, [\d.]+s <<\*\* \(cached, ", log.read_text()
+    )
+    (notebook,) = my_project.with_suffix(".log.d").glob("*.ipynb")
+    cells = json.loads(notebook.read_text())["cells"]
+    assert [c["source"][:3] for c in cells if "(cached, " in c["source"]] == ["**>"]
+
+    invoked = runner.invoke(main.gc)
+    assert "cache: 0 entries evicted" in invoked.stdout
+
+
+def test_storage_migrate(runner: CliRunner, my_project: pathlib.Path):
+    """
+    Does storage migrate move sessions, leave busy ones alone, and keep next from
+    running meanwhile?
+    """
+    runner.invoke(main.start, ["--renderer=plain", "project.toml"], input="migrating\n")
+    invoked = runner.invoke(main.migrate_sessions, ["--to=compact", "--jobs=1"])
+    assert invoked.exit_code == 0, f"{invoked.exit_code} {invoked.exception}"
+    assert invoked.stdout == "1 sessions migrated to compact, 0 already compact\n"
+
+    _store = storage.HomeDirectoryStorage.from_path(my_project)
+    assert _store.encoding == "compact"
+    assert _store.description == "migrating"
+
+    with _store.lock(), patch.object(storage, "LOCK_TIMEOUT", 0):
+        invoked = runner.invoke(main.migrate_sessions, ["--to=json", "--jobs=1"])
+        assert (
+            "1 sessions in use were left alone; run again to migrate them"
+            in invoked.stdout
+        )
+        invoked = runner.invoke(main.next, ["--renderer=plain"])
+        assert invoked.exit_code == 1
+        assert "is in use by another hacenada" in invoked.output
+
+    (storage.HACENADA_HOME / "broken.json").write_text("{not json")
+    invoked = runner.invoke(main.migrate_sessions, ["--to=compact", "--jobs=1"])
+    assert invoked.exit_code == 1
+    assert "** failed " in invoked.output
@@ -0,0 +1,79 @@
+"""
+Test the cache of automated steps' answers
+"""
+import os
+import time
+
+from hacenada import memo
+
+
+NOW = time.time()
+
+
+def step(**kw):
+    """
+    A wait step
+    """
+    return dict(
+        dict(type="wait", message="m", label="w", stop=True, check="true"), **kw
+    )
+
+
+def test_cache_key():
+    """
+    Does the key change with the step's content and the answers it refers to, but not
+    its label?
+    """
+    key = memo.cache_key(step(), {"env": "prod"})
+    assert key == memo.cache_key(
+        dict(step(), label="other", interval=3), {"env": "prod"}
+    )
+    assert key != memo.cache_key(step(), {"env": "dev"})
+    assert key != memo.cache_key(step(check="false"), {"env": "prod"})
+    assert key != memo.cache_key(step(when="env"), {"env": "prod"})
+
+
+def test_ttl_of():
+    assert memo.ttl_of(step()) is None
+    assert memo.ttl_of(step(cache=False)) is None
+    assert memo.ttl_of(step(cache=True)) == memo.DEFAULT_TTL
+    assert memo.ttl_of(step(cache=90)) == 90.0
+
+
+def test_get_put(tmp_path):
+    """
+    Is an answer remembered until its time to live passes?
+    """
+    cache = memo.StepCache(tmp_path / "cache")
+    assert cache.get("k") is None
+    cache.put("k", {"ok": True}, 60, now=NOW)
+    assert cache.get("k", now=NOW + 59) == {"ok": True}
+    assert os.path.getmtime(cache._path("k")) == NOW + 59
+    assert cache.get("k", now=NOW + 60) is None
+    assert not cache._path("k").exists()
+
+    cache._path("bad").write_text("{not json")
+    assert cache.get("bad") is None
+    # valid json, but not an entry
+    for malformed in "{}", '{"expires": null, "value": 1}', "[]":
+        cache._path("bad").write_text(malformed)
+        assert cache.get("bad") is None
+
+
+def test_evict(tmp_path):
+    """
+    Are expired entries, then the least recently used beyond the limit, evicted?
+    """
+    cache = memo.StepCache(tmp_path / "cache", max_entries=2)
+    assert cache.evict() == 0
+    cache.put("old", 1, 10, now=NOW)
+    cache.put("a", 2, 100, now=NOW + 1)
+    cache.put("b", 3, 100, now=NOW + 2)
+    # used recently, so kept over b
+    cache.get("a", now=NOW + 3)
+    cache.put("c", 4, 100, now=NOW + 20)
+    assert sorted(p.stem for p in cache.root.glob("*.json")) == ["a", "c"]
+
+    cache._path("bad").write_text("{}")
+    assert cache.evict(now=NOW + 200) == 3
+    assert list(cache.root.iterdir()) == []
@@ -0,0 +1,90 @@
+"""
+Test migrating sessions between storage encodings
+"""
+from unittest.mock import patch
+
+from hacenada import blob, migrate, storage
+
+
+def _session(name, encoding="json", **answers):
+    """
+    A session stored in HACENADA_HOME under name, with answers
+    """
+    store = storage.HomeDirectoryStorage._from_json_path(
+        storage.HACENADA_HOME / f"{name}{storage.ENCODINGS[encoding]}"
+    )
+    store.description = name
+    for label, value in answers.items():
+        store.save_answer({label: value})
+    return store
+
+
+def test_migrate(my_project):
+    """
+    Is every session moved to the new encoding, holding the same answers?
+    """
+    big = "output\n" * 1000
+    stores = [
+        _session("a", q1="one"),
+        _session("b", q1=big),
+        _session("c", "compact", q1="three"),
+    ]
+    before = {s.path.stem: s.to_structured() for s in stores}
+
+    stats = migrate.migrate("compact")
+    assert stats == migrate.MigrateStats(migrated=2, already=1)
+    home = storage.HACENADA_HOME
+    assert sorted(p.name for p in home.glob("*.hcnb")) == ["a.hcnb", "b.hcnb", "c.hcnb"]
+    assert list(home.glob("*.json")) == []
+    assert list((home / migrate.STAGING).iterdir()) == []
+    for stem, data in before.items():
+        assert migrate._read(home / f"{stem}.hcnb") == data
+    assert home / "b.hcnb" in storage.blob_store().referrers()
+    assert blob.mentions(home / "b.hcnb")
+
+    # and back again, in worker processes
+    assert migrate.migrate("json", jobs=2) == migrate.MigrateStats(migrated=3)
+    assert migrate._read(home / "a.json") == before["a"]
+
+
+def test_busy_and_failed(my_project):
+    """
+    Is a session in use left alone, and one that can't be read reported?
+    """
+    busy = _session("busy")
+    (storage.HACENADA_HOME / "broken.json").write_text("{not json")
+    with busy.lock():
+        stats = migrate.migrate("compact")
+    assert (stats.migrated, stats.busy) == (0, 1)
+    assert stats.failed[0].startswith(str(storage.HACENADA_HOME / "broken.json"))
+    assert busy.path.exists()
+
+    with patch.object(migrate, "_read", side_effect=[busy.to_structured(), {}]):
+        migrated = migrate.migrate_one(busy.path, "compact")
+    assert migrated.error.endswith(f"did not read back the same as {busy.path}")
+    assert busy.path.exists()
+    assert (
+        migrate.migrate_one(storage.HACENADA_HOME / "gone.json", "compact").status
+        == "gone"
+    )
+
+
+def test_resume(my_project):
+    """
+    After an interruption, is the storage hacenada would open kept, and the other
+    replaced or removed?
+    """
+    home = storage.HACENADA_HOME
+    # interrupted moving to compact: the json is still the one in use
+    _session("x", q1="new")
+    _session("x", "compact", q1="old")
+    (home / migrate.STAGING).mkdir()
+    (home / migrate.STAGING / "x.hcnb").write_bytes(b"partial")
+    assert migrate.migrate("compact") == migrate.MigrateStats(migrated=1)
+    assert migrate._read(home / "x.hcnb")["answer"][0]["value"] == "new"
+
+    # interrupted moving to json: the json was put in place, and is the one in use
+    _session("x", q1="newer")
+    assert migrate.migrate("json") == migrate.MigrateStats(migrated=1)
+    assert not (home / "x.hcnb").exists()
+    assert migrate._read(home / "x.json")["answer"][0]["value"] == "newer"
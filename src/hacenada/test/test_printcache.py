@@ -0,0 +1,90 @@
+"""
+Test the cache of printed output
+"""
+import os
+
+from hacenada import printcache
+
+
+def _age(*paths, ns=0):
+    """
+    Set the mtime of paths well before now (by default, to the epoch)
+    """
+    for path in paths:
+        os.utime(path, ns=(ns, ns))
+
+
+def test_fresh_get_put(tmp_path):
+    """
+    Is output used while no file changed, or while only their stat changed?
+    """
+    cache = printcache.PrintCache(tmp_path / "print")
+    source, stored = tmp_path / "s.toml", tmp_path / "s.json"
+    source.write_text("[hacenada]\n")
+    stored.write_text("{}")
+    _age(source, stored, ns=10**9)
+    key = cache.key(source, stored, "json")
+    assert key != cache.key(source, None, "json")
+    assert cache.fresh(key) is None
+
+    watched = cache.watch([source], stored)
+    assert cache.get(key, watched, 1) is None
+    cache.put(key, watched, 1, "printed")
+    assert cache.fresh(key) == "printed"
+
+    # touched: not fresh, but the same contents and revision
+    _age(source)
+    assert cache.fresh(key) is None
+    assert cache.get(key, cache.watch([source], stored), 2) is None
+    assert cache.get(key, cache.watch([source], stored), 1) == "printed"
+    assert cache.fresh(key) == "printed"
+
+    source.write_text("[hacenada]\nname = 'x'\n")
+    assert cache.fresh(key) is None
+    assert cache.get(key, cache.watch([source], stored), 1) is None
+
+
+def test_racy(tmp_path):
+    """
+    Is a file written just before its signature was taken checked by its contents?
+    """
+    cache = printcache.PrintCache(tmp_path / "print")
+    source = tmp_path / "s.toml"
+    source.write_text("[hacenada]\nname = 'a'\n")
+    mtime = source.stat().st_mtime_ns
+    key = cache.key(source, None, "toml")
+    cache.put(key, cache.watch([source], None), 0, "printed a")
+    assert cache.fresh(key) is None
+
+    # rewritten in place with the same size, within the same mtime granule
+    source.write_text("[hacenada]\nname = 'b'\n")
+    _age(source, ns=mtime)
+    assert cache.fresh(key) is None
+    assert cache.get(key, cache.watch([source], None), 0) is None
+
+    # unchanged, and long enough ago: trusted again once the contents are checked
+    cache.put(key, cache.watch([source], None), 0, "printed b")
+    _age(source)
+    assert cache.get(key, cache.watch([source], None), 0) == "printed b"
+    assert cache.fresh(key) == "printed b"
+
+
+def test_prune(tmp_path):
+    """
+    Are entries whose files are gone, and unreadable ones, deleted?
+    """
+    cache = printcache.PrintCache(tmp_path / "print")
+    assert cache.prune() == 0
+    source = tmp_path / "s.toml"
+    source.write_text("[hacenada]\n")
+    for name in "ab":
+        stored = tmp_path / f"{name}.json"
+        stored.write_text("{}")
+        _age(source, stored)
+        cache.put(
+            cache.key(source, stored, "toml"), cache.watch([source], stored), 0, name
+        )
+    (tmp_path / "b.json").unlink()
+    cache._path("bad").write_text("{not json")
+    assert cache.prune() == 2
+    assert cache.fresh(cache.key(source, tmp_path / "a.json", "toml")) == "a"
@@ -1,12 +1,16 @@
 """
 Test the rendering mechanism to see if inquirer works
 """
+import os
+import subprocess
+import sys
+import typing
 from unittest.mock import Mock, create_autospec, patch
 
 import inquirer
-from pytest import fixture
+from pytest import fixture, mark, raises
 
-from hacenada import render, session
+from hacenada import const, error, render, session
 
 
 @fixture
@@ -20,6 +24,9 @@ def test_inquirer_type(renderer):
     Do I look up inquirer question type by hacenada typename?
     """
     assert renderer._inquirer_dispatch("description") is inquirer.text
+    assert renderer._inquirer_dispatch("confirm") is inquirer.confirm
+    for typename in const.STEP_TYPES:
+        assert renderer._inquirer_dispatch(typename)
 
 
 @fixture
@@ -59,3 +66,119 @@ def test_render_no_description(renderer, steppie, seshie):
         renderer.render(steppie, seshie)
 
     m_prompt.return_value.assert_called_once_with("SCRIPT NAME : q1\noh noo\n>>")
+
+
+def test_replay_render(steppie, seshie):
+    """
+    Do I answer with recorded answers, and refuse steps that have none?
+    """
+    replayer = render.ReplayRender.from_answers(
+        [
+            {"label": "q1", "value": "recorded"},
+            {"label": "skipped", "value": None, "skipped": True},
+        ]
+    )
+    assert replayer.render(steppie, seshie) == {"q1": "recorded"}
+    assert replayer.given == ["q1"]
+
+    with raises(error.ReplayDiverged, match=r"no answer was recorded for \[skipped\]"):
+        replayer.render(dict(steppie, label="skipped"), seshie)
+
+    # wait steps get their recorded answer, without running the check
+    wait_step = dict(steppie, type="wait", check="false")
+    assert replayer.render_waits([wait_step], seshie) == {"q1": "recorded"}
+
+    replayer.until = "q1"
+    with raises(error.ReplayStopped):
+        replayer.render(steppie, seshie)
+
+
+def test_plain_render(steppie, seshie, capsys):
+    """
+    Do I ask with plain prompts, and re-ask confirmations until they make sense?
+    """
+    plain = render.PlainRender()
+    with patch("builtins.input", return_value="typed answer") as m_input:
+        assert plain.render(steppie, seshie) == {"q1": "typed answer"}
+    m_input.assert_called_once_with(">> ")
+    assert capsys.readouterr().out == "DESCRIPTION : q1\noh noo\n"
+
+    confirm = dict(steppie, type="message")
+    for replies, expected in [([""], True), (["huh?", "No"], False), (["y"], True)]:
+        with patch("builtins.input", side_effect=replies):
+            assert plain.render(confirm, seshie) == {"q1": expected}
+
+    with patch("builtins.input", side_effect=EOFError), raises(
+        error.RenderError, match="end of input"
+    ):
+        plain.render(steppie, seshie)
+
+
+@mark.parametrize(
+    "stdin,stdout,term,expected",
+    [
+        [True, True, "xterm", render.InquirerRender],
+        [True, True, "dumb", render.PlainRender],
+        [True, True, "", render.PlainRender],
+        [False, True, "xterm", render.PlainRender],
+        [True, False, "xterm", render.PlainRender],
+    ],
+)
+def test_choose_renderer(stdin, stdout, term, expected):
+    """
+    Do I use inquirer only on a full terminal, unless told otherwise?
+    """
+    with patch.object(
+        render.sys, "stdin", Mock(**{"isatty.return_value": stdin})
+    ), patch.object(
+        render.sys, "stdout", Mock(**{"isatty.return_value": stdout})
+    ), patch.dict(
+        render.os.environ, TERM=term
+    ):
+        assert isinstance(render.choose_renderer(), expected)
+        assert isinstance(render.choose_renderer("plain"), render.PlainRender)
+
+
+def _imported(code: str) -> typing.Set[str]:
+    """
+    The modules imported by a fresh interpreter that runs code
+    """
+    proc = subprocess.run(
+        [sys.executable, "-c", f"import sys; {code}; print(*sys.modules)"],
+        capture_output=True,
+        text=True,
+        check=True,
+        env=dict(os.environ, PYTHONPATH=os.pathsep.join(sys.path)),
+    )
+    return set(proc.stdout.split())
+
+
+# imported only by the commands that need them, never to run a step
+COMMAND_ONLY = {
+    "hacenada.audit",
+    "hacenada.diff",
+    "hacenada.export",
+    "hacenada.loadtest",
+    "hacenada.migrate",
+    "hacenada.replay",
+    "hacenada.report",
+    "hacenada.retention",
+    "hacenada.status",
+    "multiprocessing",
+    "ctypes",
+}
+
+
+def test_import_cost():
+    """
+    Does the plain path avoid inquirer and the modules of other commands?
+    """
+    plain = _imported("from hacenada import main; main.render.choose_renderer('plain')")
+    assert "hacenada.main" in plain
+    assert "inquirer" not in plain
+    assert not COMMAND_ONLY & plain
+    heavy = _imported(
+        "from hacenada import main; "
+        "main.render.InquirerRender._inquirer_dispatch('input')"
+    )
+    assert "inquirer" in heavy
@@ -0,0 +1,69 @@
+"""
+Test replaying sessions from their logs
+"""
+from pytest import fixture
+
+from hacenada import main, replay, script, storage
+
+
+@fixture
+def logged(my_project, scriptie):
+    """
+    The json log of a finished session
+    """
+    logd = my_project.with_suffix(".log.d")
+    logd.mkdir()
+    store = storage.HomeDirectoryStorage.from_structured({})
+    store.save_answer({"q1": "replayed description"})
+    store.save_answer({"message-1": True})
+    path = logd / "2022-06-01-1--replayed.json"
+    path.write_text(main.format_json(scriptie, store))
+    return path
+
+
+def test_replay(logged):
+    """
+    Do I give every step its recorded answer, without prompting?
+    """
+    store = storage.HomeDirectoryStorage.from_structured({})
+    result = replay.replay(logged, storage=store)
+    assert result == replay.ReplayResult(log=logged, replayed=2, finished=True)
+    assert store.description == "replayed description"
+    assert store.get_answer("message-1")["value"] is True
+
+
+def test_replay_until(logged):
+    """
+    Do I stop before the label I was asked to stop at?
+    """
+    store = storage.HomeDirectoryStorage.from_structured({})
+    result = replay.replay(logged, storage=store, until="message-1")
+    assert result == replay.ReplayResult(log=logged, replayed=1, stopped=True)
+    assert store.get_answer("message-1") is None
+
+
+def test_replay_changed_script(logged, scriptie):
+    """
+    Do I report where a changed script no longer matches a recorded run?
+    """
+    data = {"hacenada": scriptie.preamble, "step": list(scriptie.raw_steps)}
+    data["step"].insert(1, {"type": "input", "message": "new", "label": "new"})
+    result = replay.replay(logged, script.Script.from_structured(data))
+    assert result.diverged == "no answer was recorded for [new]"
+    assert result.replayed == 1
+
+    data["step"] = data["step"][:1]
+    result = replay.replay(logged, script.Script.from_structured(data))
+    assert result.finished
+    assert result.unused == ["message-1"]
+
+
+def test_find_logs(logged):
+    """
+    Do I find a single log, or every log in a directory?
+    """
+    (logged.parent / "2022-06-01-1--replayed.log").write_text("markdown")
+    other = logged.parent / "2022-06-02-1--other.hcnb"
+    other.touch()
+    assert replay.find_logs(logged) == [logged]
+    assert replay.find_logs(logged.parent) == [logged, other]
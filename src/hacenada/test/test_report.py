@@ -0,0 +1,118 @@
+"""
+Test the incremental HTML report site
+"""
+import os
+from unittest.mock import patch
+
+from pytest import fixture
+
+from hacenada import logfile, main, report, storage
+
+
+@fixture
+def logd(my_project, scriptie):
+    """
+    A .log.d with two runs, one in each encoding
+    """
+    path = my_project.with_suffix(".log.d")
+    path.mkdir()
+    runs = [("first", "<a1>"), ("second", "a2" * 200)]
+    for n, (description, answer) in enumerate(runs):
+        store = storage.HomeDirectoryStorage.from_structured({})
+        store.save_answer({"q1": answer})
+        store.description = description
+        name = f"2022-06-0{n + 1}-1--{description}"
+        if n:
+            logfile.write_compact(path / f"{name}.hcnb", scriptie, store)
+        else:
+            (path / f"{name}.json").write_text(main.format_json(scriptie, store))
+        (path / f"{name}.log").write_text("markdown is not read")
+    return path
+
+
+def test_build(logd, tmp_path):
+    """
+    Do I build an index, run pages and label history pages?
+    """
+    site = tmp_path / "site"
+    stats = report.build(logd, site)
+    assert stats == report.ReportStats(runs=2, built=2, labels=1, index=True)
+
+    index = (site / "index.html").read_text()
+    assert "<h1>hola</h1>" in index
+    assert index.index("second") < index.index("first")
+
+    run = (site / report.run_page("2022-06-01-1--first.json")).read_text()
+    assert "&lt;a1&gt;" in run
+    assert "shame if something" in run
+
+    history = (site / report.label_page("q1")).read_text()
+    assert "&lt;a1&gt;" in history
+    # long answers are shortened in the history, but not on the run page
+    assert "a2" * 100 + "…" in history
+    run = (site / report.run_page("2022-06-02-1--second.hcnb")).read_text()
+    assert "a2" * 200 in run
+
+
+def test_skipped(logd, tmp_path, scriptie):
+    """
+    Does a run page say which steps were skipped?
+    """
+    store = storage.HomeDirectoryStorage.from_structured({})
+    store.skip_step("q1")
+    (logd / "2022-06-03-1--skip.json").write_text(main.format_json(scriptie, store))
+    report.build(logd, tmp_path)
+    assert (
+        "<p>Skipped "
+        in (tmp_path / report.run_page("2022-06-03-1--skip.json")).read_text()
+    )
+
+
+def test_incremental(logd, tmp_path):
+    """
+    Do rebuilds only touch pages for logs that were added, changed or removed?
+    """
+    site = tmp_path / "site"
+    report.build(logd, site)
+
+    with patch.object(logfile, "read_log", wraps=logfile.read_log) as m_read:
+        stats = report.build(logd, site)
+    m_read.assert_not_called()
+    assert stats == report.ReportStats(runs=2)
+
+    changed = logd / "2022-06-01-1--first.json"
+    changed.write_text(changed.read_text().replace("<a1>", "changed"))
+    os.utime(changed, ns=(0, 0))
+    with patch.object(logfile, "read_log", wraps=logfile.read_log) as m_read:
+        stats = report.build(logd, site)
+    m_read.assert_called_once_with(changed)
+    assert stats == report.ReportStats(runs=2, built=1, labels=1, index=True)
+    assert "changed" in (site / report.label_page("q1")).read_text()
+
+    # a removed log takes its page away, and its labels' pages when nothing is left
+    for log in logd.glob("*--*.*"):
+        log.unlink()
+    stats = report.build(logd, site)
+    assert stats == report.ReportStats(runs=0, removed=2, labels=1, index=True)
+    assert not (site / report.run_page("2022-06-01-1--first.json")).exists()
+    assert not (site / report.label_page("q1")).exists()
+
+
+def test_unusual(logd, tmp_path):
+    """
+    Do I cope with unreadable logs, odd names, a stale manifest and a missing log dir?
+    """
+    site = tmp_path / "site"
+    (logd / "garbage.json").write_text("{")
+    (logd / "adhoc.json").write_text((logd / "2022-06-01-1--first.json").read_text())
+    (site).mkdir()
+    (site / report.MANIFEST).write_text('{"version": 0}')
+
+    stats = report.build(logd, site, title="custom")
+    assert stats.failed == ["garbage.json"]
+    assert stats.built == 3
+    assert "<h1>custom</h1>" in (site / "index.html").read_text()
+
+    stats = report.build(tmp_path / "nope.log.d", tmp_path / "empty")
+    assert stats == report.ReportStats(index=True)
+    assert "nope.log.d" in (tmp_path / "empty/index.html").read_text()
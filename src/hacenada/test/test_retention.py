@@ -0,0 +1,237 @@
+"""
+Test the retention policy for logs and sessions
+"""
+import json
+import os
+from pathlib import Path
+import shutil
+import time
+from unittest.mock import patch
+import zipfile
+
+from pytest import fixture
+
+from hacenada import blob, complete, retention, storage
+
+
+DAY = retention.SECONDS_PER_DAY
+NOW = time.time()
+
+
+@fixture
+def logd(my_project):
+    """
+    The .log.d of my_project
+    """
+    ret = my_project.with_suffix(".log.d")
+    ret.mkdir()
+    return ret
+
+
+def add_run(logd, name, days_old=0, retain=None, text="x"):
+    """
+    Write the files of a run named name, as if it finished days_old days ago
+    """
+    data = {
+        "hacenada": {"name": "hola", "retain": retain or {}},
+        "step": [],
+        "answer": [],
+    }
+    files = [logd / f"{name}.log", logd / f"{name}.json", logd / f"{name}.ipynb"]
+    files[0].write_text(text)
+    files[1].write_text(json.dumps(data))
+    files[2].write_text("{}")
+    then = NOW - days_old * DAY
+    for path in files:
+        os.utime(path, (then, then))
+    return files
+
+
+def test_runs_in(logd):
+    """
+    Are a run's files grouped, and runs ordered by date, then counter?
+    """
+    add_run(logd, "2022-06-01-10--later")
+    add_run(logd, "2022-06-01-2--earlier")
+    add_run(logd, "2022-05-31-1--v1.2")
+    (logd / "bundle-2022-05.zip").write_bytes(b"")
+    (logd / "notes.txt").write_text("not a run")
+
+    runs = retention.runs_in(logd)
+    assert [r.key for r in runs] == [
+        ("2022-05-31", 1, "2022-05-31-1--v1.2"),
+        ("2022-06-01", 2, "2022-06-01-2--earlier"),
+        ("2022-06-01", 10, "2022-06-01-10--later"),
+    ]
+    assert [p.suffix for p in runs[0].files] == [".ipynb", ".json", ".log"]
+    assert runs[0].bundle == "bundle-2022-05.zip"
+
+
+def test_compact(logd):
+    """
+    Are old runs moved into a bundle for their month, and recent ones kept?
+    """
+    add_run(logd, "2022-05-01-1--a", days_old=40)
+    add_run(logd, "2022-06-01-1--b", days_old=20)
+    add_run(logd, "2022-06-02-1--c", days_old=10)
+    add_run(logd, "2022-06-03-1--d", days_old=1)
+
+    stats = retention.RetentionStats()
+    due = retention.enforce_dir(logd, retention.Policy(days=30, runs=2), NOW, stats)
+    assert stats.compacted == 2
+    assert due == NOW - 10 * DAY + 30 * DAY
+    assert [r.key[2] for r in retention.runs_in(logd)] == [
+        "2022-06-02-1--c",
+        "2022-06-03-1--d",
+    ]
+    with zipfile.ZipFile(logd / "bundle-2022-05.zip") as zf:
+        assert sorted(zf.namelist()) == [
+            f"2022-05-01-1--a{s}" for s in (".ipynb", ".json", ".log")
+        ]
+    with zipfile.ZipFile(logd / "bundle-2022-06.zip") as zf:
+        assert zf.read("2022-06-01-1--b.log") == b"x"
+
+    # a run compacted before, but not removed, isn't bundled twice
+    with zipfile.ZipFile(logd / "bundle-2022-06.zip", "a") as zf:
+        zf.writestr("2022-06-02-1--c.log", "x")
+    retention.enforce_dir(logd, retention.Policy(runs=1), NOW, stats)
+    with zipfile.ZipFile(logd / "bundle-2022-06.zip") as zf:
+        assert len(zf.namelist()) == 6
+    assert retention.enforce_dir(logd, retention.Policy(runs=0), NOW, stats) is None
+
+
+def test_max_bytes(logd):
+    """
+    Are the oldest bundles, then the oldest runs, deleted to fit the size limit?
+    """
+    add_run(logd, "2022-05-01-1--a", days_old=40, text="x" * 1000)
+    add_run(logd, "2022-06-01-1--b", text="y" * 1000)
+    add_run(logd, "2022-06-02-1--c", text="z" * 1000)
+    stats = retention.RetentionStats()
+    retention.enforce_dir(logd, retention.Policy(days=30), NOW, stats)
+
+    sizes = {p.name: p.stat().st_size for p in logd.iterdir()}
+    limit = sum(sizes.values()) - sizes["bundle-2022-05.zip"]
+    due = retention.enforce_dir(
+        logd, retention.Policy(days=30, max_bytes=limit), NOW, stats
+    )
+    assert not (logd / "bundle-2022-05.zip").exists()
+    assert (stats.deleted, stats.freed) == (1, sizes["bundle-2022-05.zip"])
+    assert due == NOW + 30 * DAY
+
+    retention.enforce_dir(
+        logd, retention.Policy(days=30, max_bytes=limit - 1), NOW, stats
+    )
+    assert [r.key[2] for r in retention.runs_in(logd)] == ["2022-06-02-1--c"]
+    assert stats.deleted == 4
+
+
+def test_policy_of(logd):
+    """
+    Does the newest readable log say what the script's policy is?
+    """
+    assert retention.policy_of(retention.runs_in(logd)) == retention.Policy()
+    add_run(logd, "2022-06-01-1--a", retain={"runs": 3})
+    add_run(logd, "2022-06-02-1--b", retain={"runs": 5, "days": 9})
+    add_run(logd, "2022-06-03-1--c")[1].write_text("{not json")
+    policy = retention.policy_of(retention.runs_in(logd))
+    assert policy == retention.Policy(runs=5, days=9)
+    base = retention.Policy(runs=1, max_bytes=10)
+    assert policy.over(base) == retention.Policy(days=9, runs=5, max_bytes=10)
+
+
+def test_enforce_incremental(logd, tmp_path):
+    """
+    Is a directory skipped until it changes, the policy changes, or a run ages out?
+    """
+    add_run(logd, "2022-06-01-1--a", days_old=5)
+    add_run(logd, "2022-06-02-1--b", days_old=1, retain={"days": 30})
+    (storage.HACENADA_HOME / retention.STATE).write_text("{not json")
+
+    stats = retention.enforce([logd, tmp_path / "missing.log.d"], now=NOW)
+    assert (stats.compacted, stats.unchanged) == (0, 0)
+    with patch.object(
+        retention, "enforce_dir", wraps=retention.enforce_dir
+    ) as m_enforce:
+        assert retention.enforce([logd], now=NOW).unchanged == 1
+        assert (
+            retention.enforce([logd], retention.Policy(runs=9), now=NOW).unchanged == 0
+        )
+        assert (
+            retention.enforce(
+                [logd], retention.Policy(runs=9), now=NOW + 24 * DAY
+            ).unchanged
+            == 1
+        )
+        assert m_enforce.call_count == 1
+    # the oldest run is due
+    stats = retention.enforce([logd], retention.Policy(runs=9), now=NOW + 26 * DAY)
+    assert stats.compacted == 1
+
+    add_run(logd, "2022-06-03-1--c")
+    assert retention.enforce([logd], retention.Policy(runs=9), now=NOW).unchanged == 0
+
+
+def test_bundled_blobs(logd):
+    """
+    Are large answers kept while a bundle refers to them?
+    """
+    blobs = storage.blob_store()
+    ref = blobs.put("big" * 2000)
+    os.utime(blobs._path(ref["blob"]), (0, 0))
+    log = logd / "2022-05-01-1--a.json"
+    log.write_text(json.dumps({"hacenada": {}, "answer": [], "ref": ref}))
+    os.utime(log, (NOW - 40 * DAY, NOW - 40 * DAY))
+    blobs.add_referrer(log)
+
+    retention.enforce_dir(
+        logd, retention.Policy(days=30), NOW, retention.RetentionStats()
+    )
+    assert blobs.collect().deleted == 0
+    assert blobs.referrers() == [logd / "bundle-2022-05.zip"]
+    assert blob.mentions(logd / "bundle-2022-05.zip") == {ref["blob"]}
+
+
+def test_collect(my_project, logd, storagie):
+    """
+    Are abandoned sessions dropped, after their logs are found?
+    """
+    add_run(logd, "2022-05-01-1--a", days_old=40)
+    stale = storage.HACENADA_HOME / "stale__script.json"
+    stale.write_text("{}")
+    os.utime(stale, (NOW - 10 * DAY, NOW - 10 * DAY))
+    complete.remember(storage.HACENADA_HOME, Path("/stale/script.toml"), ["q1"])
+    complete.remember(storage.HACENADA_HOME, my_project, ["q1"])
+
+    # in use by another hacenada: left alone
+    os.utime(storagie.path, (NOW - 10 * DAY, NOW - 10 * DAY))
+    with storage.locked(storagie.path):
+        stats = retention.collect(retention.Policy(days=30), session_days=7, now=NOW)
+    assert (stats.sessions, stats.compacted) == (1, 1)
+    assert not stale.exists()
+    assert not storage.lock_path(stale).exists()
+    assert list(complete.load(storage.HACENADA_HOME)) == [str(my_project)]
+    assert storagie.path.exists()
+
+    # touched recently: left alone
+    os.utime(storagie.path, (NOW, NOW))
+    assert retention.prune_sessions(7, now=NOW) == []
+
+    # without session_days, sessions are left alone
+    os.utime(storagie.path, (0, 0))
+    assert retention.collect().sessions == 0
+    assert storagie.path.exists()
+
+
+def test_collect_remembered(my_project, logd):
+    """
+    Are the logs of a finished run found without a session or a root, until they go?
+    """
+    add_run(logd, "2022-05-01-1--a", days_old=40)
+    retention.remember(logd)
+    retention.remember(logd)
+    assert retention.collect(retention.Policy(runs=0), now=NOW).compacted == 1
+
+    shutil.rmtree(logd)
+    assert retention.collect(now=NOW) == retention.RetentionStats()
+    assert retention._load_state() == {}
@@ -1,8 +1,13 @@
 """
 Do we turn a toml scriptfile into a displayable script?
 """
+import json
+from unittest.mock import Mock, patch
 
-from hacenada import script
+from pytest import fixture, raises
+import yaml
+
+from hacenada import codec, error, script
 
 
 def test_autolabel(steppie):
@@ -20,3 +25,442 @@ def test_preprocess(scriptie):
     assert fixed_step["stop"] is True
     assert fixed_step["type"] == "message"
     assert fixed_step["label"] == "message-1"
+
+
+def test_validate():
+    """
+    Do I find every problem in a script before it runs?
+    """
+    assert script.Script.validate({}) == ["missing [hacenada] section"]
+    assert script.Script.validate({"hacenada": {}}) == ["missing [[step]] sections"]
+
+    problems = script.Script.validate(
+        {
+            "hacenada": {"name": "x"},
+            "step": [
+                {"message": "fine", "label": "a"},
+                "not a table",
+                {"label": "a", "message": "duplicate label"},
+                {"type": "nope", "stop": "maybe"},
+                {"type": "input", "message": "autolabel collides", "label": ""},
+                {"type": "input", "message": "hi", "label": "input-4"},
+            ],
+        }
+    )
+    assert problems == [
+        "step 1: not a table",
+        "step 2: label 'a' already used by step 0",
+        "step 3: missing message",
+        "step 3: unknown type 'nope'",
+        "step 3: stop must be true or false",
+        "step 5: label 'input-4' already used by step 4",
+    ]
+
+
+def test_validate_when():
+    """
+    Do I find bad conditions, including ones that refer to later or unknown steps?
+    """
+    problems = script.Script.validate(
+        {
+            "hacenada": {},
+            "step": [
+                {"message": "m", "label": "a", "when": 1},
+                {"message": "m", "label": "b", "when": "a =="},
+                {"message": "m", "label": "c", "when": "a == 'x' or c or nope"},
+                {"message": "m", "label": "d", "when": "a in ['x', b]"},
+            ],
+        }
+    )
+    assert problems == [
+        "step 0: when must be a string",
+        "step 1: expected a value, found the end in 'a =='",
+        "step 2: when refers to 'c', which is not an earlier step",
+        "step 2: when refers to 'nope', which is not an earlier step",
+    ]
+
+
+def test_validate_retain():
+    """
+    Do I find mistakes in the retention policy?
+    """
+    steps = [{"message": "m"}]
+    retain = {"days": 30, "runs": "ten", "max_bytes": -1, "weeks": 2, "days_": True}
+    assert script.Script.validate({"hacenada": {"retain": retain}, "step": steps}) == [
+        "retain: runs must be a number of runs",
+        "retain: max_bytes must be a number of bytes",
+        "retain: unknown key 'weeks'",
+        "retain: unknown key 'days_'",
+    ]
+    assert script.Script.validate({"hacenada": {"retain": 30}, "step": steps}) == [
+        "retain must be a table"
+    ]
+
+
+def test_should_show(scriptie):
+    """
+    Do I show steps without a condition, and steps whose condition is true?
+    """
+    data = {"hacenada": scriptie.preamble, "step": scriptie.raw_steps}
+    data["step"][1]["when"] = "q1 != none"
+    conditional = script.Script.from_structured(data)
+    assert conditional.should_show(conditional.overlay[0], {}.get)
+    assert not conditional.should_show(conditional.overlay[1], {}.get)
+    assert conditional.should_show(conditional.overlay[1], {"q1": "x"}.get)
+
+    # conditions survive compiling
+    compiled = script.Script.from_compiled(conditional.compile())
+    assert compiled.conditions == conditional.conditions
+
+
+def test_step_digest(steppie):
+    """
+    Does a step's digest follow what it asks, and not its label?
+    """
+    digest = script.step_digest(steppie)
+    assert script.step_digest(dict(steppie, label="other", stop=False)) == digest
+    assert script.step_digest(dict(steppie, message="changed")) != digest
+    assert script.step_digest(dict(steppie, when="a")) != digest
+
+
+def test_reload(scriptie, my_project, tmp_path):
+    """
+    Do I reuse unchanged steps and conditions when an edited script is reloaded?
+    """
+    my_project.write_text(my_project.read_text() + 'when = "q1 != none"\n')
+    first = scriptie.reload(my_project)
+    assert first.overlay[0] is scriptie.overlay[0]
+    assert first.overlay[1]["when"] == "q1 != none"
+
+    my_project.write_text(my_project.read_text().replace("oh noo", "oh yes"))
+    second = first.reload(my_project)
+    assert second.overlay[0]["message"] == "oh yes"
+    assert second.overlay[1] is first.overlay[1]
+    assert second.conditions["message-1"] is first.conditions["message-1"]
+
+    my_project.write_text(my_project.read_text().replace("q1 != none", "later == 1"))
+    with raises(error.ScriptError, match="'later', which is not an earlier step"):
+        second.reload(my_project)
+
+    compiled = tmp_path / f"project{script.COMPILED_SUFFIX}"
+    compiled.write_bytes(scriptie.compile())
+    assert second.reload(compiled) == scriptie
+
+
+FOREACH = {
+    "hacenada": {"name": "fan-out"},
+    "step": [
+        {"type": "input", "message": "which regions?", "label": "regions"},
+        {
+            "message": "deploy to {item}",
+            "label": "deploy",
+            "foreach": "regions",
+            "stop": False,
+        },
+        {
+            "message": "check {item}",
+            "label": "check",
+            "foreach": ["a", 2],
+            "when": "regions",
+        },
+    ],
+}
+
+
+def test_foreach():
+    """
+    Do foreach steps expand lazily, from a list or an earlier answer?
+    """
+    fanout = script.Script.from_structured(FOREACH)
+    assert len(fanout.overlay) == 3
+    assert fanout.overlay[2]["foreach"] == ["a", "2"]
+
+    answers = {"regions": "us-east-1, eu-west-1 ap-south-1"}
+    steps = fanout.steps(answers.get)
+    assert next(steps)["label"] == "regions"
+    assert next(steps) == {
+        "type": "message",
+        "message": "deploy to us-east-1",
+        "stop": False,
+        "label": "deploy[us-east-1]",
+        "template": "deploy",
+    }
+    assert [s["label"] for s in steps] == [
+        "deploy[eu-west-1]",
+        "deploy[ap-south-1]",
+        "check[a]",
+        "check[2]",
+    ]
+
+    # an answer may also be a list; no answer (yet) means no steps
+    assert len(list(fanout.steps({"regions": ["x", "y"]}.get))) == 5
+    assert [s["label"] for s in fanout.steps({}.get)] == [
+        "regions",
+        "check[a]",
+        "check[2]",
+    ]
+    printable = [s["label"] for s in fanout.steps({}.get, show_templates=True)]
+    assert printable == ["regions", "deploy", "check[a]", "check[2]"]
+
+    assert fanout.template_label("deploy[us-east-1]") == "deploy"
+    assert fanout.template_label("regions[x]") == "regions[x]"
+    assert fanout.template_label("regions") == "regions"
+
+    # the foreach step's condition applies to each of its steps
+    check = list(fanout.steps({}.get))[1]
+    assert not fanout.should_show(check, {}.get)
+    assert fanout.should_show(check, answers.get)
+
+
+def test_validate_foreach():
+    """
+    Do I find foreach steps that have nothing sensible to expand?
+    """
+    steps = [
+        {"message": "m", "foreach": "later"},
+        {"message": "m", "foreach": []},
+        {"message": "m", "foreach": [{"not": "an item"}]},
+        {"message": "m", "label": "later", "foreach": 3},
+    ]
+    assert script.Script.validate({"hacenada": {}, "step": steps}) == [
+        "step 0: foreach refers to 'later', which is not an earlier step",
+        "step 1: foreach must be a list of items, or the label of an earlier step",
+        "step 2: foreach must be a list of items, or the label of an earlier step",
+        "step 3: foreach must be a list of items, or the label of an earlier step",
+    ]
+
+
+def test_wait_steps():
+    """
+    Do I keep the check of wait steps, and find checks that can't run?
+    """
+    data = {
+        "hacenada": {},
+        "step": [
+            {
+                "type": "wait",
+                "message": "m",
+                "label": "up",
+                "check": "ping -c1 {item}",
+                "timeout": 60,
+                "foreach": ["a", "b"],
+            },
+            {
+                "type": "wait",
+                "message": "m",
+                "check": " ",
+                "interval": 0,
+                "timeout": True,
+            },
+            {"message": "m", "check": "true", "timeout": 5},
+            {"type": "wait", "message": "m", "interval": "soon", "cache": "yes"},
+            {"message": "m", "cache": 0},
+        ],
+    }
+    assert script.Script.validate(data) == [
+        "step 1: a wait step needs a check command",
+        "step 1: interval must be a number of seconds",
+        "step 1: timeout must be a number of seconds",
+        "step 2: check, timeout only apply to wait steps",
+        "step 3: a wait step needs a check command",
+        "step 3: interval must be a number of seconds",
+        "step 3: cache must be true, false or a number of seconds",
+        "step 4: cache only apply to wait steps",
+    ]
+
+    data["step"] = data["step"][:1]
+    waits = script.Script.from_structured(data)
+    assert [(s["check"], s["timeout"]) for s in waits.steps({}.get)] == [
+        ("ping -c1 a", 60),
+        ("ping -c1 b", 60),
+    ]
+
+
+def test_references():
+    """
+    Do I find the earlier answers a step depends on, through its condition and foreach?
+    """
+    data = {
+        "hacenada": {},
+        "step": [
+            {"message": "m", "label": "hosts"},
+            {"message": "m", "label": "env"},
+            {
+                "message": "m",
+                "label": "each",
+                "foreach": "hosts",
+                "when": "env == 'prod'",
+            },
+            {"message": "m", "label": "fixed", "foreach": ["a"]},
+        ],
+    }
+    refs = script.Script.from_structured(data)
+    steps = {s["label"]: s for s in refs.steps({"hosts": "h1"}.get)}
+    assert refs.references(steps["each[h1]"]) == {"hosts", "env"}
+    assert refs.references(steps["fixed[a]"]) == set()
+    assert refs.references(steps["env"]) == set()
+
+
+def test_from_structured_invalid():
+    """
+    Do I refuse to load a script with problems?
+    """
+    with raises(error.ScriptError, match="step 0: missing message"):
+        script.Script.from_structured({"hacenada": {}, "step": [{"type": "input"}]})
+
+
+def test_compile(scriptie, tmp_path):
+    """
+    Does a compiled script load back identically, without reparsing?
+    """
+    compiled = tmp_path / f"project{script.COMPILED_SUFFIX}"
+    compiled.write_bytes(scriptie.compile())
+
+    with patch.object(script.Script, "preprocess_steps") as m_preprocess:
+        loaded = script.Script.from_scriptfile(compiled)
+    m_preprocess.assert_not_called()
+    assert loaded == scriptie
+
+
+def test_from_compiled_errors(scriptie):
+    """
+    Do I reject things that are not compiled scripts, or are the wrong version?
+    """
+    with raises(error.ScriptError, match="not a compiled script: "):
+        script.Script.from_compiled(b"[hacenada]")
+    with raises(error.ScriptError, match="not a compiled script$"):
+        script.Script.from_compiled(codec.dump_records([["hacenada", {}]]))
+    with raises(error.ScriptError, match="not a compiled script$"):
+        script.Script.from_compiled(codec.dump_records([]))
+    with raises(error.ScriptError, match="version 99 is not supported"):
+        script.Script.from_compiled(codec.dump_records([["compiled", 99]]))
+    with raises(error.ScriptError, match="version 3 is not supported"):
+        script.Script.from_compiled(codec.dump_records([["compiled", 3]]))
+
+
+FRAGMENT = """
+[[step]]
+message = "shared preflight"
+label = "preflight"
+"""
+
+
+@fixture
+def includer(tmp_path):
+    """
+    A script that includes a fragment, which includes another fragment
+    """
+    (tmp_path / "common").mkdir()
+    (tmp_path / "common/preflight.toml").write_text(FRAGMENT)
+    (tmp_path / "common/outer.json").write_text(
+        json.dumps(
+            {
+                "hacenada": {"include": ["preflight.toml"]},
+                "step": [{"message": "outer", "label": "outer"}],
+            }
+        )
+    )
+    main = tmp_path / "main.toml"
+    main.write_text(
+        '[hacenada]\nname = "main"\ninclude = ["common/outer.json"]\n'
+        '[[step]]\nmessage = "own step"\n'
+    )
+    return main
+
+
+def test_parsers(tmp_path, scriptie):
+    """
+    Do I pick the parser by file extension?
+    """
+    data = {"hacenada": scriptie.preamble, "step": scriptie.raw_steps}
+    as_json = tmp_path / "project.json"
+    as_json.write_text(json.dumps(data))
+    assert script.Script.from_scriptfile(as_json) == scriptie
+
+    as_yaml = tmp_path / "project.yml"
+    as_yaml.write_text(yaml.safe_dump(data))  # pyyaml is in the "test" extra
+    assert script.Script.from_scriptfile(as_yaml) == scriptie
+
+    with patch.dict("sys.modules", {"yaml": None}):
+        with raises(error.ScriptError, match="need PyYAML"):
+            script.parse_yaml(b"{}")
+
+    for bad, match in [
+        ("project.ini", "don't know how to read .ini files"),
+        ("project", "don't know how to read extensionless files"),
+        ("missing.toml", "No such file"),
+    ]:
+        with raises(error.ScriptError, match=match):
+            script.Script.from_scriptfile(tmp_path / bad)
+
+    for name, content in [
+        ("bad.toml", "[hacenada"),
+        ("bad.json", "{"),
+        ("bad.yaml", "a: [b"),
+        ("list.json", "[]"),
+    ]:
+        (tmp_path / name).write_text(content)
+        with raises(error.ScriptError, match=f"{name}: "):
+            script.Script.from_scriptfile(tmp_path / name)
+
+
+def test_register_parser(tmp_path):
+    """
+    Can I add my own front-end?
+    """
+    with patch.dict(script.PARSERS):
+
+        @script.parser(".lines")
+        def _parse_lines(raw):
+            steps = [{"message": m} for m in raw.decode().split()]
+            return {"hacenada": {}, "step": steps}
+
+        lines = tmp_path / "script.lines"
+        lines.write_text("one\ntwo\n")
+        loaded = script.Script.from_scriptfile(lines)
+        assert [s["message"] for s in loaded.overlay] == ["one", "two"]
+
+
+def test_include(includer):
+    """
+    Are fragment steps composed ahead of the script's own steps?
+    """
+    loaded = script.Script.from_scriptfile(includer)
+    assert [s["label"] for s in loaded.overlay] == ["preflight", "outer", "message-2"]
+    assert loaded.preamble["name"] == "main"
+    common = includer.parent / "common"
+    assert script.source_files(includer) == [
+        includer,
+        common / "outer.json",
+        common / "preflight.toml",
+    ]
+
+    (includer.parent / "common/preflight.toml").write_text(
+        '[hacenada]\ninclude = ["outer.json"]\n' + FRAGMENT
+    )
+    with raises(error.ScriptError, match="included from itself"):
+        script.Script.from_scriptfile(includer)
+
+
+def test_parse_cache(includer, tmp_path):
+    """
+    Is a fragment shared by several scripts parsed only once?
+    """
+    other = tmp_path / "other.toml"
+    other.write_text(
+        '[hacenada]\nname = "other"\ninclude = ["common/preflight.toml"]\n'
+    )
+
+    script._parse_cache.clear()
+    with patch.dict(script.PARSERS, {".toml": Mock(wraps=script.parse_toml)}):
+        script.Script.from_scriptfile(includer)
+        script.Script.from_scriptfile(other)
+        script.Script.from_scriptfile(includer)
+        # main.toml, preflight.toml and other.toml; outer.json isn't a .toml
+        assert script.PARSERS[".toml"].call_count == 3
+
+    # the cache is bounded
+    script._parse_cache.clear()
+    with patch.object(script, "PARSE_CACHE_SIZE", 2):
+        script.Script.from_scriptfile(includer)
+    assert len(script._parse_cache) == 2
@@ -1,11 +1,11 @@
 """
 Do we manage a session properly?
 """
-from unittest.mock import ANY, MagicMock, call, create_autospec
+from unittest.mock import ANY, MagicMock, call, create_autospec, patch
 
 from pytest import fixture, raises
 
-from hacenada import abstract, error, session
+from hacenada import abstract, error, memo, script, session, storage
 
 
 @fixture
@@ -42,7 +42,7 @@ def test_step_session(sesho):
     """
     Do we correctly navigate a session with multiple questions?
     """
-    sesho.storage.answer = ["skipping_first_question"]
+    sesho.storage.answer = [{"label": "q1"}]
     sesho.options.renderer.render.return_value = {"message-1": "True"}
     with raises(error.ScriptFinished):
         sesho.step_session()
@@ -58,3 +58,299 @@ def test_step_session(sesho):
     sesho.options.renderer.render.return_value = {"q1": "description19"}
     sesho.step_session()
     assert sesho.storage.description == "description19"
+
+
+def test_conditional_steps(sesho, scriptie):
+    """
+    Are steps whose condition is false skipped, and recorded as skipped?
+    """
+    scriptie.overlay[1]["when"] = 'q1 == "go"'
+    scriptie.compile_conditions()
+    answers = {"q1": {"label": "q1", "value": "stay"}}
+    sesho.storage.get_answer.side_effect = answers.get
+    sesho.storage.answer = [{"label": "q1"}]
+    with raises(error.ScriptFinished):
+        sesho.step_session()
+    sesho.options.renderer.render.assert_not_called()
+    sesho.storage.skip_step.assert_called_once_with("message-1")
+    assert sesho.answer_value("q1") == "stay"
+    assert sesho.answer_value("message-1") is None
+
+    answers["q1"]["value"] = "go"
+    sesho.options.renderer.render.return_value = {"message-1": True}
+    with raises(error.ScriptFinished):
+        sesho.step_session()
+    sesho.options.renderer.render.assert_called_once()
+
+
+def test_events(sesho):
+    """
+    Does the on_event hook hear about each step shown and answered, and the end?
+    """
+    events = []
+    sesho.options.on_event = events.append
+    sesho.storage.description = "desc"
+    sesho.storage.answer = [{"label": "q1"}]
+    sesho.options.renderer.render.return_value = {"message-1": True}
+    with raises(error.ScriptFinished):
+        sesho.step_session()
+    assert [(e["event"], e.get("label")) for e in events] == [
+        ("shown", "message-1"),
+        ("answered", "message-1"),
+        ("finished", None),
+    ]
+    assert events[1]["value"] is True
+    assert events[1]["type"] == "message"
+    assert events[2]["session"] == "desc"
+
+
+def test_reconcile(scriptie):
+    """
+    Do answers follow their steps when the script is edited?
+    """
+    store = storage.HomeDirectoryStorage.from_structured({})
+    sesh = session.Session(
+        storage=store,
+        script=scriptie,
+        options=session.SessionOptions(renderer=MagicMock()),
+    )
+    assert sesh.reconcile() == session.Reconciliation()
+    assert store.step_digests == scriptie.step_digests()
+    store.save_answer({"q1": "described"})
+    store.save_answer({"message-1": True})
+
+    # a step inserted ahead of message-1 shifts its autolabel to message-2
+    data = {"hacenada": scriptie.preamble, "step": list(scriptie.raw_steps)}
+    data["step"].insert(1, {"message": "inserted"})
+    sesh.script = script.Script.from_structured(data)
+    assert sesh.reconcile() == session.Reconciliation(
+        relabeled={"message-1": "message-2"}
+    )
+    assert sesh.answered_labels() == {"q1", "message-2"}
+    assert store.get_answer("message-2")["value"] is True
+
+    # a changed question loses its answer; an unchanged one keeps it
+    data["step"][0] = dict(data["step"][0], message="a different question")
+    del data["step"][2]
+    sesh.script = script.Script.from_structured(data)
+    assert sesh.reconcile() == session.Reconciliation(invalidated=["q1", "message-2"])
+    assert sesh.answered_labels() == set()
+    assert sesh.reconcile() == session.Reconciliation()
+
+
+def test_reconcile_unrecorded(scriptie):
+    """
+    Do I keep answers whose labels still exist when no step digests were recorded?
+    """
+    store = storage.HomeDirectoryStorage.from_structured(
+        {"answer": [{"label": "q1", "value": "x"}, {"label": "gone", "value": "y"}]}
+    )
+    sesh = session.Session(
+        storage=store,
+        script=scriptie,
+        options=session.SessionOptions(renderer=MagicMock()),
+    )
+    assert sesh.reconcile() == session.Reconciliation(invalidated=["gone"])
+    assert sesh.answered_labels() == {"q1"}
+
+
+def test_foreach_session():
+    """
+    Are foreach steps expanded as the session reaches them, and only then?
+    """
+    fanout = script.Script.from_structured(
+        {
+            "hacenada": {"name": "fan-out"},
+            "step": [
+                {"type": "input", "message": "how many?", "label": "regions"},
+                {
+                    "type": "input",
+                    "message": "deploy {item}",
+                    "label": "deploy",
+                    "foreach": "regions",
+                },
+            ],
+        }
+    )
+    store = storage.HomeDirectoryStorage.from_structured({})
+    renderer = MagicMock()
+    sesh = session.Session(
+        storage=store, script=fanout, options=session.SessionOptions(renderer=renderer)
+    )
+    renderer.render.return_value = {"regions": " ".join(f"r{n}" for n in range(1000))}
+    with patch.object(fanout, "expand", wraps=fanout.expand) as m_expand:
+        sesh.step_session()
+    # the next step was looked for, but nothing was expanded past it
+    m_expand.assert_called_once()
+
+    renderer.render.side_effect = lambda step, context: {step["label"]: "done"}
+    sesh.step_session()
+    assert renderer.render.call_args[0][0]["label"] == "deploy[r0]"
+    assert sesh.answered_labels() == {"regions", "deploy[r0]"}
+    assert len(fanout.overlay) == 2
+
+    # answers of expanded steps stay while the foreach step is unchanged
+    sesh.reconcile()
+    assert sesh.reconcile() == session.Reconciliation()
+    fanout.overlay[1]["message"] = "deploy {item} carefully"
+    assert sesh.reconcile() == session.Reconciliation(invalidated=["deploy[r0]"])
+
+
+def test_wait_session():
+    """
+    Are wait steps reached together waited for together, and only answered when done?
+    """
+    waits = script.Script.from_structured(
+        {
+            "hacenada": {"name": "waits"},
+            "step": [
+                {
+                    "type": "wait",
+                    "message": "cert",
+                    "label": "cert",
+                    "check": "c",
+                    "stop": False,
+                },
+                {
+                    "type": "wait",
+                    "message": "dns",
+                    "label": "dns",
+                    "check": "d",
+                    "stop": False,
+                },
+                {"message": "go on", "label": "go", "stop": False},
+                {
+                    "type": "wait",
+                    "message": "a",
+                    "label": "a",
+                    "check": "a",
+                    "stop": False,
+                },
+                {
+                    "type": "wait",
+                    "message": "b",
+                    "label": "b",
+                    "check": "b",
+                    "when": "go",
+                    "stop": False,
+                },
+                {
+                    "type": "wait",
+                    "message": "z",
+                    "label": "z",
+                    "check": "z",
+                    "stop": False,
+                },
+            ],
+        }
+    )
+    store = storage.HomeDirectoryStorage.from_structured({})
+    renderer = MagicMock()
+    sesh = session.Session(
+        storage=store, script=waits, options=session.SessionOptions(renderer=renderer)
+    )
+
+    calls = []
+
+    def render_waits(steps, context):
+        calls.append(steps)
+        return {s["label"]: {"ok": s["label"] != "b" or len(calls) > 3} for s in steps}
+
+    renderer.render_waits.side_effect = render_waits
+    renderer.render.return_value = {"go": True}
+    with raises(
+        error.WaitTimedOut, match=r"the check for \[b\] did not succeed in time"
+    ):
+        sesh.step_session()
+    assert [[s["label"] for s in group] for group in calls] == [
+        ["cert", "dns"],
+        ["a"],
+        ["b", "z"],
+    ]
+    assert sesh.answered_labels() == {"cert", "dns", "go", "a", "z"}
+
+    # an unfinished wait is waited for again
+    with raises(error.ScriptFinished):
+        sesh.step_session()
+    assert [s["label"] for s in calls[-1]] == ["b"]
+    assert store.get_answer("b")["value"] == {"ok": True}
+
+
+def test_cached_waits(tmp_path, capsys):
+    """
+    Is a cached wait step's answer remembered, and used again while its inputs are the
+    same?
+    """
+    data = {
+        "hacenada": {"name": "waits"},
+        "step": [
+            {"message": "env", "label": "env", "stop": False},
+            {
+                "type": "wait",
+                "message": "cert",
+                "label": "cert",
+                "check": "c",
+                "cache": True,
+                "stop": False,
+            },
+            {
+                "type": "wait",
+                "message": "dns",
+                "label": "dns",
+                "check": "d",
+                "stop": False,
+            },
+            {
+                "type": "wait",
+                "message": "ping",
+                "label": "ping",
+                "check": "p",
+                "cache": 60,
+                "when": "env",
+            },
+        ],
+    }
+    waits = script.Script.from_structured(data)
+    cache = memo.StepCache(tmp_path / "cache")
+    renderer = MagicMock()
+    renderer.render.side_effect = lambda step, context: {"env": env}
+    renderer.render_waits.side_effect = lambda steps, context: {
+        s["label"]: {"ok": True, "attempts": 2, "elapsed": 3.0} for s in steps
+    }
+    events = []
+
+    def run():
+        store = storage.HomeDirectoryStorage.from_structured({})
+        opts = session.SessionOptions(
+            renderer=renderer, cache=cache, on_event=events.append
+        )
+        with raises(error.ScriptFinished):
+            session.Session(storage=store, script=waits, options=opts).step_session()
+        return store
+
+    env = "prod"
+    store = run()
+    assert not any(a.get("cached") for a in store.answer)
+    assert len(list(cache.root.glob("*.json"))) == 2
+
+    renderer.render_waits.reset_mock()
+    store = run()
+    assert [s["label"] for s in renderer.render_waits.call_args[0][0]] == ["dns"]
+    assert [a["label"] for a in store.answer if a.get("cached")] == ["cert", "ping"]
+    assert store.get_answer("cert") == storage.Answer(
+        label="cert",
+        value={"ok": True, "attempts": 2, "elapsed": 3.0},
+        when=ANY,
+        cached=True,
+    )
+    assert [e["label"] for e in events if e.get("cached")] == ["cert", "ping"]
+    assert (
+        "cert: cert\n>> cached: succeeded after 2 checks, 3.0s\n"
+        in capsys.readouterr().out
+    )
+
+    # the ping step refers to env, so a different answer misses the cache
+    env = "dev"
+    renderer.render_waits.reset_mock()
+    run()
+    assert [s["label"] for s in renderer.render_waits.call_args[0][0]] == ["ping"]
@@ -0,0 +1,77 @@
+"""
+Test listing sessions from their summaries
+"""
+import datetime
+from pathlib import Path
+from unittest.mock import patch
+
+from pytest import raises
+
+from hacenada import session, status, storage
+
+
+NOW = datetime.datetime(2026, 1, 1, 12, 0, 0, tzinfo=datetime.timezone.utc)
+
+
+def test_read_collect(my_project, scriptie, tmp_path):
+    """
+    Is each session's progress read from its summary, without opening the storage?
+    """
+    store = storage.HomeDirectoryStorage.from_path(my_project)
+    session.Session(store, scriptie, session.SessionOptions(quiet=True)).reconcile()
+    store.description = "first"
+    store.save_answer({"q1": "first"})
+    other = storage.HomeDirectoryStorage._from_json_path(
+        storage.HACENADA_HOME / "elsewhere__other.json"
+    )
+    other.update_meta(steps={"a": "", "b[1]": ""})
+
+    with patch.object(
+        storage.HomeDirectoryStorage, "_from_json_path", autospec=True
+    ) as m_open:
+        found = status.collect(storage.HACENADA_HOME)
+    m_open.assert_not_called()
+    assert [
+        (s.script_path, s.description, s.done, s.total, s.current) for s in found
+    ] == [
+        (my_project, "first", 1, 2, "message-1"),
+        (Path("/elsewhere/other"), "", 0, 2, "a"),
+    ]
+    assert found[0].last_answer == store.get_answer("q1")["when"]
+    assert found[1].last_answer is None
+
+
+def test_missing_and_broken(my_project):
+    """
+    Is a summary written for a session stored without one, and a broken session
+    reported?
+    """
+    store = storage.HomeDirectoryStorage.from_path(my_project)
+    store.save_answer({"q1[1]": "item"})
+    store.db.close()
+    storage.summary_path(store.path).unlink()
+    (found,) = status.collect(storage.HACENADA_HOME)
+    assert (found.done, found.total, found.last_answer is not None) == (0, 0, True)
+    assert storage.summary_path(store.path).exists()
+
+    (storage.HACENADA_HOME / "broken.json").write_text("{not json")
+    broken = status.read(storage.HACENADA_HOME / "broken.json")
+    assert broken.error.startswith(str(storage.HACENADA_HOME / "broken.json"))
+    compact = storage.HACENADA_HOME / f"broken{storage.ENCODINGS['compact']}"
+    compact.write_bytes(b"\xff not compact")
+    assert status.read(compact).error.startswith(f"{compact}: ")
+
+    # anything else is a bug, not a broken session
+    with patch.object(status, "_summary", side_effect=KeyError("q1")):
+        with raises(KeyError):
+            status.read(store.path)
+
+
+def test_ago():
+    assert status.ago(None) == "-"
+    assert status.ago(NOW, NOW) == "0s"
+    assert status.ago(NOW - datetime.timedelta(seconds=59), NOW) == "59s"
+    assert status.ago(NOW - datetime.timedelta(minutes=5, seconds=10), NOW) == "5m"
+    assert status.ago(NOW - datetime.timedelta(hours=3), NOW) == "3h"
+    assert status.ago(NOW - datetime.timedelta(days=2, hours=23), NOW) == "2d"
+    assert status.ago(NOW + datetime.timedelta(seconds=5), NOW) == "0s"
@@ -1,12 +1,15 @@
 """
 Tests that we can interact with storage
 """
+import datetime
 from pathlib import Path
-from unittest.mock import ANY
+import time
+from unittest.mock import ANY, patch
 
 from pytest import mark, raises
+from tinydb.operations import delete
 
-from hacenada import error, storage
+from hacenada import abstract, blob, complete, error, storage
 
 
 @mark.parametrize(
@@ -42,14 +45,119 @@ def test_from_cwd(my_project):
 
     stor = storage.HomeDirectoryStorage.from_cwd()
     assert stor.script_path == my_project
-    normaled = storage._normalize_path(my_project, ".json")
-    assert (storage.HACENADA_HOME / f"{normaled}").exists()
+    stored = storage.session_path(my_project, ".json")
+    assert stored.exists()
 
-    # 3. create another storage, check the exception
-    normaled2 = Path(normaled).stem + "2.json"
+    # a script in a directory below has a bucket of its own
+    storage.HomeDirectoryStorage.from_path(my_project.parent / "below" / "other.toml")
+    assert storage.HomeDirectoryStorage.from_cwd().script_path == my_project
+    # ...and is told apart even when it shares one
+    with patch.object(storage, "BUCKET_DIGITS", 0):
+        storage.HomeDirectoryStorage.from_path(my_project)
+        storage.HomeDirectoryStorage.from_path(
+            my_project.parent / "below" / "other.toml"
+        )
+        assert storage.HomeDirectoryStorage.from_cwd().script_path == my_project
+    # a script in cwd with "__" in its name is ours
+    other = storage.HomeDirectoryStorage.from_path(my_project.parent / "my__other.toml")
+    with raises(error.MultipleNextFound):
+        storage.HomeDirectoryStorage.from_cwd()
+    other.drop()
+
+    # 3. create another storage, directly in HACENADA_HOME as older versions did; it's
+    # moved into the bucket and found there
+    normaled2 = Path(stored.name).stem + "2.json"
     (storage.HACENADA_HOME / f"{normaled2}").touch()
     with raises(error.MultipleNextFound):
         _ = storage.HomeDirectoryStorage.from_cwd()
+    assert not (storage.HACENADA_HOME / normaled2).exists()
+    assert (stored.parent / normaled2).exists()
+
+
+def test_sharded(my_project):
+    """
+    Are storages kept in one bucket per directory, and those in the flat layout moved
+    there?
+    """
+    assert storage.bucket(my_project.parent) == storage.bucket(my_project.parent)
+    assert storage.bucket(my_project.parent) != storage.bucket(my_project.parent.parent)
+    assert (
+        storage.bucket(my_project.parent).parent
+        == storage.HACENADA_HOME / storage.SESSIONS
+    )
+
+    # a session from an older version, with its summary
+    stor = storage.HomeDirectoryStorage.from_path(my_project)
+    stor.save_answer({"q1": "a1"})
+    stor.save_answer({"big": "output\n" * 1000})
+    stor.db.close()
+    stored = storage.session_path(my_project, ".json")
+    flat = storage.HACENADA_HOME / stored.name
+    stored.rename(flat)
+    storage.summary_path(stored).rename(storage.summary_path(flat))
+    blobs = storage.blob_store()
+    blobs.collect()
+    blobs.add_referrer(flat)
+
+    assert storage.stored_path(my_project) == stored
+    assert (
+        not flat.exists() and stored.exists() and storage.summary_path(stored).exists()
+    )
+    # its blobs are still referred to from where it is now
+    assert blobs.referrers() == [flat, stored]
+    assert blobs.collect(now=time.time() + blob.GRACE_SECONDS + 10).deleted == 0
+    assert (
+        storage.HomeDirectoryStorage.from_path(my_project).get_answer("q1")["value"]
+        == "a1"
+    )
+
+    # every storage at once, its bucket worked out from its name
+    stored.rename(flat)
+    assert storage.shard_sessions() == 1
+    assert storage.shard_sessions() == 0
+    assert stored.exists()
+
+    # dropped from the flat layout too
+    stored.rename(flat)
+    storage.HomeDirectoryStorage.drop_path(my_project)
+    assert not flat.exists() and not stored.exists()
+
+
+def test_sharded_underscores(my_project):
+    """
+    Is a flat storage moved to the right bucket when its script's path has "__" in it?
+    """
+    script_path = my_project.parent / "my__dir" / "the__script.toml"
+    stor = storage.HomeDirectoryStorage.from_path(script_path)
+    stor.db.close()
+    stored = storage.session_path(script_path, ".json")
+    assert storage.script_of(stored) == script_path
+    flat = storage.HACENADA_HOME / stored.name
+    stored.rename(flat)
+    assert storage.shard_sessions() == 1
+    assert storage.stored_path(script_path) == stored
+    assert storage.script_of(stored) == script_path
+
+    # made before the absolute path was recorded: the directory is spelled out from
+    # the name
+    legacy = storage.HomeDirectoryStorage._from_json_path(stored)
+    legacy.meta.update(delete("script"))
+    legacy.update_meta(script_path="the__script.toml")
+    legacy.db.close()
+    stored.rename(flat)
+    assert storage.shard_sessions() == 1
+    assert stored.exists()
+    assert (
+        storage.script_of(stored)
+        == my_project.parent / "my" / "dir" / "the__script.toml"
+    )
+    assert storage.script_of(stored, {}).name == "script"
+
+    # removed meanwhile: its name is all there is to go on, and it isn't made again
+    stored.unlink()
+    storage.summary_path(stored).unlink()
+    assert storage.script_of(stored).name == "script"
+    assert not stored.exists()
 
 
 def test_save_get_answer(storagie):
@@ -61,6 +169,124 @@ def test_save_get_answer(storagie):
     assert storagie.get_answer("q1") == storage.Answer(label="q1", value="a1", when=ANY)
 
 
+def test_skip_step(storagie):
+    """
+    Is a skipped step recorded as answered, with no value?
+    """
+    storagie.skip_step("message-1")
+    assert storagie.get_answer("message-1") == storage.Answer(
+        label="message-1", value=None, when=ANY, skipped=True
+    )
+
+    # a plain storage only has to record some answer for it
+    mem = storage.HomeDirectoryStorage.from_structured({})
+    abstract.SessionStorage.skip_step(mem, "q1")
+    assert mem.get_answer("q1") == storage.Answer(label="q1", value=None, when=ANY)
+
+
+def test_save_cached(storagie):
+    """
+    Is a remembered answer marked as cached?
+    """
+    storagie.save_cached("q1", "a1")
+    assert storagie.get_answer("q1") == storage.Answer(
+        label="q1", value="a1", when=ANY, cached=True
+    )
+    storagie.save_answer({"q1": "a2"})
+    assert "cached" not in storagie.get_answer("q1")
+
+    mem = storage.HomeDirectoryStorage.from_structured({})
+    abstract.SessionStorage.save_cached(mem, "q1", "a1")
+    assert mem.get_answer("q1") == storage.Answer(label="q1", value="a1", when=ANY)
+
+
+def test_one_write(storagie):
+    """
+    Is saving an answer one write of the storage, and is nothing written if it fails?
+    """
+    real = storagie.answer.storage
+    with patch.object(real, "write", wraps=real.write) as m_write:
+        storagie.save_answer({"q1": "a1"})
+        # nothing changed: nothing written
+        storagie.replace_structured(storagie.to_structured())
+    assert m_write.call_count == 1
+    revision = storagie.revision
+
+    with patch.object(storagie, "_replace", side_effect=OSError), raises(OSError):
+        storagie.save_answer({"q1": "a2"})
+    assert storagie.get_answer("q1")["value"] == "a1"
+    assert storagie.revision == revision
+    storagie.save_answer({"q2": "a2"})
+    assert [a["label"] for a in storagie.answer] == ["q1", "q2"]
+
+
+def test_replace_structured(storagie):
+    """
+    Are only changed answers written, and large ones kept as blobs?
+    """
+    storagie.save_answer({"q1": "a1"})
+    storagie.save_answer({"gone": "x"})
+    memory = storage.HomeDirectoryStorage.from_structured(storagie.to_structured())
+    memory.forget_answer("gone")
+    memory.save_answer({"big": "output\n" * 1000})
+    memory.description = "replaced"
+
+    storagie.replace_structured(memory.to_structured())
+    assert [a["label"] for a in storagie.answer] == ["q1", "big"]
+    assert storagie.answer.all()[1]["value"]["blob"]
+    assert storagie.get_answer("big")["value"] == "output\n" * 1000
+    assert storagie.description == "replaced"
+
+
+def test_lock(storagie):
+    """
+    Does the lock keep out another hacenada, and find a session migrated while waiting?
+    """
+    with storagie.lock():
+        with raises(error.StorageBusy, match="in use by another hacenada"):
+            with patch.object(storage, "LOCK_POLL", 0.01):
+                storage.locked(storagie.path, timeout=0.03).__enter__()
+    with storage.locked(storagie.path):
+        pass
+
+    storagie.save_answer({"q1": "a1"})
+    data = storagie.to_structured()
+    compact = storagie.path.with_suffix(".hcnb")
+    storage.HomeDirectoryStorage.from_structured(data, compact).db.close()
+    storagie.path.unlink()
+    with storagie.lock():
+        assert storagie.path == compact
+        assert storagie.get_answer("q1")["value"] == "a1"
+
+    with storage.HomeDirectoryStorage.from_structured({}).lock():
+        pass
+    with abstract.SessionStorage.lock(storagie):
+        pass
+
+
+def test_move_answers(storagie):
+    """
+    Can I forget answers, and swap answers between labels?
+    """
+    storagie.save_answer({"a": 1})
+    storagie.save_answer({"b": 2})
+    storagie.save_answer({"c": 3})
+    storagie.forget_answer("c")
+    storagie.relabel_answers({"a": "b", "b": "a"})
+    assert [(a["label"], a["value"]) for a in storagie.answer] == [("b", 1), ("a", 2)]
+
+    assert storagie.step_digests == {}
+    storagie.step_digests = {"a": "1234"}
+    assert storagie.step_digests == {"a": "1234"}
+
+    # a plain storage doesn't have to keep track
+    abstract.SessionStorage.forget_answer(storagie, "a")
+    abstract.SessionStorage.relabel_answers(storagie, {"a": "b"})
+    abstract.SessionStorage.step_digests.fset(storagie, {})
+    assert abstract.SessionStorage.step_digests.fget(storagie) == {}
+    assert len(storagie.answer) == 2
+
+
 def test_save_get_meta(storagie):
     """
     Can I save and retrieve properties from meta?
@@ -73,6 +299,77 @@ def test_save_get_meta(storagie):
     assert storagie.script_path == Path("oh/no")
 
 
+def test_revision(storagie):
+    """
+    Does every change to the session count one revision?
+    """
+    before = storagie.revision
+    storagie.save_answer({"q1": "a1"})
+    storagie.skip_step("q2")
+    storagie.relabel_answers({"q2": "q3"})
+    storagie.forget_answer("q3")
+    storagie.description = "changed"
+    storagie.description = "changed"
+    assert storagie.revision == before + 5
+
+
+@mark.parametrize("encoding", list(storage.ENCODINGS))
+def test_checkpoint_undo(my_project, encoding):
+    """
+    Does undo put the answers back as they were at each checkpoint, as far back as
+    they are kept?
+    """
+    store = storage.HomeDirectoryStorage.from_path(my_project, encoding=encoding)
+    assert store.undo() is None
+    store.save_answer({"q1": "first"})
+    store.description = "first"
+    store.checkpoint()
+    store.checkpoint()
+    store.save_answer({"q1": "typo"})
+    store.save_answer({"q1": "typo again"})
+    store.skip_step("q2")
+    store.relabel_answers({"q2": "q3"})
+    store.description = "typo"
+    store.description = "typo"
+    store.checkpoint()
+    store.forget_answer("q1")
+    # only the first answer of each label since the checkpoint is kept
+    assert [len(r["before"]) for r in store.checkpoints] == [1, 3, 1]
+
+    assert store.undo() == ["q1"]
+    assert store.get_answer("q1")["value"] == "typo again"
+    before = store.revision
+    assert store.undo() == ["q1", "q2", "q3"]
+    assert store.revision == before + 1
+    assert [a["label"] for a in store.answer] == ["q1"]
+    assert store.get_answer("q1")["value"] == "first"
+    assert store.description == "first"
+    assert isinstance(store.get_answer("q1")["when"], datetime.datetime)
+
+    store.db.close()
+    store = storage.HomeDirectoryStorage.from_path(my_project)
+    assert store.undo() == ["q1"]
+    assert store.undo() is None
+    assert len(store.answer) == 0
+    assert "description" not in store.meta.all()[0]
+    assert abstract.SessionStorage.undo(store) is None
+
+    with patch.object(storage, "CHECKPOINTS", 2):
+        for n in range(4):
+            store.save_answer({f"q{n}": n})
+            store.checkpoint()
+    assert [list(r["before"]) for r in store.checkpoints] == [["q2"], ["q3"]]
+
+
+def test_stored_path(my_project):
+    """
+    Is a session's storage found without opening it, and only once there is one?
+    """
+    assert storage.stored_path(my_project) is None
+    store = storage.HomeDirectoryStorage.from_path(my_project, encoding="compact")
+    assert storage.stored_path(my_project) == store.path
+
+
 def test_to_structured(storagie):
     storagie.save_answer({"q1": "a1"})
     storagie.save_answer({"q2": "a 2"})
@@ -86,7 +383,14 @@ def test_to_structured(storagie):
         meta=dict(
             description="hello there",
             script_path=str(storagie.script_path),
+            script=str(storagie.script_path),
+            revision=4,
         ),
+        checkpoint=[
+            dict(
+                before=dict(q1=None, q2=None), meta=dict(description=None), sealed=False
+            )
+        ],
     )
 
 
@@ -102,8 +406,90 @@ def test_drop_path(my_project, storagie):
     assert len(storagie.answer) == 2
     assert storagie.description
 
+    assert storage.summary_path(storagie.path).exists()
+    # the bucket is kept while another script's session is in it
+    other = storage.HomeDirectoryStorage.from_path(my_project.parent / "other.toml")
+    assert other.path.parent == storagie.path.parent
     storage.HomeDirectoryStorage.drop_path(my_project)
+    assert not storage.summary_path(storagie.path).exists()
+    assert not storage.lock_path(storagie.path).exists()
+    assert storagie.path.parent.exists()
+    other.db.close()
+    storage.HomeDirectoryStorage.drop_path(my_project.parent / "other.toml")
+    assert not storagie.path.parent.exists()
     store2 = storage.HomeDirectoryStorage.from_path(my_project)
 
     assert len(store2.answer) == 0
     assert not store2.description
+
+    # a finished session drops itself, holding the lock already
+    complete.remember(storage.HACENADA_HOME, my_project, ["q1"])
+    with store2.lock():
+        store2.drop()
+    assert not store2.path.exists()
+    assert not storage.summary_path(store2.path).exists()
+    assert not store2.path.parent.exists()
+    assert not storage.lock_path(store2.path).exists()
+    assert complete.load(storage.HACENADA_HOME) == {}
+    storage.HomeDirectoryStorage.from_structured({}).drop()
+
+
+def test_encoding(my_project):
+    """
+    Do I create, find and refuse to re-encode storage in each encoding?
+    """
+    compact = storage.HomeDirectoryStorage.from_path(my_project, encoding="compact")
+    compact.save_answer({"q1": "a1"})
+    assert compact.encoding == "compact"
+    assert compact.path.suffix == ".hcnb"
+
+    # an existing storage is found without naming its encoding
+    found = storage.HomeDirectoryStorage.from_path(my_project)
+    assert found.encoding == "compact"
+    assert found.get_answer("q1")["value"] == "a1"
+    assert storage.HomeDirectoryStorage.from_cwd().encoding == "compact"
+
+    with raises(error.StorageError, match="already compact-encoded"):
+        storage.HomeDirectoryStorage.from_path(my_project, encoding="json")
+
+    # after dropping, a different encoding may be chosen
+    storage.HomeDirectoryStorage.drop_path(my_project)
+    store = storage.HomeDirectoryStorage.from_path(my_project, encoding="json")
+    assert store.encoding == "json"
+    assert len(store.answer) == 0
+
+
+def test_from_structured(storagie):
+    """
+    Can I build an in-memory storage from structured data?
+    """
+    storagie.save_answer({"q1": "a1"})
+    storagie.description = "hello there"
+
+    mem = storage.HomeDirectoryStorage.from_structured(storagie.to_structured())
+    assert mem.path is None
+    assert mem.encoding == "json"
+    assert mem.to_structured() == storagie.to_structured()
+    assert mem.get_answer("q1") == storagie.get_answer("q1")
+    assert abstract.SessionStorage.encoding.fget(mem) == "json"
+
+
+def test_large_answers(storagie, my_project):
+    """
+    Are large answers kept in the blob store, and referenced from storage?
+    """
+    big = "captured output\n" * 1000
+    storagie.save_answer({"q1": big})
+    storagie.save_answer({"q2": "small"})
+
+    raw = storagie.answer.all()
+    assert blob.is_ref(raw[0]["value"])
+    assert raw[1]["value"] == "small"
+    assert big not in storagie.path.read_text()
+    assert storagie.get_answer("q1")["value"] == big
+    assert storage.blob_store().referrers() == [storagie.path]
+
+    # in-memory storage keeps values inline
+    mem = storage.HomeDirectoryStorage.from_structured({})
+    mem.save_answer({"q1": big})
+    assert mem.answer.all()[0]["value"] == big
@@ -0,0 +1,111 @@
+"""
+Test wait steps, which poll a check command
+"""
+import time
+from unittest.mock import MagicMock, patch
+
+from hacenada import wait
+
+
+def waiting(label, check, **kw):
+    """
+    A wait step
+    """
+    return dict(
+        type="wait",
+        message=f"wait for {label}",
+        label=label,
+        stop=True,
+        check=check,
+        **kw,
+    )
+
+
+def test_poll_backoff(tmp_path):
+    """
+    Do I check again, less often each time, until the check succeeds?
+    """
+    counter = tmp_path / "n"
+    check = (
+        f"n=$(cat {counter} 2>/dev/null || echo 0); n=$((n+1)); echo $n > {counter}; "
+        "echo try $n; [ $n = 4 ]"
+    )
+    report = MagicMock()
+    with patch.object(wait, "MAX_INTERVAL", 0.03):
+        (result,) = wait.wait_for([waiting("cert", check, interval=0.01)], report)
+    assert (result.ok, result.attempts, result.output) == (True, 4, "try 4\n")
+    assert [c[0][1:] for c in report.call_args_list] == [
+        (1, 0.01),
+        (1, 0.02),
+        (1, 0.03),
+    ]
+    assert result.to_answer() == dict(
+        ok=True, attempts=4, elapsed=round(result.elapsed, 1), output="try 4\n"
+    )
+
+
+def test_poll_timeout():
+    """
+    Do I give up when the timeout passes, even in the middle of a check?
+    """
+    (result,) = wait.wait_for([waiting("slow", "sleep 5", timeout=0.2)])
+    assert (result.ok, result.attempts) == (False, 1)
+    assert result.elapsed < 1
+
+    report = MagicMock()
+    (result,) = wait.wait_for(
+        [waiting("never", "exit 3", timeout=0.1, interval=0.04)], report
+    )
+    assert not result.ok
+    assert result.attempts >= 2
+    assert report.call_args_list[0][0][1:] == (3, 0.04)
+
+
+def test_finished_at_timeout():
+    """
+    Is a check that finishes just as time runs out still treated as out of time?
+    """
+    with patch.object(wait.os, "killpg", side_effect=ProcessLookupError):
+        (result,) = wait.wait_for([waiting("slow", "sleep 0.2", timeout=0.05)])
+    assert (result.ok, result.attempts) == (False, 1)
+
+
+def test_concurrent():
+    """
+    Are several waits polled at the same time?
+    """
+    started = time.monotonic()
+    results = wait.wait_for([waiting("a", "sleep 0.3"), waiting("b", "sleep 0.3")])
+    assert time.monotonic() - started < 0.55
+    assert [(r.label, r.ok) for r in results] == [("a", True), ("b", True)]
+
+
+def test_render_waits(capsys):
+    """
+    Are wait steps shown, and their progress and outcome reported?
+    """
+    context = MagicMock()
+    context.options.quiet = False
+    steps = [waiting("ok", "true"), waiting("bad", "false", timeout=0.05, interval=1)]
+    answers = wait.render_waits(steps, context)
+    assert answers["ok"]["ok"] and not answers["bad"]["ok"]
+    out = capsys.readouterr().out
+    assert "ok: wait for ok\n>> waiting for: true\n" in out
+    assert "[bad] check 1 exited 1; checking again in 0s\n" in out
+    assert "[ok] succeeded after 1 check, 0.0s\n" in out
+    assert "[bad] timed out after 2 checks" in out
+
+    context.options.quiet = True
+    wait.render_waits([waiting("ok", "true")], context)
+    assert capsys.readouterr().out == ""
+
+
+def test_describe(capsys):
+    assert (
+        wait.describe(dict(ok=False, attempts=1, elapsed=600.2))
+        == "timed out after 1 check, 600.2s"
+    )
+    wait._print_report(wait.WaitResult("x", attempts=2), None, 4)
+    assert (
+        capsys.readouterr().out == "[x] check 2 ran out of time; checking again in 4s\n"
+    )
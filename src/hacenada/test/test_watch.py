@@ -0,0 +1,120 @@
+"""
+Test noticing changes to script files
+"""
+import ctypes
+import ctypes.util
+import threading
+from unittest.mock import Mock, patch
+
+from hacenada import watch
+
+
+def test_signature(tmp_path):
+    """
+    Do I tell written files apart, and notice missing ones?
+    """
+    path = tmp_path / "x.toml"
+    assert watch.signature(path) is None
+    path.write_text("a")
+    before = watch.signature(path)
+    path.write_text("ab")
+    assert watch.signature(path) != before
+
+
+def test_changes_polling(tmp_path):
+    """
+    Without inotify, do I poll, and yield only when the file really changed?
+    """
+    path = tmp_path / "x.toml"
+    path.write_text("a")
+    writes = iter(["a", None, "abc"])
+
+    def _sleep(_):
+        content = next(writes)
+        if content is None:
+            path.unlink()
+        else:
+            path.write_text(content)
+            # same content, same size; only the mtime can tell, so pin it
+            if content == "a":
+                path.touch()
+
+    with patch.object(watch, "_inotify", return_value=None), patch.object(
+        watch.time, "sleep", side_effect=_sleep
+    ):
+        changes = watch.changes([path], interval=0)
+        next(changes)
+        assert path.read_text() == "a"
+        next(changes)
+        assert path.read_text() == "abc"
+
+
+def test_changes_inotify(tmp_path):
+    """
+    Do I wake up when the file is written, or replaced by another file?
+    """
+    path = tmp_path / "x.toml"
+    path.write_text("a")
+    (tmp_path / "unrelated").write_text("")
+    changes = watch.changes([path])
+
+    def _edit():
+        (tmp_path / "unrelated").write_text("b")
+        (tmp_path / "new").write_text("replacement")
+        (tmp_path / "new").replace(path)
+
+    threading.Timer(0.1, _edit).start()
+    next(changes)
+    assert path.read_text() == "replacement"
+    changes.close()
+
+
+def test_inotify_unavailable(tmp_path):
+    """
+    Do I fall back when inotify can't be used?
+    """
+    with patch.object(ctypes, "CDLL", side_effect=OSError):
+        assert watch._inotify([tmp_path / "x"]) is None
+
+    libc = Mock(**{"inotify_init1.return_value": -1})
+    with patch.object(ctypes, "CDLL", return_value=libc):
+        assert watch._inotify([tmp_path / "x"]) is None
+
+    libc = Mock(
+        **{"inotify_init1.return_value": 99, "inotify_add_watch.return_value": -1}
+    )
+    with patch.object(ctypes, "CDLL", return_value=libc), patch.object(
+        ctypes.util, "find_library", return_value="libc.so.6"
+    ), patch.object(watch.os, "close") as m_close:
+        assert watch._inotify([tmp_path / "x"]) is None
+    m_close.assert_called_once_with(99)
+
+
+def test_changes_several(tmp_path):
+    """
+    Do I notice changes to any of the files, including ones added to paths after a
+    change?
+    """
+    (tmp_path / "sub").mkdir()
+    first, second, third = (
+        tmp_path / "a.toml",
+        tmp_path / "sub" / "b.toml",
+        tmp_path / "sub" / "c.toml",
+    )
+    for path in (first, second, third):
+        path.write_text("a")
+    paths = [first]
+    changes = watch.changes(paths)
+
+    threading.Timer(0.1, first.write_text, ["ab"]).start()
+    next(changes)
+    paths.append(second)
+
+    def _edit():
+        third.write_text("ab")
+        second.write_text("ab")
+
+    threading.Timer(0.1, _edit).start()
+    next(changes)
+    assert second.read_text() == "ab"
+    changes.close()
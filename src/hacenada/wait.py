@@ -0,0 +1,173 @@
+"""
+Wait steps: poll a check command until it succeeds, backing off between checks
+
+A wait step's `check` is a shell command. It is run at once, then again after
+`interval` seconds, then after twice as long each time (up to MAX_INTERVAL),
+until it exits 0 or `timeout` seconds have passed. Wait steps reached together
+(all but the last with `stop = false`) are polled at the same time, by one
+asyncio event loop.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import signal
+import time
+import typing
+
+import attr
+
+from hacenada.const import STR_DICT
+from hacenada.script import Step
+
+
+DEFAULT_INTERVAL = 5.0
+DEFAULT_TIMEOUT = 600.0
+
+# how much longer to wait after each failed check, and the longest wait
+BACKOFF = 2.0
+MAX_INTERVAL = 60.0
+
+# how much of the check's output (its end) to keep in the answer
+MAX_OUTPUT = 1024
+
+Report = typing.Callable[["WaitResult", typing.Optional[int], float], None]
+
+
+@attr.s(auto_attribs=True)
+class WaitResult:
+    """
+    How polling a wait step's check went
+    """
+
+    label: str
+    ok: bool = False
+    attempts: int = 0
+    elapsed: float = 0.0
+    output: str = ""
+
+    def to_answer(self) -> STR_DICT:
+        """
+        The answer recorded for the step
+        """
+        return dict(
+            ok=self.ok,
+            attempts=self.attempts,
+            elapsed=round(self.elapsed, 1),
+            output=self.output,
+        )
+
+
+def describe(answer: typing.Any) -> str:
+    """
+    A wait step's answer, for people
+    """
+    tries = "1 check" if answer["attempts"] == 1 else f"{answer['attempts']} checks"
+    outcome = "succeeded" if answer["ok"] else "timed out"
+    return f"{outcome} after {tries}, {answer['elapsed']}s"
+
+
+async def run_check(
+    command: str, timeout: float
+) -> typing.Tuple[typing.Optional[int], str]:
+    """
+    Run command in a shell, returning its exit status (None if it ran out of time) and
+    output
+    """
+    proc = await asyncio.create_subprocess_shell(
+        command,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.STDOUT,
+        start_new_session=True,
+    )
+    try:
+        out, _ = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        # the whole process group, so commands the shell started don't hold the pipe
+        # open
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+        except ProcessLookupError:  # it finished just as time ran out
+            pass
+        await proc.wait()
+        return None, ""
+    return proc.returncode, out.decode("utf-8", errors="replace")
+
+
+async def poll(step: Step, report: typing.Optional[Report] = None) -> WaitResult:
+    """
+    Run the step's check until it succeeds or times out
+
+    After each failed check, report is told the result so far, the exit status
+    and how long until the next check.
+    """
+    timeout = step.get("timeout", DEFAULT_TIMEOUT)
+    delay = step.get("interval", DEFAULT_INTERVAL)
+    result = WaitResult(label=step["label"])
+    started = time.monotonic()
+    while True:
+        remaining = timeout - (time.monotonic() - started)
+        returncode, output = await run_check(step["check"], max(remaining, 0.0))
+        result.attempts += 1
+        result.elapsed = time.monotonic() - started
+        result.output = output[-MAX_OUTPUT:]
+        if returncode == 0:
+            result.ok = True
+            return result
+
+        remaining = timeout - result.elapsed
+        if remaining <= 0:
+            return result
+        pause = min(delay, remaining)
+        if report:
+            report(result, returncode, pause)
+        await asyncio.sleep(pause)
+        delay = min(delay * BACKOFF, MAX_INTERVAL)
+
+
+async def poll_all(
+    steps: typing.Sequence[Step], report: typing.Optional[Report] = None
+) -> typing.List[WaitResult]:
+    """
+    Poll the checks of steps all at once, until each succeeds or times out
+    """
+    return list(await asyncio.gather(*(poll(step, report) for step in steps)))
+
+
+def wait_for(
+    steps: typing.Sequence[Step], report: typing.Optional[Report] = None
+) -> typing.List[WaitResult]:
+    """
+    Poll the checks of steps all at once, in a new event loop
+    """
+    return asyncio.run(poll_all(steps, report))
+
+
+async def answer_waits(steps: typing.Sequence[Step]) -> STR_DICT:
+    """
+    Poll the checks of steps all at once, in the running event loop, giving their
+    answers by label
+    """
+    return {result.label: result.to_answer() for result in await poll_all(steps)}
+
+
+def _print_report(result: WaitResult, returncode: typing.Optional[int], pause: float):
+    status = "ran out of time" if returncode is None else f"exited {returncode}"
+    again = f"checking again in {pause:.0f}s"
+    print(f"[{result.label}] check {result.attempts} {status}; {again}")
+
+
+def render_waits(steps: typing.Sequence[Step], context) -> STR_DICT:
+    """
+    Show wait steps, poll their checks, and give their answers by label
+    """
+    quiet = context.options.quiet
+    if not quiet:
+        for step in steps:
+            message = step["message"].strip()
+            print(f"{step['label']}: {message}\n>> waiting for: {step['check']}")
+    results = wait_for(steps, None if quiet else _print_report)
+    if not quiet:
+        for result in results:
+            print(f"[{result.label}] {describe(result.to_answer())}")
+    return {result.label: result.to_answer() for result in results}
@@ -0,0 +1,118 @@
+"""
+Notice when a script file, or a fragment it includes, changes
+
+On Linux the directories holding the files are watched with inotify, so a change is
+noticed as soon as a file is written (or replaced, as many editors do).
+Elsewhere the files are polled.
+"""
+from __future__ import annotations
+
+import os
+from pathlib import Path
+import struct
+import time
+import typing
+
+
+# seconds between checks when polling
+POLL_INTERVAL = 0.5
+
+# inotify(7) events that mean a file in the directory was written or replaced
+IN_CLOSE_WRITE = 0x8
+IN_MOVED_TO = 0x80
+IN_CREATE = 0x100
+_EVENT = struct.Struct("iIII")
+
+
+def signature(path: Path) -> typing.Optional[typing.Tuple[int, int, int]]:
+    """
+    What changes about a file when it is written, or None if it doesn't exist
+    """
+    try:
+        st = path.stat()
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+
+def _poll(interval: float) -> typing.Generator[None, None, None]:
+    while True:
+        time.sleep(interval)
+        yield
+
+
+def _inotify(
+    paths: typing.List[Path],
+) -> typing.Optional[typing.Generator[None, None, None]]:
+    """
+    Events for paths from inotify, or None if inotify isn't available
+    """
+    import ctypes
+    import ctypes.util
+
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        fd = libc.inotify_init1(os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+
+    mask = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+    for directory in sorted({path.parent for path in paths}):
+        if libc.inotify_add_watch(fd, os.fsencode(directory), mask) < 0:
+            os.close(fd)
+            return None
+    return _read_events(fd, {os.fsencode(path.name) for path in paths})
+
+
+def _read_events(
+    fd: int, names: typing.Set[bytes]
+) -> typing.Generator[None, None, None]:
+    """
+    Yield whenever a batch of inotify events on fd mentions one of the file names
+    """
+    try:
+        while True:
+            buf = os.read(fd, 64 * 1024)
+            pos = 0
+            seen = set()
+            while pos < len(buf):
+                length = _EVENT.unpack_from(buf, pos)[3]
+                start = pos + _EVENT.size
+                pos = start + length
+                seen.add(buf[start:pos].rstrip(b"\0"))
+            if names & seen:
+                yield
+    finally:
+        os.close(fd)
+
+
+def changes(
+    paths: typing.List[Path], interval: float = POLL_INTERVAL
+) -> typing.Iterator[None]:
+    """
+    Yield each time one of the files in paths changes, for as long as the caller
+    iterates
+
+    A change is a new modification time, size or inode; touching a file
+    counts, but reading it does not. paths is looked at again after each
+    change, so the caller may update it in place (as when a script's includes
+    change).
+    """
+    last: typing.Dict[Path, typing.Optional[typing.Tuple[int, int, int]]] = {}
+    while True:
+        watched = [Path(path).absolute() for path in paths]
+        last = {
+            path: last[path] if path in last else signature(path) for path in watched
+        }
+        events = _inotify(watched) or _poll(interval)
+        for _ in events:
+            current = {path: signature(path) for path in watched}
+            if any(
+                sig is not None and sig != last[path] for path, sig in current.items()
+            ):
+                break
+        events.close()
+        last = current
+        yield